@@ -5,20 +5,20 @@ do_clean() {
 }
 
 do_build() {
-    mkdir -p html pdf spool
+    mkdir -p pdf spool
 
-    (cd html && ecromedos -f xhtml ../src/manual.xml)
-    (cd spool && ecromedos -f xelatex ../src/manual.xml)
+    ecromedos -f xhtml,xelatex -o spool src/manual.xml
+    mv spool/xhtml html
 
     (
-        cd spool
+        cd spool/xelatex
         for i in $(seq 1 3); do
             xelatex main.tex
         done
     )
 
-    cp spool/main.pdf pdf/user-manual.pdf
-    cp spool/main.pdf html/user-manual.pdf
+    cp spool/xelatex/main.pdf pdf/user-manual.pdf
+    cp spool/xelatex/main.pdf html/user-manual.pdf
 }
 
 case "$1" in
@@ -1,4 +1,4 @@
-from argparse import ArgumentParser, BooleanOptionalAction, RawTextHelpFormatter
+from argparse import ArgumentParser, ArgumentTypeError, BooleanOptionalAction, RawTextHelpFormatter
 from enum import StrEnum, auto
 from importlib.resources import files
 from pathlib import Path
@@ -22,13 +22,32 @@ class GeneratorType(StrEnum):
     XELATEX = auto()
 
 
+def generator_types(value):
+    """Parse a comma-separated list of output formats."""
+
+    formats = []
+    for name in value.split(","):
+        try:
+            generator_type = GeneratorType(name.strip())
+        except ValueError:
+            choices = ", ".join(GeneratorType)
+            raise ArgumentTypeError(f"invalid format '{name.strip()}' (choose from {choices})")
+        if generator_type not in formats:
+            formats.append(generator_type)
+    return formats
+
+
 class ECMDSArgumentParser(ArgumentParser):
     _VERSION_STRING = f"%(prog)s, version {VERSION}\nCopyright (C) 2005-2016, Tobias Koch <tobias@tobijk.de>"
 
     def __init__(self, *args, **kwargs):
         super().__init__(formatter_class=RawTextHelpFormatter, prog="ecromedos Document Processor", *args, **kwargs)
         self.add_argument(
-            "source_file", type=Path, metavar="source-file", help="Source file for the document generation."
+            "source_file",
+            type=Path,
+            nargs="?",
+            metavar="source-file",
+            help="Source file for the document generation.",
         )
         self.add_argument("-v", "--version", action="version", version=self._VERSION_STRING)
         self.add_argument(
@@ -47,9 +66,11 @@ class ECMDSArgumentParser(ArgumentParser):
         self.add_argument(
             "-f",
             "--format",
-            type=GeneratorType,
-            choices=GeneratorType,
-            help="Generate the specified output format.",
+            type=generator_types,
+            metavar="{" + ",".join(GeneratorType) + "}",
+            help="Generate the specified output format. Several formats can be given\n"
+            "as a comma-separated list, the document is then parsed only once and\n"
+            "each format is written to its own subdirectory of --output-dir.",
         )
         self.add_argument(
             "-n",
@@ -73,3 +94,74 @@ class ECMDSArgumentParser(ArgumentParser):
             "--hyperref", action=BooleanOptionalAction, default=True, help="Enable/disable active links in PDF output."
         )
         self.add_argument("--validate", action=BooleanOptionalAction, help="Enable/disable validation of the document.")
+        self.add_argument(
+            "--incremental",
+            action=BooleanOptionalAction,
+            help="Only rewrite output files that changed and reuse expensive plugin\n"
+            "results from the previous build in the output directory.",
+        )
+        self.add_argument(
+            "--validation-cache",
+            action=BooleanOptionalAction,
+            help="Skip validating documents, which already passed validation in an\n"
+            "earlier run with identical content.",
+        )
+        self.add_argument(
+            "--math-cache",
+            action=BooleanOptionalAction,
+            help="Enable/disable reusing bitmaps of formulae rendered in earlier runs.",
+        )
+        self.add_argument(
+            "--serve",
+            type=Path,
+            metavar="SOCKET",
+            help="Run as render server listening on the given Unix socket, keeping\n"
+            "stylesheets and plugins loaded between documents.",
+        )
+        self.add_argument(
+            "--server",
+            type=Path,
+            metavar="SOCKET",
+            help="Hand the document to the render server listening on the given Unix socket.\n"
+            "Without a server, the document is rendered by this process.",
+        )
+        self.add_argument(
+            "-B",
+            "--batch",
+            action="append",
+            metavar="PATTERN",
+            help="Render many documents in one go. Takes a file name, a glob pattern or\n"
+            "@manifest (a file listing one source per line), may be given repeatedly.",
+        )
+        self.add_argument(
+            "-o",
+            "--output-dir",
+            type=Path,
+            default=Path("."),
+            help="Base directory for batch and multi-format output, each document or\n"
+            "format gets its own subdirectory. Output directory in watch mode.",
+        )
+        self.add_argument("-j", "--jobs", type=int, help="Number of worker processes in batch mode.")
+        self.add_argument(
+            "--metrics",
+            type=Path,
+            metavar="FILE",
+            help="Write wall clock and CPU time, peak memory usage and node counts per\n"
+            "processing phase to FILE as JSON.",
+        )
+        self.add_argument(
+            "--profile-plugins",
+            type=int,
+            nargs="?",
+            const=10,
+            metavar="N",
+            help="Measure the time spent in each plugin and print a table at the end,\n"
+            "listing the N (default 10) slowest nodes with their source lines.",
+        )
+        self.add_argument(
+            "-w",
+            "--watch",
+            action="store_true",
+            help="Keep running and render the document again whenever it, one of its\n"
+            "includes or images, the configuration or the stylesheets change.",
+        )
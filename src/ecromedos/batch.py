@@ -0,0 +1,189 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from ecromedos.error import ECMDSError
+from ecromedos.pipeline import ECMDSPipeline
+
+# pipeline of the current worker process
+_worker_pipeline = None
+_worker_error = None
+
+
+def expand_sources(patterns):
+    """Turn a list of file names, glob patterns and @manifest files into a
+    list of source files. Manifests contain one file name or pattern per
+    line, relative to the manifest's location. Finding no files at all is an
+    error."""
+
+    sources = []
+
+    def add(pattern, base_dir=None):
+        if base_dir is not None and not os.path.isabs(pattern):
+            pattern = os.path.join(base_dir, pattern)
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches = [pattern]
+        for match in matches:
+            path = Path(match).absolute()
+            if path not in sources:
+                sources.append(path)
+
+    for pattern in patterns:
+        pattern = str(pattern)
+        if pattern.startswith("@"):
+            manifest = Path(pattern[1:])
+            try:
+                with open(manifest, "rt", encoding="utf-8") as fp:
+                    for line in fp:
+                        line = line.strip()
+                        if line and not line.startswith("#"):
+                            add(line, base_dir=manifest.absolute().parent)
+            except IOError:
+                raise ECMDSError(f"Could not read batch manifest {manifest}.")
+        else:
+            add(pattern)
+
+    if not sources:
+        raise ECMDSError(f"No documents match {', '.join(str(pattern) for pattern in patterns)}.")
+
+    return sources
+
+
+def output_dirs_for(sources, output_root):
+    """Assign each source file its own output directory below @output_root,
+    mirroring the directory layout of the sources."""
+
+    output_root = Path(output_root).absolute()
+
+    if len(sources) == 1:
+        return [output_root / sources[0].stem]
+
+    common = Path(os.path.commonpath([source.parent for source in sources]))
+    return [output_root / source.relative_to(common).with_suffix("") for source in sources]
+
+
+def _init_worker(config_file_path, target_format, validation_enabled, tmp_root, options):
+    """Build the pipeline once per worker process."""
+
+    global _worker_pipeline, _worker_error
+
+    try:
+        _worker_pipeline = ECMDSPipeline(
+            config_file_path=config_file_path,
+            target_format=target_format,
+            validation_enabled=validation_enabled,
+            tmp_dir=tempfile.mkdtemp(prefix="ecmds-", dir=tmp_root),
+            options=options,
+        )
+    except ECMDSError as e:
+        _worker_error = e.msg()
+
+
+def _render_document(source_file, output_dir, xsl_parameters):
+    """Render a single document in a worker process and report the outcome."""
+
+    result = {"source_file": str(source_file), "output_dir": str(output_dir), "status": "ok", "message": ""}
+    start = time.perf_counter()
+
+    try:
+        if _worker_error:
+            raise ECMDSError(_worker_error)
+        if not source_file.is_file():
+            raise ECMDSError(f"{source_file} doesn't exist or is not a file.")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        _worker_pipeline.render(source_file, output_dir=output_dir, xsl_parameters=xsl_parameters, verbose=False)
+        result["metrics"] = _worker_pipeline.metrics.as_dict()
+    except ECMDSError as e:
+        result.update(status="error", message=e.msg())
+    except Exception as e:
+        result.update(status="error", message=f"Unexpected error: {e}")
+
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def render_batch(
+    sources,
+    output_root,
+    config_file_path,
+    target_format=None,
+    validation_enabled=None,
+    xsl_parameters=None,
+    options=None,
+    jobs=None,
+    callback=None,
+):
+    """Render all @sources in a pool of @jobs worker processes, each document
+    into its own directory below @output_root. A failing document does not
+    stop the batch. Returns one result per document, in input order, with
+    the fields source_file, output_dir, status, message and elapsed, and for
+    documents that were rendered successfully, metrics."""
+
+    sources = [Path(source).absolute() for source in sources]
+    if not sources:
+        return []
+
+    output_dirs = output_dirs_for(sources, output_root)
+    jobs = min(jobs or os.cpu_count() or 1, len(sources))
+    results = [None] * len(sources)
+
+    # the worker pools of the plugins share the CPUs with the other documents
+    options = {**(options or {}), "concurrent_jobs": str(jobs)}
+
+    with tempfile.TemporaryDirectory(prefix="ecmds-") as tmp_root:
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(config_file_path, target_format, validation_enabled, tmp_root, options),
+        ) as executor:
+            futures = {
+                executor.submit(_render_document, source, output_dir, xsl_parameters or {}): index
+                for index, (source, output_dir) in enumerate(zip(sources, output_dirs))
+            }
+
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        "source_file": str(sources[index]),
+                        "output_dir": str(output_dirs[index]),
+                        "status": "error",
+                        "message": f"Worker process failed: {e}",
+                        "elapsed": 0.0,
+                    }
+                results[index] = result
+                if callback:
+                    callback(result)
+
+    return results
+
+
+def print_summary(results, wall_time):
+    """Print a per-document status and timing table."""
+
+    width = max([len(r["source_file"]) for r in results] + [8])
+    failed = [r for r in results if r["status"] != "ok"]
+
+    print(f"\n {'Document':<{width}}  {'Status':<6}  {'Time':>8}")
+    for r in results:
+        print(f" {r['source_file']:<{width}}  {r['status']:<6}  {r['elapsed']:>7.2f}s")
+
+    total = sum(r["elapsed"] for r in results)
+    print(f"\n {len(results) - len(failed)} of {len(results)} documents rendered, ", end="")
+    print(f"{total:.2f}s of work in {wall_time:.2f}s wall time.")
+
+    for r in failed:
+        print(f"\n {r['source_file']}:\n  {r['message']}", file=sys.stderr)
@@ -0,0 +1,157 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import hashlib
+import os
+from pathlib import Path
+import re
+import shutil
+import threading
+import time
+
+from ecromedos.error import ECMDSError
+
+# default limit for the size of a cache
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def parse_size(value):
+    """Turn a size like 512K, 64M or 1G into a number of bytes."""
+
+    if isinstance(value, int):
+        return value
+
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ECMDSError(f"Invalid size '{value}', expected a number optionally followed by K, M or G.")
+
+    number, unit = match.groups()
+    return int(number) * 1024 ** " KMG".index(unit.upper() or " ")
+
+
+class ECMDSDiskCache:
+    """Stores results of expensive operations in @cache_dir, so that they
+    survive between runs and are shared by all documents.
+
+    Entries are addressed by the SHA-256 digest of a namespace and a key,
+    which must capture everything that influences the result. get() and
+    put() work like those of the incremental build cache, so plugins can
+    treat both alike.
+
+    Reading an entry marks it as recently used. When the cache grows beyond
+    @max_size bytes, the least recently used entries are removed until it is
+    below 90% of the limit.
+
+    Several processes and threads may use the same cache at once. Entries
+    are written atomically and an entry that disappears is simply a miss."""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self._cache_dir = Path(cache_dir)
+        self._max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        """Return the data stored under @namespace and @key or None."""
+
+        entry_path = self._entry_path(namespace, key)
+        try:
+            data = entry_path.read_bytes()
+        except OSError:
+            return None
+
+        self._touch(entry_path)
+        return data
+
+    def put(self, namespace, key, data):
+        """Store @data under @namespace and @key."""
+        self._store(namespace, key, lambda tmp_path: tmp_path.write_bytes(data))
+
+    def get_file(self, namespace, key):
+        """Return the path of the entry stored under @namespace and @key or
+        None. The file may be linked to, but must not be modified."""
+
+        entry_path = self._entry_path(namespace, key)
+        if not entry_path.is_file():
+            return None
+
+        self._touch(entry_path)
+        return entry_path
+
+    def put_file(self, namespace, key, file_path):
+        """Store a copy of the file at @file_path under @namespace and @key."""
+        self._store(namespace, key, lambda tmp_path: shutil.copyfile(file_path, tmp_path))
+
+    # PRIVATE
+
+    def _store(self, namespace, key, write):
+        """Let @write create the entry under a temporary name, then move it
+        into place."""
+
+        entry_path = self._entry_path(namespace, key)
+        tmp_path = entry_path.with_name(f".{entry_path.name}.{os.getpid()}.{threading.get_ident()}")
+
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            write(tmp_path)
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry_size for _, entry_size, _ in self._entries())
+            else:
+                self._size += size
+
+            if self._size > self._max_size:
+                self._evict()
+
+    @staticmethod
+    def _touch(entry_path):
+        """Mark an entry as used by setting its access time. The modification
+        time stays, because output files may be hard links to the entry. In a
+        shared or read-only cache, entries can't be marked, but are used all
+        the same."""
+
+        try:
+            os.utime(entry_path, ns=(time.time_ns(), entry_path.stat().st_mtime_ns))
+        except OSError:
+            pass
+
+    def _entry_path(self, namespace, key):
+        digest = hashlib.sha256(f"{namespace}\0{key}".encode("utf-8")).hexdigest()
+        return self._cache_dir / digest[:2] / digest
+
+    def _entries(self):
+        """Yield path, size and time of last use of every entry."""
+
+        try:
+            subdirs = list(self._cache_dir.iterdir())
+        except OSError:
+            return
+
+        for subdir in subdirs:
+            try:
+                for entry in os.scandir(subdir):
+                    if not entry.name.startswith("."):
+                        st = entry.stat()
+                        yield Path(entry.path), st.st_size, st.st_atime_ns
+            except OSError:
+                continue
+
+    def _evict(self):
+        """Remove the least recently used entries."""
+
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+
+        for entry_path, size, _ in entries:
+            if self._size <= self._max_size * 0.9:
+                break
+            entry_path.unlink(missing_ok=True)
+            self._size -= size
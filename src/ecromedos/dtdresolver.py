@@ -3,11 +3,10 @@
 # License: MIT
 # URL:     http://www.ecromedos.net
 
-import os
-
 import lxml.etree as etree
 
 from ecromedos.error import ECMDSError
+from ecromedos.validation import load_dtd
 
 
 class ECMDSDTDResolver(etree.Resolver):
@@ -27,7 +26,7 @@ class ECMDSDTDResolver(etree.Resolver):
                 catalog_url = "http://www.ecromedos.net/dtd/" + version + "/" + name + ".dtd"
 
                 if catalog_url == url:
-                    filename = os.path.join(style_dir, "DTD", "ecromedos.dtd")
-                    return self.resolve_filename(filename, context)
+                    dtd = load_dtd(style_dir)
+                    return self.resolve_string(dtd.data, context, base_url=str(dtd.file_path))
 
         return None
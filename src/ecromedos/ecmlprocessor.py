@@ -7,16 +7,34 @@ import lxml.etree as etree
 
 from ecromedos.error import ECMDSError
 from ecromedos.helpers import progress
+from ecromedos.metrics import ECMDSMetrics
+from ecromedos.stylecache import ECMDSStylesheetCache
+from ecromedos.validation import load_dtd
 
 
 class ECMLProcessor:
-    def __init__(self, resolver, preprocessor, target_format, style_dir):
+    def __init__(
+        self,
+        resolver,
+        preprocessor,
+        target_format,
+        style_dir,
+        stylesheet_cache=None,
+        validation_cache=None,
+        count_elements=False,
+    ):
         self._resolver = resolver
         self._preprocessor = preprocessor
         self._style_dir = style_dir
         self._target_format = target_format
+        self._stylesheet_cache = stylesheet_cache or ECMDSStylesheetCache()
+        self._validation_cache = validation_cache
+        self._count_elements = count_elements
         self._stylesheet = self._load_stylesheet()
 
+        # measurements of the last run
+        self.metrics = ECMDSMetrics(target_format=str(target_format))
+
     @progress(description="Reading document...", final_status="DONE")
     def _load_xml_document(self, filename):
         """Try to load XML document from @filename."""
@@ -32,29 +50,33 @@ class ECMLProcessor:
 
     def _load_stylesheet(self):
         """Load matching stylesheet for desired output format."""
+        return self._stylesheet_cache.load(self._style_dir, self._target_format)
 
-        file_path = self._style_dir / self._target_format / "ecmds.xsl"
-        try:
-            tree = self._load_xml_document(file_path, verbose=False)
-        except ECMDSError as e:
-            raise ECMDSError(f"Could not load stylesheet:\n {e.msg()}")
-
-        try:
-            return etree.XSLT(tree)
-        except Exception as e:
-            raise ECMDSError(str(e))
+    @property
+    def stylesheet_files(self):
+        """The stylesheet and all files it includes or imports."""
+        return self._stylesheet_cache.closure(self._style_dir, self._target_format)
 
-    @progress(description="Validating document...", final_status="VALID")
+    @progress(description="Validating document...", final_status="VALID", timed=True)
     def _validate_document(self, document):
         """Validate the given document."""
 
-        dtd = etree.DTD(self._style_dir / "DTD" / "ecromedos.dtd")
-        result = dtd.validate(document)
+        dtd = load_dtd(self._style_dir)
+
+        digest = None
+        if self._validation_cache is not None:
+            digest = self._validation_cache.digest(document, dtd)
+            if digest in self._validation_cache:
+                return True
+
+        result = dtd.validator.validate(document)
 
         if not result:
-            raise ECMDSError(dtd.error_log.last_error)
-        else:
-            return result
+            raise ECMDSError(dtd.validator.error_log.last_error)
+        elif self._validation_cache is not None:
+            self._validation_cache.add(digest)
+
+        return result
 
     @progress(description="Transforming document...", final_status="DONE")
     def _apply_stylesheet(self, document, xsl_parameters):
@@ -65,14 +87,42 @@ class ECMLProcessor:
         except Exception as e:
             raise ECMDSError(f"Error transforming document:\n {e}.")
 
-    def process(self, filename, validation_enabled, xsl_parameters, verbose=True):
-        """Convert the document stored under filename."""
+    @property
+    def timings(self):
+        """Wall clock time spent per phase of the last run."""
+        return self.metrics.timings
+
+    def load(self, filename, validation_enabled, verbose=True):
+        """Read and, if requested, validate the document stored under filename.
+        The elements of the document are counted only if the processor was
+        asked to, as that takes a walk over the whole tree."""
+
+        self.metrics = ECMDSMetrics(source_file=str(filename), target_format=str(self._target_format))
 
-        document = self._load_xml_document(filename)
+        with self.metrics.phase("read") as entry:
+            document = self._load_xml_document(filename, verbose=verbose)
+            if self._count_elements:
+                entry["elements"] = int(document.xpath("count(//*)"))
 
         if validation_enabled:
-            self._validate_document(document)
+            with self.metrics.phase("validate"):
+                self._validate_document(document, verbose=verbose)
+
+        return document
+
+    def transform(self, document, xsl_parameters, verbose=True):
+        """Run the plugins and the stylesheet over an already loaded document."""
 
-        self._preprocessor.prepareDocument(document, target_format=self._target_format)
+        with self.metrics.phase("preprocess"):
+            self._preprocessor.prepareDocument(
+                document, target_format=self._target_format, metrics=self.metrics, verbose=verbose
+            )
+
+        with self.metrics.phase("transform"):
+            return self._apply_stylesheet(document=document, xsl_parameters=xsl_parameters, verbose=verbose)
+
+    def process(self, filename, validation_enabled, xsl_parameters, verbose=True):
+        """Convert the document stored under filename."""
 
-        self._apply_stylesheet(document=document, xsl_parameters=xsl_parameters, verbose=verbose)
+        document = self.load(filename, validation_enabled, verbose=verbose)
+        self.transform(document, xsl_parameters, verbose=verbose)
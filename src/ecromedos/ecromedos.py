@@ -6,19 +6,20 @@
 
 from argparse import ArgumentError
 from enum import IntEnum, auto
-from pathlib import Path
 import sys
 import tempfile
+import time
 
 from argcomplete import autocomplete
 
 from ecromedos.argumentparser import ECMDSArgumentParser
-from ecromedos.configreader import ECMDSConfigReader
-from ecromedos.dtdresolver import ECMDSDTDResolver
-from ecromedos.ecmlprocessor import ECMLProcessor
-from ecromedos.error import ECMDSError
+from ecromedos.batch import expand_sources, print_summary, render_batch
+from ecromedos.error import ECMDSError, ECMDSServerUnavailable
 from ecromedos.helpers import print_document_template
-from ecromedos.preprocessor import ECMDSPreprocessor
+from ecromedos.metrics import print_plugin_profile, write_metrics
+from ecromedos.pipeline import ECMDSPipeline, render_formats
+from ecromedos.server import serve, submit_job
+from ecromedos.watch import ECMDSWatcher
 
 
 # exit values
@@ -28,6 +29,36 @@ class ExitValue(IntEnum):
     ECMDS_ERR_UNKNOWN = auto()
 
 
+def report(args, documents):
+    """Write and print the measurements taken while rendering @documents."""
+
+    documents = list(documents)
+
+    if args.metrics:
+        write_metrics(args.metrics, documents)
+
+    for document in documents:
+        if profile := document.get("plugin_profile"):
+            if len(documents) > 1:
+                print(f"\n {document.get('source_file')} ({document.get('target_format')}):", end="")
+            print_plugin_profile(profile)
+
+
+def render(args, target_format, params, options):
+    """Render the source file in this process."""
+
+    with tempfile.TemporaryDirectory(prefix="ecmds-") as tmp_dir:
+        pipeline = ECMDSPipeline(
+            config_file_path=args.config,
+            target_format=target_format,
+            validation_enabled=args.validate,
+            tmp_dir=tmp_dir,
+            options=options,
+        )
+        pipeline.render(args.source_file, xsl_parameters=params)
+    report(args, [pipeline.metrics.as_dict()])
+
+
 def main():
     autocomplete(parser := ECMDSArgumentParser(exit_on_error=False))
     try:
@@ -46,33 +77,117 @@ def main():
     if args.style:
         params["global.stylesheet"] = f"document('{args.style.absolute()}')"
 
+    target_format = args.format[0] if args.format else None
+    if args.format and len(args.format) > 1 and (args.batch or args.serve or args.server or args.watch):
+        print("ecromedos: multiple output formats can't be combined with batch, server or watch mode", file=sys.stderr)
+        sys.exit(ExitValue.ECMDS_ERR_INVOCATION)
+
+    options = {}
+    if args.incremental is not None:
+        options["incremental"] = "yes" if args.incremental else "no"
+    if args.validation_cache is not None:
+        options["validation_cache"] = "yes" if args.validation_cache else "no"
+    if args.math_cache is not None:
+        options["math_cache"] = "yes" if args.math_cache else "no"
+    if args.profile_plugins is not None:
+        options["profile_plugins"] = args.profile_plugins
+    if args.metrics:
+        # only worth a walk over the whole tree, if someone looks at it
+        options["count_elements"] = "yes"
+    if args.watch:
+        # reuse plugin results and leave unchanged files alone between rebuilds
+        options.setdefault("incremental", "yes")
+
     if args.new:
         print_document_template(args.new)
         sys.exit(0)
 
+    elif args.serve:
+        try:
+            serve(args.serve, config_file_path=args.config, validation_enabled=args.validate, options=options)
+        except ECMDSError as e:
+            print(e.msg(), file=sys.stderr)
+            sys.exit(ExitValue.ECMDS_ERR_PROCESSING)
+        except OSError as e:
+            print(f"ecromedos: cannot listen on {args.serve}: {e}", file=sys.stderr)
+            sys.exit(ExitValue.ECMDS_ERR_INVOCATION)
+        except KeyboardInterrupt:
+            print("\n -> Caught SIGINT, terminating.", file=sys.stderr)
+
+    elif args.batch:
+        if args.source_file is not None:
+            args.batch.append(str(args.source_file))
+        try:
+            sources = expand_sources(args.batch)
+            start = time.perf_counter()
+            results = render_batch(
+                sources,
+                output_root=args.output_dir,
+                config_file_path=args.config,
+                target_format=target_format,
+                validation_enabled=args.validate,
+                xsl_parameters=params,
+                options=options,
+                jobs=args.jobs,
+                callback=lambda r: print(f" * {r['source_file']}... {r['status'].upper()}"),
+            )
+            print_summary(results, time.perf_counter() - start)
+            report(args, [r["metrics"] for r in results if "metrics" in r])
+        except ECMDSError as e:
+            print(e.msg(), file=sys.stderr)
+            sys.exit(ExitValue.ECMDS_ERR_PROCESSING)
+        except KeyboardInterrupt:
+            print("\n -> Caught SIGINT, terminating.", file=sys.stderr)
+            sys.exit(ExitValue.ECMDS_ERR_PROCESSING)
+
+        if any(r["status"] != "ok" for r in results):
+            sys.exit(ExitValue.ECMDS_ERR_PROCESSING)
+
+    elif args.source_file is None:
+        print("ecromedos: no source file given", file=sys.stderr)
+        sys.exit(ExitValue.ECMDS_ERR_INVOCATION)
+
     elif not (args.source_file.exists() and args.source_file.is_file()):
         print(f"ecromedos: {args.source_file} doesn't exist or is not a file", file=sys.stderr)
         sys.exit(ExitValue.ECMDS_ERR_INVOCATION)
 
     else:
         try:
-            with tempfile.TemporaryDirectory(prefix="ecmds-") as tmp_dir:
-                configuration, plugins_map = ECMDSConfigReader().readConfig(
+            if args.server:
+                try:
+                    result = submit_job(
+                        args.server, args.source_file, target_format=target_format, xsl_parameters=params
+                    )
+                except ECMDSServerUnavailable as e:
+                    print(f" * {e.msg()} Rendering without it.", file=sys.stderr)
+                    render(args, target_format, params, options)
+                else:
+                    print(f" * Rendered by server in {result['elapsed']:.3f}s")
+                    report(args, [result["metrics"]])
+            elif args.watch:
+                ECMDSWatcher(
+                    args.source_file,
                     config_file_path=args.config,
-                    target_format=args.format,
+                    target_format=target_format,
                     validation_enabled=args.validate,
-                    tmp_dir=tmp_dir,
-                )
-                resolver = ECMDSDTDResolver(configuration=configuration)
-                preprocessor = ECMDSPreprocessor(configuration=configuration, plugins_map=plugins_map)
-                ECMLProcessor(
-                    resolver=resolver,
-                    preprocessor=preprocessor,
-                    target_format=configuration["target_format"],
-                    style_dir=Path(configuration["style_dir"]),
-                ).process(
-                    args.source_file, validation_enabled=configuration["validation_enabled"], xsl_parameters=params
+                    output_dir=args.output_dir,
+                    xsl_parameters=params,
+                    options=options,
+                    metrics_file=args.metrics,
+                ).run()
+            elif args.format and len(args.format) > 1:
+                reports = render_formats(
+                    args.source_file,
+                    args.format,
+                    output_dir=args.output_dir,
+                    config_file_path=args.config,
+                    validation_enabled=args.validate,
+                    xsl_parameters=params,
+                    options=options,
                 )
+                report(args, reports.values())
+            else:
+                render(args, target_format, params, options)
         except ECMDSError as e:
             print(e.msg(), file=sys.stderr)
             sys.exit(ExitValue.ECMDS_ERR_PROCESSING)
@@ -27,6 +27,10 @@ class ECMDSConfigError(ECMDSError):
     pass
 
 
+class ECMDSServerUnavailable(ECMDSError):
+    pass
+
+
 class ECMDSPluginError(ECMDSError):
     def __init__(self, value, plugin_name):
         super().__init__(value)
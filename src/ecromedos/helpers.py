@@ -1,5 +1,8 @@
+import os
+from pathlib import Path
 import shutil
 import subprocess
+import time
 
 from ecromedos.error import ECMDSError, ECMDSPluginError
 from ecromedos import templates
@@ -27,6 +30,21 @@ class ExternalTool:
             return result
 
 
+def get_cache_dir(configuration):
+    """Returns the directory for caches that persist between runs or None, if
+    persistent caching was disabled by setting an empty cache_dir."""
+
+    if (cache_dir := configuration.get("cache_dir")) is not None:
+        return Path(cache_dir) if cache_dir else None
+
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "ecromedos"
+
+
+def is_enabled(configuration, key, default="no"):
+    """Interprets the configuration entry @key as a yes/no switch."""
+    return str(configuration.get(key, default)).strip().lower() in ["yes", "true", "on", "1"]
+
+
 def print_document_template(document_type):
     """Outputs a template for a new document of @document_type to stdout."""
 
@@ -38,14 +56,15 @@ def print_document_template(document_type):
         print(template)
 
 
-def progress(description, final_status):
+def progress(description, final_status, timed=False):
     def inner(func):
         def wrapper(*args, verbose=True, **kwargs):
             if verbose:
                 print(f" * {description}{' ' * (40 - len(description))}", end="")
+            start = time.perf_counter()
             result = func(*args, **kwargs)
             if verbose:
-                print(final_status)
+                print(f"{final_status} ({time.perf_counter() - start:.3f}s)" if timed else final_status)
 
             return result
 
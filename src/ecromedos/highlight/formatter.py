@@ -3,16 +3,58 @@
 # License: MIT
 # URL:     http://www.ecromedos.net
 
-import re
 from xml.sax.saxutils import escape as xmlescape
 
 from pygments.formatter import Formatter
 
 
+class ECMLTagTable(dict):
+    """Maps token types to the opening and closing ECML tags for @style,
+    resolving each token type only once. A table can be shared by all
+    formatters using the same style."""
+
+    def __init__(self, style):
+        super().__init__()
+        self.__tstyle = dict(style)
+
+    def __missing__(self, ttype):
+        tags = self[ttype] = self.__tagsForType(ttype)
+        return tags
+
+    # PRIVATE
+
+    def __tagsForType(self, ttype):
+        while ttype not in self.__tstyle:
+            ttype = ttype.parent
+
+        style = self.__tstyle[ttype]
+        opening = []
+        closing = []
+
+        if style["color"]:
+            opening.append('<color rgb="#%s">' % style["color"].lower().lstrip("#"))
+            closing.insert(0, "</color>")
+        if style["underline"]:
+            opening.append("<u>")
+            closing.insert(0, "</u>")
+        if style["italic"]:
+            opening.append("<i>")
+            closing.insert(0, "</i>")
+        if style["bold"]:
+            opening.append("<b>")
+            closing.insert(0, "</b>")
+
+        return "".join(opening), "".join(closing)
+
+
 class ECMLPygmentsFormatter(Formatter):
+    """Formats tokens as ECML markup in one pass. The markup is parsed into a
+    code element by the caller on purpose: libxml2 creates the many small
+    nodes of a listing faster in one parse than lxml's TreeBuilder or
+    SubElement add them one by one, and the markup can be cached as is."""
+
     def __init__(self, **options):
         Formatter.__init__(self, **options)
-        self.__tstyle = dict(options["style"])
         try:
             self.__bgcolor = options["style"].background_color
         except AttributeError:
@@ -22,65 +64,46 @@ class ECMLPygmentsFormatter(Formatter):
         self.__line_step = options["line_step"]
         self.__output_format = options["output_format"]
         self.__new_line = True
+        # opening and closing tags by token type
+        if (tag_table := options.get("tag_table")) is None:
+            tag_table = ECMLTagTable(options["style"])
+        self.__tags = tag_table
 
     def format(self, tokensource, outfile):
-        if self.__bgcolor:
-            outfile.write('<code bgcolor="#%s">' % self.__bgcolor.lower().lstrip("#"))
-        else:
-            outfile.write("<code>")
+        outfile.write(self.format_markup(tokensource))
 
-        for ttype, tvalue in tokensource:
-            while ttype not in self.__tstyle:
-                ttype = ttype.parent
-
-            self.writeToken(ttype, tvalue, outfile)
+    def format_markup(self, tokensource):
+        chunks = []
 
-        outfile.write("</code>")
+        if self.__bgcolor:
+            chunks.append('<code bgcolor="#%s">' % self.__bgcolor.lower().lstrip("#"))
+        else:
+            chunks.append("<code>")
 
-    def writeToken(self, ttype, tvalue, outfile):
-        if self.__emit_line_numbers or self.__output_format.endswith("latex"):
-            lines = tvalue.splitlines(True)
+        split_lines = self.__emit_line_numbers or self.__output_format.endswith("latex")
+        tag_table = self.__tags
 
-            for line in lines:
-                if self.__emit_line_numbers:
-                    self.writeLineNo(self.__line_no, outfile)
-                self.writeOpeningTags(ttype, outfile)
-                outfile.write(xmlescape(line))
-                self.writeClosingTags(ttype, outfile)
+        for ttype, tvalue in tokensource:
+            tags = tag_table[ttype]
 
-                if re.search(r"\r|(?:\r)?\n$", line):
-                    self.__line_no += self.__line_step
-                    self.__new_line = True
-        else:
-            self.writeOpeningTags(ttype, outfile)
-            outfile.write(xmlescape(tvalue))
-            self.writeClosingTags(ttype, outfile)
+            if split_lines:
+                self.writeLines(tags, tvalue, chunks)
+            else:
+                chunks += (tags[0], xmlescape(tvalue), tags[1])
 
-    def writeLineNo(self, line_no, outfile):
-        if self.__new_line:
-            outfile.write("<b>%04d</b> " % line_no)
-            self.__new_line = False
+        chunks.append("</code>")
+        return "".join(chunks)
 
-    def writeOpeningTags(self, ttype, outfile):
-        style = self.__tstyle[ttype]
+    def writeLines(self, tags, tvalue, chunks):
+        opening, closing = tags
 
-        if style["color"]:
-            outfile.write('<color rgb="#%s">' % style["color"].lower().lstrip("#"))
-        if style["underline"]:
-            outfile.write("<u>")
-        if style["italic"]:
-            outfile.write("<i>")
-        if style["bold"]:
-            outfile.write("<b>")
+        for line in tvalue.splitlines(True):
+            if self.__emit_line_numbers and self.__new_line:
+                chunks.append("<b>%04d</b> " % self.__line_no)
+                self.__new_line = False
 
-    def writeClosingTags(self, ttype, outfile):
-        style = self.__tstyle[ttype]
+            chunks += (opening, xmlescape(line), closing)
 
-        if style["bold"]:
-            outfile.write("</b>")
-        if style["italic"]:
-            outfile.write("</i>")
-        if style["underline"]:
-            outfile.write("</u>")
-        if style["color"]:
-            outfile.write("</color>")
+            if "\r" in line or line.endswith("\n"):
+                self.__line_no += self.__line_step
+                self.__new_line = True
@@ -0,0 +1,137 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+from concurrent.futures import ProcessPoolExecutor
+
+from pygments.lexers import get_lexer_by_name
+from pygments.styles import get_style_by_name
+from pygments.util import ClassNotFound as PygmentsClassNotFound
+from pygments_style_github import GithubStyle
+
+from ecromedos.error import ECMDSPluginError
+from ecromedos.highlight.formatter import ECMLPygmentsFormatter, ECMLTagTable
+
+
+class ECMDSHighlighter:
+    """Turns listings into the markup of ECML code elements with Pygments.
+    Lexers and styles with their tag tables are looked up once and shared by
+    all listings."""
+
+    def __init__(self, default_colorscheme="default"):
+        self.__colorscheme = default_colorscheme
+        self.__lexers = {}
+        self.__styles = {}
+
+    def highlight(self, string, options):
+        """Highlight @string as the attributes of its code element and the
+        output format in @options ask for, returns markup."""
+
+        # output line numbers?
+        try:
+            startline = int(options["startline"])
+            have_line_numbers = True
+        except ValueError:
+            msg = "Invalid start line '%s'." % (options["startline"],)
+            raise ECMDSPluginError(msg, "highlight")
+        except KeyError:
+            have_line_numbers = False
+            startline = 1
+
+        # increment to add to each line
+        try:
+            line_stepping = int(options["linestep"])
+        except ValueError:
+            msg = "Invalid line stepping '%s'." % (options["linestep"],)
+            raise ECMDSPluginError(msg, "highlight")
+        except KeyError:
+            line_stepping = 1
+
+        # style to use
+        style, tag_table = self.get_style(options.get("colorscheme", self.__colorscheme))
+
+        # get a lexer for given syntax
+        lexer = self.get_lexer(options["syntax"])
+
+        # do the actual highlighting
+        formatter = ECMLPygmentsFormatter(
+            emit_line_numbers=have_line_numbers,
+            startline=startline,
+            line_step=line_stepping,
+            style=style,
+            output_format=options["output_format"],
+            tag_table=tag_table,
+        )
+
+        return formatter.format_markup(lexer.get_tokens(string))
+
+    def get_style(self, color_scheme):
+        """Returns the style named @color_scheme and its tag table."""
+
+        if (style := self.__styles.get(color_scheme)) is not None:
+            return style
+
+        try:
+            if color_scheme in ["default", "github"]:
+                style = GithubStyle
+            else:
+                style = get_style_by_name(color_scheme)
+        except PygmentsClassNotFound:
+            msg = "No style by name '%s'" % color_scheme
+            raise ECMDSPluginError(msg, "highlight")
+
+        self.__styles[color_scheme] = style, ECMLTagTable(style)
+        return self.__styles[color_scheme]
+
+    def get_lexer(self, syntax):
+        """Returns a lexer for @syntax, shared by all listings."""
+
+        if (lexer := self.__lexers.get(syntax)) is not None:
+            return lexer
+
+        try:
+            lexer = self.__lexers[syntax] = get_lexer_by_name(syntax)
+        except PygmentsClassNotFound:
+            msg = "No lexer class found for '%s'." % syntax
+            raise ECMDSPluginError(msg, "highlight")
+
+        return lexer
+
+    def highlight_parallel(self, listings, max_workers):
+        """Highlight the (string, options) @listings in a pool of processes.
+        Returns a (markup, error message) pair for each, in the same order.
+
+        Lexers are prepared before the pool starts, so that processes forked
+        from this one inherit the compiled lexer rules."""
+
+        for _, options in listings:
+            try:
+                self.get_lexer(options["syntax"])
+            except ECMDSPluginError:
+                # reported with the listing
+                pass
+
+        chunksize = max(1, len(listings) // (max_workers * 4))
+
+        with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker, initargs=(self.__colorscheme,)
+        ) as executor:
+            return list(executor.map(_highlight_in_worker, listings, chunksize=chunksize))
+
+
+# the highlighter of a worker process
+_worker_highlighter = None
+
+
+def _init_worker(default_colorscheme):
+    global _worker_highlighter
+    _worker_highlighter = ECMDSHighlighter(default_colorscheme)
+
+
+def _highlight_in_worker(listing):
+    string, options = listing
+    try:
+        return _worker_highlighter.highlight(string, options), None
+    except ECMDSPluginError as e:
+        return None, e.msg()
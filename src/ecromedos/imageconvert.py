@@ -0,0 +1,86 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from ecromedos.error import ECMDSPluginError
+
+# raster formats converted in-process and the names Pillow uses for them
+PILLOW_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG", ".gif": "GIF"}
+
+# formats that keep their alpha channel
+ALPHA_FORMATS = [".png"]
+
+
+def pillow_available():
+    return Image is not None
+
+
+class ECMDSPillowConverter:
+    """Scales and converts PNG, JPEG and GIF images without starting a
+    process, with the same results as 'convert -scale WIDTHx -alpha remove'.
+    Everything else is left to ImageMagick."""
+
+    def __init__(self):
+        if Image is None:
+            raise ECMDSPluginError(
+                "Converting images with Pillow requires the Pillow package, install ecromedos[pillow].", "picture"
+            )
+
+    def convert(self, src, dst, width=None):
+        """Convert @src to @dst, scaled to @width pixels if given. Returns
+        False, if the conversion must be done by ImageMagick."""
+        return self.convert_variants(src, [(dst, width)])
+
+    def convert_variants(self, src, variants):
+        """Convert @src to all (dst, width) @variants, decoding it once."""
+
+        if Path(src).suffix.lower() not in PILLOW_FORMATS:
+            return False
+        if any(Path(dst).suffix.lower() not in PILLOW_FORMATS for dst, _ in variants):
+            return False
+
+        try:
+            with Image.open(src) as image:
+                # ImageMagick keeps all frames of an animation
+                if getattr(image, "n_frames", 1) > 1:
+                    return False
+
+                image.load()
+
+                if image.mode not in ["RGB", "RGBA", "L", "LA"]:
+                    image = image.convert("RGBA" if self._has_alpha(image) else "RGB")
+
+                for dst, width in variants:
+                    self._save(image, dst, width)
+        except (OSError, ValueError):
+            raise ECMDSPluginError(f"Could not convert graphics file {src}.", "picture")
+
+        return True
+
+    @staticmethod
+    def _save(image, dst, width):
+        dst_suffix = Path(dst).suffix.lower()
+
+        if width:
+            width = int(width)
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.BOX)
+
+        if dst_suffix not in ALPHA_FORMATS and image.mode in ["RGBA", "LA"]:
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+
+        image.save(dst, PILLOW_FORMATS[dst_suffix])
+
+    @staticmethod
+    def _has_alpha(image):
+        return "A" in image.getbands() or "transparency" in image.info
@@ -0,0 +1,138 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import mmap
+import re
+import struct
+
+# the root element of an SVG file is expected in this many bytes
+SVG_HEAD_SIZE = 64 * 1024
+
+# JPEG start of frame markers, which carry the dimensions
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_size(file_path):
+    """Returns width and height in pixels of the PNG, JPEG, GIF, BMP, WebP or
+    SVG image at @file_path, as found in the file header. Returns None, if the
+    format is not recognized or the header is broken.
+
+    The file is memory-mapped, so that only the pages holding the header are
+    read, even if a JPEG file carries large metadata before its frame."""
+
+    try:
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for reader in [_png_size, _gif_size, _jpeg_size, _bmp_size, _webp_size, _svg_size]:
+                if (size := reader(data)) is not None:
+                    return size
+    except (OSError, ValueError, struct.error):
+        # empty files can't be mapped
+        pass
+
+    return None
+
+
+def _png_size(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        return struct.unpack(">II", data[16:24])
+    return None
+
+
+def _gif_size(data):
+    if data[:6] in [b"GIF87a", b"GIF89a"]:
+        return struct.unpack("<HH", data[6:10])
+    return None
+
+
+def _jpeg_size(data):
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+
+        marker = data[offset + 1]
+
+        # fill bytes and markers without payload
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+
+        offset += 2 + length
+
+    return None
+
+
+def _bmp_size(data):
+    if data[:2] != b"BM":
+        return None
+
+    (header_size,) = struct.unpack("<I", data[14:18])
+
+    if header_size == 12:
+        return struct.unpack("<HH", data[18:22])
+
+    width, height = struct.unpack("<ii", data[18:26])
+    # negative height marks a top-down bitmap
+    return width, abs(height)
+
+
+def _webp_size(data):
+    if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        return None
+
+    chunk = data[12:16]
+
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        (bits,) = struct.unpack("<I", data[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+
+    return None
+
+
+def _svg_size(data):
+    head = data[:SVG_HEAD_SIZE].decode("utf-8", errors="replace")
+
+    if not (match := re.search(r"<svg\b([^>]*)>", head)):
+        return None
+
+    attributes = dict(re.findall(r"""([\w:-]+)\s*=\s*["']([^"']*)["']""", match.group(1)))
+
+    width = attributes.get("width")
+    height = attributes.get("height")
+
+    # other units depend on the resolution the SVG is rendered at
+    if width is not None or height is not None:
+        try:
+            return _svg_pixels(width), _svg_pixels(height)
+        except (AttributeError, ValueError):
+            return None
+
+    try:
+        _, _, width, height = (float(value) for value in re.split(r"[\s,]+", attributes["viewBox"].strip()))
+    except (KeyError, ValueError):
+        return None
+
+    return round(width), round(height)
+
+
+def _svg_pixels(value):
+    return round(float(value.strip().removesuffix("px")))
@@ -0,0 +1,252 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import threading
+
+from ecromedos.error import ECMDSError
+
+BUILD_DIR_NAME = ".ecmds-build"
+MANIFEST_VERSION = 1
+
+
+def file_digest(file_path):
+    """Return the SHA-256 hex digest of the file at @file_path or None, if it
+    can't be read."""
+
+    try:
+        with open(file_path, "rb") as fp:
+            return hashlib.file_digest(fp, "sha256").hexdigest()
+    except OSError:
+        return None
+
+
+def document_sources(document):
+    """Return the source file of @document and all files it pulls in through
+    external entities, e.g. the chapters of a book."""
+
+    if not (url := document.docinfo.URL):
+        return []
+
+    source_file = Path(url).absolute()
+    file_paths = [source_file]
+
+    if (internal_dtd := document.docinfo.internalDTD) is not None:
+        for entity in internal_dtd.iterentities():
+            if entity.system_url:
+                file_paths.append(source_file.parent / entity.system_url)
+
+    return file_paths
+
+
+class ECMDSBuildCache:
+    """Keeps track of what went into and came out of the last build in an
+    output directory, so that a rebuild only redoes what changed.
+
+    The state lives in a hidden directory inside the output directory:
+
+        manifest.json  the pipeline key, the digests of all input files
+                       (document, entity files, files read by plugins) and
+                       of all files that were written
+        objects/       plugin results keyed by the content they were made
+                       from, e.g. highlighted listings or formula bitmaps
+        staging/       the working directory of the build in progress
+
+    A build renders into the staging directory. On commit, only files whose
+    content differs are moved into the output directory, so unchanged files
+    keep their modification times. Files written by the previous build but
+    not by this one are removed.
+
+    The whole document is still preprocessed and transformed, so numbering,
+    the table of contents, the index and the glossary stay consistent.
+    Plugins avoid redoing expensive work through get() and put()."""
+
+    def __init__(self):
+        self._output_dir = None
+        self._manifest = {}
+        self._inputs = {}
+        self._used_objects = set()
+
+    @property
+    def staging_dir(self):
+        return self._build_dir / "staging"
+
+    @property
+    def _build_dir(self):
+        if self._output_dir is None:
+            raise ECMDSError("No build in progress.")
+        return self._output_dir / BUILD_DIR_NAME
+
+    def begin(self, output_dir, document, key, sources=None):
+        """Start a build of @document into @output_dir. @key identifies
+        everything besides the inputs that influences the result, e.g. the
+        target format, the stylesheet parameters and the pipeline files.
+        @sources are the files the document was read from, as returned by
+        document_sources(), which is called if they aren't given.
+
+        Returns False, if the output directory is up to date and nothing needs
+        to be done. Otherwise, the caller has to render into staging_dir and
+        call commit() or abort()."""
+
+        self._output_dir = Path(output_dir).absolute()
+        self._manifest = self._read_manifest()
+        self._inputs = {}
+        self._used_objects = set()
+
+        for file_path in document_sources(document) if sources is None else sources:
+            self.add_dependency(file_path)
+
+        if self._is_up_to_date(key):
+            return False
+
+        self._manifest["key"] = key
+        self._manifest["version"] = MANIFEST_VERSION
+
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        self.staging_dir.mkdir(parents=True)
+        return True
+
+    def add_dependency(self, file_path):
+        """Record that the build read @file_path."""
+
+        file_path = str(Path(file_path).absolute())
+        if file_path not in self._inputs:
+            self._inputs[file_path] = file_digest(file_path)
+
+    def get(self, namespace, key):
+        """Return the result a plugin stored under @namespace and @key in this
+        or the previous build, or None."""
+
+        object_id = self._object_id(namespace, key)
+        try:
+            data = (self._build_dir / "objects" / object_id).read_bytes()
+        except OSError:
+            return None
+
+        self._used_objects.add(object_id)
+        return data
+
+    def put(self, namespace, key, data):
+        """Store the result @data of a plugin under @namespace and @key."""
+
+        object_id = self._object_id(namespace, key)
+        objects_dir = self._build_dir / "objects"
+
+        try:
+            objects_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = objects_dir / f".{object_id}.{os.getpid()}.{threading.get_ident()}"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, objects_dir / object_id)
+        except OSError:
+            return
+
+        self._used_objects.add(object_id)
+
+    def commit(self):
+        """Publish the staged files and save the manifest. Returns the names
+        of the files that were written or removed."""
+
+        old_outputs = self._manifest.get("outputs", {})
+        new_outputs = {}
+        changed = []
+
+        for staged in sorted(p for p in self.staging_dir.rglob("*") if p.is_file()):
+            name = staged.relative_to(self.staging_dir).as_posix()
+            target = self._output_dir / name
+            digest = file_digest(staged)
+
+            if file_digest(target) != digest:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staged, target)
+                changed.append(name)
+
+            st = target.stat()
+            new_outputs[name] = [digest, st.st_size, st.st_mtime_ns]
+
+        for name in old_outputs.keys() - new_outputs.keys():
+            (self._output_dir / name).unlink(missing_ok=True)
+            changed.append(name)
+
+        self._collect_garbage()
+
+        self._manifest["inputs"] = self._inputs
+        self._manifest["outputs"] = new_outputs
+        self._write_manifest()
+
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        self._output_dir = None
+        return changed
+
+    def abort(self):
+        """Throw away the staged files, leaving the output directory as it was."""
+
+        if self._output_dir is not None:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            self._output_dir = None
+
+    # PRIVATE
+
+    @staticmethod
+    def _object_id(namespace, key):
+        return hashlib.sha256(f"{namespace}\0{key}".encode("utf-8")).hexdigest()
+
+    def _is_up_to_date(self, key):
+        """Check the manifest against the current state of inputs and outputs."""
+
+        if self._manifest.get("version") != MANIFEST_VERSION or self._manifest.get("key") != key:
+            return False
+
+        inputs = self._manifest.get("inputs", {})
+
+        # a new entity file is missing from the old manifest
+        if not self._inputs.keys() <= inputs.keys():
+            return False
+
+        for file_path, digest in inputs.items():
+            current = self._inputs[file_path] if file_path in self._inputs else file_digest(file_path)
+            if current != digest:
+                return False
+
+        for name, (_, size, mtime_ns) in self._manifest.get("outputs", {}).items():
+            try:
+                st = (self._output_dir / name).stat()
+            except OSError:
+                return False
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                return False
+
+        return True
+
+    def _collect_garbage(self):
+        """Remove plugin results, which were not used by this build."""
+
+        objects_dir = self._build_dir / "objects"
+        if not objects_dir.is_dir():
+            return
+
+        for entry in objects_dir.iterdir():
+            if entry.name not in self._used_objects:
+                entry.unlink(missing_ok=True)
+
+    def _read_manifest(self):
+        try:
+            with open(self._build_dir / "manifest.json", "rt", encoding="utf-8") as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _write_manifest(self):
+        manifest_path = self._build_dir / "manifest.json"
+        try:
+            with open(manifest_path.with_suffix(".tmp"), "wt", encoding="utf-8") as fp:
+                json.dump(self._manifest, fp, indent=1, sort_keys=True)
+            os.replace(manifest_path.with_suffix(".tmp"), manifest_path)
+        except OSError as e:
+            raise ECMDSError(f"Could not write build manifest {manifest_path}: {e}")
@@ -0,0 +1,76 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import re
+
+# characters with a special meaning in some context in LaTeX
+SPECIAL_CHARS = {
+    "[": "{[}",
+    "]": "{]}",
+    "{": "\\{{}",
+    "}": "\\}{}",
+    "#": "\\#{}",
+    "&": "\\&{}",
+    "_": "\\_{}",
+    "%": "\\%{}",
+    "$": "\\${}",
+    "^": "\\^{}",
+    "\\": "\\textbackslash{}",
+    "~": "\\textasciitilde{}",
+}
+
+# characters, which babel or ligatures may turn into something else
+TEXT_ACTIVE_CHARS = {ch: "{}{\\string%s}{}" % ch for ch in "-:;!?\"`'="}
+VERBATIM_ACTIVE_CHARS = {ch: "{}{%s}{}" % ch for ch in "-:;!?\"`'="}
+
+_TEXT_TABLE = str.maketrans({**SPECIAL_CHARS, **TEXT_ACTIVE_CHARS})
+
+# verbatim tables by number of spaces per tab
+_verbatim_tables = {}
+
+# white-space up to the last line break in it
+_LEADING_LINES = re.compile(r"\s*\n")
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def escape_text(string, lstrip=False):
+    """Replace any character in @string that could have a special meaning in
+    some context in LaTeX with a macro and cut multiple line breaks. White-
+    space up to the last line break at the start of @string is dropped, if
+    @lstrip is set.
+
+    Returns the escaped string and whether the leading white-space of the
+    following string is to be stripped, because this one ends in a line
+    break."""
+
+    if lstrip and (match := _LEADING_LINES.match(string)):
+        string = string[match.end() :]
+
+    if lstrip and (not string or string.isspace()):
+        # still looking for the start of the line
+        return string, True
+
+    escaped = string.translate(_TEXT_TABLE)
+
+    if "\n" not in string:
+        return escaped, False
+
+    escaped = _BLANK_LINES.sub("\n", escaped)
+    lstrip = string[-1].isspace() and "\n" in string[len(string.rstrip()) :]
+
+    return escaped, lstrip
+
+
+def escape_verbatim(string, tab_spaces=4):
+    """Replace any character in @string that could have a special meaning in
+    some context in LaTeX with a macro and tabs with @tab_spaces spaces. Other
+    white-space is left as is."""
+
+    if (table := _verbatim_tables.get(tab_spaces)) is None:
+        table = _verbatim_tables[tab_spaces] = str.maketrans(
+            {**SPECIAL_CHARS, **VERBATIM_ACTIVE_CHARS, "\t": " " * tab_spaces}
+        )
+
+    return string.translate(table)
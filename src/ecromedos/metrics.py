@@ -0,0 +1,217 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+from contextlib import contextmanager
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from ecromedos.error import ECMDSError
+from ecromedos.version import VERSION
+
+
+def _peak_rss_kib():
+    """Peak resident set size of this process so far, in KiB."""
+
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, everybody else kilobytes
+    return peak_rss // 1024 if sys.platform == "darwin" else peak_rss
+
+
+def _sample():
+    times = os.times()
+    return time.perf_counter(), time.process_time(), times.children_user + times.children_system
+
+
+class ECMDSMetrics:
+    """Collects wall clock time, CPU time, peak memory usage and counters for
+    each phase of rendering a document.
+
+    CPU time is split into the time spent in this process and in external
+    tools such as latex or convert. Phases may nest, e.g. the plugins' flush
+    phase is part of the preprocess phase.
+
+    Plugins report numbers of their own, e.g. how many formulae were
+    rendered, in a dict named statistics, which is filled in on flush()."""
+
+    def __init__(self, **info):
+        self.info = dict(info)
+        self.phases = {}
+        self.plugin_statistics = {}
+        self.plugin_profile = None
+
+    @contextmanager
+    def phase(self, name):
+        """Measure the enclosed block as phase @name. Yields the phase's entry,
+        to which the block may add counters."""
+
+        entry = self.phases.setdefault(name, {})
+        start_wall, start_cpu, start_child_cpu = _sample()
+        try:
+            yield entry
+        finally:
+            end_wall, end_cpu, end_child_cpu = _sample()
+            entry["wall_s"] = end_wall - start_wall
+            entry["cpu_s"] = end_cpu - start_cpu
+            entry["child_cpu_s"] = end_child_cpu - start_child_cpu
+            entry["peak_rss_kib"] = _peak_rss_kib()
+
+    def count(self, phase, name, value):
+        """Set counter @name of @phase to @value."""
+        self.phases.setdefault(phase, {})[name] = value
+
+    @property
+    def timings(self):
+        """Wall clock time per phase."""
+        return {name: entry["wall_s"] for name, entry in self.phases.items() if "wall_s" in entry}
+
+    def as_dict(self):
+        result = {**self.info, "phases": self.phases, "peak_rss_kib": _peak_rss_kib()}
+        if self.plugin_statistics:
+            result["plugin_statistics"] = self.plugin_statistics
+        if self.plugin_profile is not None:
+            result["plugin_profile"] = self.plugin_profile.as_dict()
+        return result
+
+
+class ECMDSPluginProfile:
+    """Measures the time spent in each plugin's process() and flush() and
+    remembers the @slowest individual process() calls together with the
+    element and source line that triggered them.
+
+    Text nodes don't carry a line number, they are attributed to the
+    element visited last, i.e. their parent or preceding sibling. Source
+    lines of content pulled in through external entities count from the
+    start of the entity file, which libxml2 doesn't record. Therefore, each
+    node is also labeled with the top-level division it belongs to, e.g.
+    chapter[3]."""
+
+    def __init__(self, slowest=10):
+        self.plugins = {}
+        self._slowest = []
+        self._max_slowest = slowest
+        self._sequence = itertools.count()
+        self._current = None
+
+    def locate(self, node):
+        """Tell the profiler which element the preprocessor is visiting."""
+        self._current = node
+
+    def process(self, plugin_name, plugin, node, format):
+        """Call @plugin's process() on @node and take the time."""
+
+        if isinstance(node, str):
+            tag, context = "@text", self._current
+        else:
+            tag, context = node.tag, node
+
+        # plugins may replace the node, remember where it was
+        parent = context.getparent() if context is not None else None
+
+        start = time.perf_counter()
+        try:
+            return plugin.process(node, format)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._add(plugin_name, "process", elapsed)
+
+            if self._max_slowest and (len(self._slowest) < self._max_slowest or elapsed > self._slowest[0][0]):
+                line = context.sourceline if context is not None else None
+                if context is not None and context.getparent() is None:
+                    context = parent
+                entry = (elapsed, next(self._sequence), plugin_name, tag, self._division(context), line)
+
+                if len(self._slowest) < self._max_slowest:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heapreplace(self._slowest, entry)
+
+    def flush(self, plugin_name, plugin):
+        """Call @plugin's flush() and take the time."""
+
+        start = time.perf_counter()
+        try:
+            plugin.flush()
+        finally:
+            self._add(plugin_name, "flush", time.perf_counter() - start)
+
+    def as_dict(self):
+        slowest = [
+            {"plugin": plugin_name, "element": tag, "division": division, "line": line, "time_s": elapsed}
+            for elapsed, _, plugin_name, tag, division, line in sorted(self._slowest, reverse=True)
+        ]
+        return {"plugins": self.plugins, "slowest_nodes": slowest}
+
+    # PRIVATE
+
+    @staticmethod
+    def _division(node):
+        """Name the child of the root element, which contains @node."""
+
+        if node is None or node.getparent() is None:
+            return None
+
+        while (parent := node.getparent()).getparent() is not None:
+            node = parent
+
+        index = sum(1 for _ in node.itersiblings(node.tag, preceding=True)) + 1
+        return f"{node.tag}[{index}]"
+
+    def _add(self, plugin_name, method, elapsed):
+        stats = self.plugins.setdefault(plugin_name, {})
+        stats[f"{method}_calls"] = stats.get(f"{method}_calls", 0) + 1
+        stats[f"{method}_s"] = stats.get(f"{method}_s", 0.0) + elapsed
+        stats[f"{method}_max_s"] = max(stats.get(f"{method}_max_s", 0.0), elapsed)
+
+
+def print_plugin_profile(profile, file=sys.stdout):
+    """Print the plugin profile from a metrics report as table, plugins with
+    the highest total time first."""
+
+    def total(item):
+        stats = item[1]
+        return stats.get("process_s", 0.0) + stats.get("flush_s", 0.0)
+
+    print(f"\n {'Plugin':<12} {'Calls':>8} {'process()':>10} {'max':>9} {'flush()':>9} {'Total':>9}", file=file)
+
+    for plugin_name, stats in sorted(profile["plugins"].items(), key=total, reverse=True):
+        print(
+            f" {plugin_name:<12} {stats.get('process_calls', 0):>8}"
+            f" {stats.get('process_s', 0.0):>9.3f}s {stats.get('process_max_s', 0.0):>8.3f}s"
+            f" {stats.get('flush_s', 0.0):>8.3f}s {total((plugin_name, stats)):>8.3f}s",
+            file=file,
+        )
+
+    if profile["slowest_nodes"]:
+        print("\n Slowest nodes:", file=file)
+        for node in profile["slowest_nodes"]:
+            location = f"line {node['line'] or '?'}"
+            if node["division"]:
+                location += f" of {node['division']}"
+            print(f"  {node['time_s']:>8.3f}s  {node['plugin']:<12} <{node['element']}> at {location}", file=file)
+
+
+def write_metrics(file_path, documents):
+    """Write the metrics of one or more rendered @documents to @file_path as JSON."""
+
+    report = {"ecromedos_version": VERSION, "documents": list(documents)}
+
+    try:
+        with open(file_path, "wt", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2)
+            fp.write("\n")
+    except IOError as e:
+        raise ECMDSError(f"Could not write metrics to {file_path}: {e}")
@@ -0,0 +1,326 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import chdir
+from importlib.resources import files
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import lxml.etree as etree
+
+from ecromedos.configreader import ECMDSConfigReader
+from ecromedos.dtdresolver import ECMDSDTDResolver
+from ecromedos.ecmlprocessor import ECMLProcessor
+from ecromedos.error import ECMDSError
+from ecromedos.helpers import get_cache_dir, is_enabled
+from ecromedos.incremental import ECMDSBuildCache, document_sources
+from ecromedos.preprocessor import ECMDSPreprocessor
+from ecromedos.validation import ECMDSValidationCache
+
+# settings of plugins, which run pools of workers
+WORKER_SETTINGS = ["highlight_workers", "math_shards", "picture_workers"]
+
+
+class ECMDSPipeline:
+    """Holds the configuration, the plugin instances and the compiled stylesheet
+    for one target format, so that any number of documents can be rendered
+    without paying the setup cost again."""
+
+    def __init__(self, config_file_path, target_format, validation_enabled, tmp_dir, options=None):
+        self._config_file_path = Path(config_file_path)
+        self._tmp_dir = Path(tmp_dir)
+
+        self.configuration, plugins_map = ECMDSConfigReader().readConfig(
+            config_file_path=self._config_file_path,
+            target_format=target_format,
+            validation_enabled=validation_enabled,
+            tmp_dir=str(self._tmp_dir),
+        )
+        self.configuration.update(options or {})
+        self._share_cpus()
+
+        if is_enabled(self.configuration, "validation_cache") and (cache_dir := get_cache_dir(self.configuration)):
+            validation_cache = ECMDSValidationCache(cache_dir)
+        else:
+            validation_cache = None
+
+        if is_enabled(self.configuration, "incremental"):
+            self._build_cache = self.configuration["build_cache"] = ECMDSBuildCache()
+        else:
+            self._build_cache = None
+
+        self._preprocessor = ECMDSPreprocessor(configuration=self.configuration, plugins_map=plugins_map)
+        self._processor = ECMLProcessor(
+            resolver=ECMDSDTDResolver(configuration=self.configuration),
+            preprocessor=self._preprocessor,
+            target_format=self.configuration["target_format"],
+            style_dir=Path(self.configuration["style_dir"]),
+            validation_cache=validation_cache,
+            count_elements=is_enabled(self.configuration, "count_elements"),
+        )
+
+        # the files are looked up once, is_stale() only polls them
+        self._watched_files = list(self._iter_watched_files())
+        self._fingerprint = self.fingerprint()
+
+    @property
+    def target_format(self):
+        return self.configuration["target_format"]
+
+    @property
+    def metrics(self):
+        """Measurements taken while rendering the last document."""
+        return self._processor.metrics
+
+    @property
+    def timings(self):
+        """Wall clock time spent per phase of the last document."""
+        return self._processor.timings
+
+    def _share_cpus(self):
+        """If several pipelines run in parallel, as given by the option
+        concurrent_jobs, let the worker pools of the plugins share the CPUs,
+        unless their sizes are configured."""
+
+        try:
+            jobs = int(self.configuration.get("concurrent_jobs") or 1)
+        except ValueError:
+            raise ECMDSError("The value of concurrent_jobs must be a number.")
+
+        if jobs < 2:
+            return
+
+        workers = str(max(1, (os.cpu_count() or 1) // jobs))
+        for name in WORKER_SETTINGS:
+            if not self.configuration.get(name):
+                self.configuration[name] = workers
+
+    def _iter_watched_files(self):
+        """Yield all files, which the pipeline was built from: the configuration,
+        the plugin modules, the stylesheet with everything it includes and the
+        data files next to them, which the stylesheets read with document()."""
+
+        yield self._config_file_path
+        yield Path(str(files("ecromedos"))) / "defaults" / "plugins.conf"
+
+        if (plugin_dir := self.configuration.get("plugin_dir")) and Path(plugin_dir).is_dir():
+            yield from sorted(Path(plugin_dir).glob("*.py"))
+
+        stylesheet_files = [Path(file_path) for file_path in self._processor.stylesheet_files]
+        yield from stylesheet_files
+
+        for directory in dict.fromkeys(file_path.parent for file_path in stylesheet_files):
+            yield from sorted(directory.glob("*.xml"))
+
+    def fingerprint(self):
+        """Return a mapping of all configuration, plugin and stylesheet files to
+        their modification times."""
+
+        fingerprint = {}
+        for file_path in self._watched_files:
+            try:
+                fingerprint[str(file_path)] = file_path.stat().st_mtime_ns
+            except OSError:
+                fingerprint[str(file_path)] = None
+        return fingerprint
+
+    def is_stale(self):
+        """Check if any of the files the pipeline was built from changed on disk."""
+        return self.fingerprint() != self._fingerprint
+
+    def build_key(self, xsl_parameters=None):
+        """Identify everything besides the document that determines the output."""
+
+        data = [str(self.target_format), sorted((xsl_parameters or {}).items()), sorted(self._fingerprint.items())]
+        return hashlib.sha256(json.dumps(data).encode("utf-8")).hexdigest()
+
+    def load(self, source_file, verbose=True):
+        """Parse and validate @source_file."""
+
+        return self._processor.load(
+            Path(source_file).absolute(), validation_enabled=self.configuration["validation_enabled"], verbose=verbose
+        )
+
+    def render_document(self, document, output_dir=None, xsl_parameters=None, verbose=True, sources=None):
+        """Run plugins and stylesheet over the loaded @document and write the
+        result into @output_dir (or the current working directory).
+
+        Plugins reset their state in flush() at the end of every successful run.
+        After a failed run, the plugins are reloaded, because their state is
+        undefined at that point.
+
+        In incremental mode, the document is rendered into a staging directory
+        and only files that changed are copied to @output_dir. Nothing is
+        rendered at all, if none of the inputs changed since the last build.
+        The inputs are the @sources of the document, which are taken from its
+        doctype, if not given."""
+
+        output_dir = Path(output_dir or ".").absolute()
+        work_dir = output_dir
+
+        self.metrics.info.setdefault("source_file", document.docinfo.URL)
+
+        if self._build_cache is not None:
+            if not self._build_cache.begin(output_dir, document, self.build_key(xsl_parameters), sources=sources):
+                self.metrics.info["up_to_date"] = True
+                if verbose:
+                    print(" * Output is up to date.")
+                return
+            work_dir = self._build_cache.staging_dir
+
+        try:
+            with chdir(work_dir):
+                self._processor.transform(document, xsl_parameters=xsl_parameters or {}, verbose=verbose)
+        except BaseException:
+            self._preprocessor.reloadPlugins()
+            if self._build_cache is not None:
+                self._build_cache.abort()
+            raise
+        finally:
+            self._clean_tmp_dir()
+
+        if self._build_cache is not None:
+            changed = self._build_cache.commit()
+            self.metrics.info["changed_files"] = len(changed)
+            if verbose:
+                print(f" * Updated {len(changed)} output file(s).")
+
+    def render(self, source_file, output_dir=None, xsl_parameters=None, verbose=True):
+        """Render @source_file into @output_dir (or the current working directory)."""
+
+        document = self.load(source_file, verbose=verbose)
+        self.render_document(document, output_dir=output_dir, xsl_parameters=xsl_parameters, verbose=verbose)
+
+    def _clean_tmp_dir(self):
+        """Remove intermediate files left behind by the plugins."""
+
+        for entry in self._tmp_dir.iterdir():
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+
+
+def _render_serialized_document(
+    data, base_url, sources, config_file_path, target_format, tmp_root, output_dir, xsl_parameters, options
+):
+    """Worker side of render_formats(), returns the metrics of the run. The
+    serialized tree has no doctype, so the @sources of the document are
+    passed along."""
+
+    document = etree.ElementTree(etree.fromstring(data, etree.XMLParser(huge_tree=True), base_url=base_url))
+
+    start = time.perf_counter()
+    pipeline = ECMDSPipeline(
+        config_file_path=config_file_path,
+        target_format=target_format,
+        validation_enabled=False,
+        tmp_dir=tempfile.mkdtemp(prefix="ecmds-", dir=tmp_root),
+        options=options,
+    )
+    pipeline.render_document(
+        document, output_dir=output_dir, xsl_parameters=xsl_parameters, verbose=False, sources=sources
+    )
+
+    return {**pipeline.metrics.as_dict(), "elapsed_s": time.perf_counter() - start}
+
+
+def render_formats(
+    source_file,
+    target_formats,
+    output_dir,
+    config_file_path,
+    validation_enabled,
+    xsl_parameters,
+    options=None,
+    verbose=True,
+):
+    """Render @source_file into several @target_formats, each into a
+    subdirectory of @output_dir named after the format.
+
+    The document is parsed, entity-expanded and validated only once. The
+    first format is rendered in this process, all others in worker processes
+    that receive a serialized copy of the loaded tree.
+
+    Returns the metrics of each format's run, with the total time including
+    the pipeline setup in the field elapsed_s. If any format fails, the
+    others are still rendered and an ECMDSError lists the errors by format."""
+
+    source_file = Path(source_file).absolute()
+    output_dir = Path(output_dir).absolute()
+    first_format, *other_formats = target_formats
+
+    for target_format in target_formats:
+        (output_dir / target_format).mkdir(parents=True, exist_ok=True)
+
+    # all formats are rendered at the same time
+    options = {**(options or {}), "concurrent_jobs": str(len(target_formats))}
+
+    with tempfile.TemporaryDirectory(prefix="ecmds-") as tmp_root:
+        pipeline = ECMDSPipeline(
+            config_file_path=config_file_path,
+            target_format=first_format,
+            validation_enabled=validation_enabled,
+            tmp_dir=tempfile.mkdtemp(prefix="ecmds-", dir=tmp_root),
+            options=options,
+        )
+        document = pipeline.load(source_file, verbose=verbose)
+
+        data = etree.tostring(document.getroot(), encoding="utf-8")
+        sources = [str(file_path) for file_path in document_sources(document)]
+
+        with ProcessPoolExecutor(max_workers=max(len(other_formats), 1)) as executor:
+            futures = {
+                target_format: executor.submit(
+                    _render_serialized_document,
+                    data,
+                    str(source_file),
+                    sources,
+                    config_file_path,
+                    target_format,
+                    tmp_root,
+                    output_dir / target_format,
+                    xsl_parameters,
+                    options,
+                )
+                for target_format in other_formats
+            }
+
+            reports = {}
+            errors = []
+
+            start = time.perf_counter()
+            try:
+                pipeline.render_document(
+                    document, output_dir=output_dir / first_format, xsl_parameters=xsl_parameters, verbose=False
+                )
+            except ECMDSError as e:
+                errors.append(f"{first_format}: {e.msg()}")
+            else:
+                reports[first_format] = {**pipeline.metrics.as_dict(), "elapsed_s": time.perf_counter() - start}
+
+            for target_format, future in futures.items():
+                try:
+                    reports[target_format] = future.result()
+                except ECMDSError as e:
+                    errors.append(f"{target_format}: {e.msg()}")
+                except Exception as e:
+                    errors.append(f"{target_format}: Unexpected error: {e}")
+
+    if verbose:
+        for target_format in target_formats:
+            if target_format in reports:
+                print(f" * Rendered {target_format} in {reports[target_format]['elapsed_s']:.2f}s")
+
+    if errors:
+        raise ECMDSError("\n".join(errors))
+
+    return reports
@@ -3,15 +3,36 @@
 # License: MIT
 # URL:     http://www.ecromedos.net
 
+from importlib import metadata
+import json
+import os
+import zlib
+
 from lxml import etree
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.styles import get_style_by_name
-from pygments.util import ClassNotFound as PygmentsClassNotFound
-from pygments_style_github import GithubStyle
+import pygments
+
+from ecromedos.diskcache import ECMDSDiskCache, parse_size
+from ecromedos.error import ECMDSError, ECMDSPluginError
+from ecromedos.helpers import get_cache_dir, is_enabled
+from ecromedos.highlight.highlighter import ECMDSHighlighter
+
+# attributes of a code element that make a difference to the listing
+LISTING_OPTIONS = ["syntax", "colorscheme", "startline", "linestep", "output_format"]
+
+# fewer listings are not worth starting processes for
+MIN_PARALLEL_LISTINGS = 20
 
-from ecromedos.error import ECMDSPluginError
-from ecromedos.highlight.formatter import ECMLPygmentsFormatter
+
+def _highlighter_version():
+    """Listings highlighted by other versions of Pygments or the default
+    style are not reused."""
+
+    try:
+        style_version = metadata.version("pygments-style-github")
+    except metadata.PackageNotFoundError:
+        style_version = None
+
+    return [pygments.__version__, style_version]
 
 
 def getInstance(config):
@@ -22,6 +43,56 @@ def getInstance(config):
 class Plugin:
     def __init__(self, config):
         self.__colorscheme = config.get("pygments_default_colorscheme", "default")
+        self.__highlighter = ECMDSHighlighter(self.__colorscheme)
+
+        # results of the previous build in incremental mode and of all
+        # earlier runs, looked up in this order
+        self.__caches = [cache for cache in [config.get("build_cache"), self.__open_cache(config)] if cache]
+        self.__version = _highlighter_version() if self.__caches else None
+
+        # number of processes highlighting listings in parallel
+        try:
+            self.__max_workers = max(1, int(config.get("highlight_workers") or os.cpu_count() or 1))
+        except ValueError:
+            raise ECMDSPluginError("The value of highlight_workers must be a number.", "highlight")
+
+        # markup or error messages of listings highlighted by prepare()
+        self.__prepared = {}
+        # cache entries prepare() found, with the index of the cache
+        self.__cached = {}
+
+    def prepare(self, root, format):
+        """Highlight all listings of the document in a pool of processes
+        before the preprocessor walks it, so that process() only picks up the
+        results. Listings found in a cache are left out."""
+
+        if self.__max_workers < 2:
+            return
+
+        listings = {}
+
+        for node in root.iter("code"):
+            if not node.attrib.get("syntax"):
+                continue
+
+            contents, options = self.__listing(node, format)
+            key = self.__listing_key(contents, options)
+
+            if key in listings or key in self.__cached:
+                continue
+
+            if (entry := self.__lookup(key)) is not None:
+                self.__cached[key] = entry
+            else:
+                listings[key] = (contents, options)
+
+        if len(listings) < MIN_PARALLEL_LISTINGS:
+            return
+
+        results = self.__highlighter.highlight_parallel(
+            list(listings.values()), min(self.__max_workers, len(listings))
+        )
+        self.__prepared = dict(zip(listings, results))
 
     def process(self, node, format):
         """Prepare @node for target @format."""
@@ -30,20 +101,14 @@ class Plugin:
         if not node.attrib.get("syntax"):
             return node
 
-        # fetch contents
-        contents = etree.tostring(node, method="text", encoding="unicode")
-
-        if node.attrib.get("strip", "no").lower() in ["yes", "true"]:
-            contents = contents.strip()
-
-        options = dict(node.attrib)
-        options["output_format"] = format
+        contents, options = self.__listing(node, format)
 
         # fetch content and highlight
-        highlighted = self.__highlight(contents, options)
-
-        # parse result into element
-        newnode = etree.fromstring(highlighted)
+        try:
+            newnode = self.__highlight_cached(contents, options)
+        except ECMDSPluginError as e:
+            msg = f"{e.msg().rstrip('.')} in 'code' tag on line {node.sourceline}."
+            raise ECMDSPluginError(msg, "highlight")
 
         # copy node properties to new node
         for k, v in node.attrib.items():
@@ -63,60 +128,83 @@ class Plugin:
         return newnode
 
     def flush(self):
-        pass
+        self.__prepared = {}
+        self.__cached = {}
 
     # PRIVATE
 
-    def __highlight(self, string, options):
-        """Call syntax highlighter."""
+    @staticmethod
+    def __open_cache(config):
+        """Open the persistent listing cache, unless it is disabled."""
 
-        # output line numbers?
-        try:
-            self.__startline = int(options["startline"])
-            self.__haveLineNumbers = True
-        except ValueError:
-            msg = "Invalid start line '%s'." % (options["startline"],)
-            raise ECMDSPluginError(msg, "highlight")
-        except KeyError:
-            self.__haveLineNumbers = False
-            self.__startline = 1
+        if not is_enabled(config, "highlight_cache") or not (cache_dir := get_cache_dir(config)):
+            return None
 
-        # increment to add to each line
         try:
-            self.__lineStepping = int(options["linestep"])
-        except ValueError:
-            msg = "Invalid line stepping '%s'." % (options["linestep"],)
-            raise ECMDSPluginError(msg, "highlight")
-        except KeyError:
-            self.__lineStepping = 1
+            max_size = parse_size(config.get("highlight_cache_size", "64M"))
+        except ECMDSError as e:
+            raise ECMDSPluginError(e.msg(), "highlight")
 
-        # style to use
-        try:
-            color_scheme = options.get("colorscheme", self.__colorscheme)
-            if color_scheme in ["default", "github"]:
-                self.__style = GithubStyle
+        return ECMDSDiskCache(cache_dir / "highlight", max_size=max_size)
+
+    @staticmethod
+    def __listing(node, format):
+        """Returns the text of the listing in @node and the options for
+        highlighting it."""
+
+        contents = etree.tostring(node, method="text", encoding="unicode")
+
+        if node.attrib.get("strip", "no").lower() in ["yes", "true"]:
+            contents = contents.strip()
+
+        options = dict(node.attrib)
+        options["output_format"] = format
+
+        return contents, options
+
+    def __listing_key(self, string, options):
+        # the listing is already stripped, if requested
+        listing_options = {name: options.get(name) for name in LISTING_OPTIONS}
+        return json.dumps([string, listing_options, self.__colorscheme, self.__version], sort_keys=True)
+
+    def __lookup(self, key):
+        """Returns the index of the first cache holding the listing under
+        @key and the data stored there, or None."""
+
+        for index, cache in enumerate(self.__caches):
+            if (data := cache.get("highlight", key)) is not None:
+                return index, data
+
+        return None
+
+    def __highlight_cached(self, string, options):
+        """Reuse the result of prepare() or of an earlier build, if the listing
+        didn't change. Listings are kept as compressed markup."""
+
+        if not self.__caches and not self.__prepared:
+            return etree.fromstring(self.__highlighter.highlight(string, options))
+
+        key = self.__listing_key(string, options)
+
+        if (entry := self.__cached.get(key) or self.__lookup(key)) is None:
+            if key in self.__prepared:
+                markup, error = self.__prepared[key]
+                if error is not None:
+                    raise ECMDSPluginError(error, "highlight")
             else:
-                self.__style = get_style_by_name(color_scheme)
-        except PygmentsClassNotFound:
-            msg = "No style by name '%s'" % options["colorscheme"]
-            raise ECMDSPluginError(msg, "highlight")
-        except KeyError:
-            self.__style = GithubStyle
+                markup = self.__highlighter.highlight(string, options)
 
-        # get a lexer for given syntax
-        try:
-            lexer = get_lexer_by_name(options["syntax"])
-        except PygmentsClassNotFound:
-            msg = "No lexer class found for '%s'." % options["syntax"]
-            raise ECMDSPluginError(msg, "highlight")
+            if self.__caches:
+                data = zlib.compress(markup.encode("utf-8"))
+                for cache in self.__caches:
+                    cache.put("highlight", key, data)
 
-        # do the actual highlighting
-        formatter = ECMLPygmentsFormatter(
-            emit_line_numbers=self.__haveLineNumbers,
-            startline=self.__startline,
-            line_step=self.__lineStepping,
-            style=self.__style,
-            output_format=options["output_format"],
-        )
+            return etree.fromstring(markup)
+
+        index, data = entry
+
+        # fill in the caches that missed
+        for cache in self.__caches[:index]:
+            cache.put("highlight", key, data)
 
-        return highlight(string, lexer, formatter)
+        return etree.fromstring(zlib.decompress(data))
@@ -3,16 +3,52 @@
 # License: MIT
 # URL:     http://www.ecromedos.net
 
-import io
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
 from pathlib import Path
 import re
+import shutil
 import tempfile
+import time
 
 from lxml import etree
 from ecromedos.argumentparser import GeneratorType
 
-from ecromedos.error import ECMDSPluginError
-from ecromedos.helpers import ExternalTool
+from ecromedos.diskcache import ECMDSDiskCache, parse_size
+from ecromedos.error import ECMDSError, ECMDSPluginError
+from ecromedos.helpers import ExternalTool, get_cache_dir, is_enabled
+
+# fewest formulae per LaTeX run, fewer aren't worth the startup time
+MIN_SHARD_SIZE = 50
+
+# formulae are typeset on pages of their own in a document starting with
+PREAMBLE = """\
+\\documentclass[12pt]{scrartcl}\\usepackage{courier}
+\\usepackage{courier}
+\\usepackage{helvet}
+\\usepackage{mathpazo}
+\\usepackage{amsmath}
+\\usepackage[active,displaymath,textmath]{preview}
+\\frenchspacing{}
+\\usepackage{ucs}
+\\usepackage[utf8x]{inputenc}
+\\usepackage[T1]{autofe}
+\\PrerenderUnicode{äöüß}
+\\pagestyle{empty}
+\\begin{document}"""
+
+# dvisvgm takes the extents of each formula from the preview package, but
+# only with option tightpage
+SVG_PREAMBLE = PREAMBLE.replace("[active,displaymath,textmath]", "[active,displaymath,textmath,tightpage]")
+
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# LaTeX asks for another pass
+RERUN_PATTERN = re.compile(r"Rerun to get|Label\(s\) may have changed|There were undefined references")
+
+# aux file lines, which don't need another pass
+TRIVIAL_AUX_PATTERN = re.compile(r"\\relax|\\gdef\s*\\@abspage@last\{[0-9]+\}")
 
 
 def getInstance(config):
@@ -25,16 +61,53 @@ class Plugin:
         self._counter = 1
         self._nodes = []
 
-        self._run_latex = ExternalTool("latex", "-interaction", "nonstopmode")
-        self._run_dvipng = ExternalTool(
-            "dvipng", "-D", config.get("dvipng_dpi", "100"), "--depth", "-gif", "-T", "tight", "-o", "m%06d.gif"
-        )
+        # img nodes per distinct formula, the first one is rendered
+        self._occurrences = {}
+
+        # depth and image data per formula, placed on flush
+        self._images = {}
+
+        # numbers reported in the build metrics
+        self.statistics = {}
 
         # temporary directory
         self._tmp_dir = Path(config["tmp_dir"])
 
-        # output document
-        self.out = io.StringIO()
+        # GIF bitmaps or SVG drawings
+        self._output = config.get("math_output", "gif").strip().lower()
+        if self._output not in ["gif", "svg"]:
+            raise ECMDSPluginError(f"Unknown math_output '{self._output}', expected gif or svg.", "math")
+
+        # SVGs up to this size are put into the page instead of a file
+        try:
+            self._inline_size = parse_size(config.get("math_inline_size", "0"))
+        except ECMDSError as e:
+            raise ECMDSPluginError(e.msg(), "math")
+        self._inline_counter = 0
+
+        self._dpi = config.get("dvipng_dpi", "100")
+        self._run_latex = ExternalTool("latex", "-interaction", "nonstopmode")
+        self._run_dvipng = ExternalTool("dvipng", "-D", self._dpi, "--depth", "-gif", "-T", "tight")
+        self._run_dvisvgm = ExternalTool("dvisvgm", "--no-fonts", "--page=1-")
+
+        # preamble dumped into a format file, None until built, False if that failed
+        self._preload_format = is_enabled(config, "math_preload_format")
+        self._format_file = None
+        self._format_key = None
+
+        # durations of the LaTeX passes per shard
+        self._shard_passes = []
+
+        # number of LaTeX runs in parallel
+        try:
+            self._max_shards = max(1, int(config.get("math_shards") or os.cpu_count() or 1))
+        except ValueError:
+            raise ECMDSPluginError("The value of math_shards must be a number.", "math")
+
+        # results of the previous build in incremental mode and of all
+        # earlier runs, looked up in this order
+        self._disk_cache = self._open_cache(config)
+        self._caches = [cache for cache in [config.get("build_cache"), self._disk_cache] if cache]
 
     def process(self, node, format):
         """Prepare @node for target @format."""
@@ -47,17 +120,30 @@ class Plugin:
         return result
 
     def flush(self):
-        """If target format is XHTML, generate GIFs from formulae."""
+        """If target format is XHTML, generate images from formulae."""
+
+        if num_formulae := sum(len(nodes) for nodes in self._occurrences.values()):
+            self.statistics = {
+                "formulae": num_formulae,
+                "distinct": len(self._occurrences),
+                "rendered": len(self._nodes),
+                "dedup_ratio": num_formulae / len(self._occurrences),
+            }
+        else:
+            self.statistics = {}
 
-        # generate bitmaps of formulae
-        if self.out.tell() > 0:
-            self.out.write("\\end{document}\n")
-            self._latex_to_dvi_to_gif()
-            self.out.close()
-            self.out = io.StringIO()
+        # generate images of formulae
+        if self._nodes:
+            self._latex_to_dvi_to_images()
+
+        for formula, occurrences in self._occurrences.items():
+            if (image := self._images.get(formula)) is not None:
+                self._place_image(occurrences, *image)
 
         self._counter = 1
         self._nodes = []
+        self._occurrences = {}
+        self._images = {}
 
     def LaTeX_ProcessMath(self, node):
         """Mark node, to be copied 1:1 to output document."""
@@ -75,36 +161,17 @@ class Plugin:
         return math_node
 
     def XHTML_ProcessMath(self, node):
-        """Call LaTeX and ImageMagick to produce a GIF."""
-
-        if self.out.tell() == 0:
-            self.out.write(
-                """\
-\\documentclass[12pt]{scrartcl}\\usepackage{courier}
-\\usepackage{courier}
-\\usepackage{helvet}
-\\usepackage{mathpazo}
-\\usepackage{amsmath}
-\\usepackage[active,displaymath,textmath]{preview}
-\\frenchspacing{}
-\\usepackage{ucs}
-\\usepackage[utf8x]{inputenc}
-\\usepackage[T1]{autofe}
-\\PrerenderUnicode{äöüß}
-\\pagestyle{empty}
-\\begin{document}"""
-            )
-
-        # save TeX markup
-        # formula = etree.tostring(node, method="text", encoding="unicode")
-
-        # give each formula one page
-        self.out.write("$%s$\n\\clearpage{}\n" % node.text)
+        """Call LaTeX and dvipng or dvisvgm to produce an image."""
 
         copy_node = etree.Element("copy")
         img_node = etree.Element("img")
 
-        img_node.attrib["src"] = "m%06d.gif" % (self._counter,)
+        # identical formulae share one image
+        if (occurrences := self._occurrences.get(node.text)) is not None:
+            img_node.attrib["src"] = occurrences[0].attrib["src"]
+        else:
+            img_node.attrib["src"] = "m%06d.%s" % (self._counter, self._output)
+            self._counter += 1
         img_node.attrib["alt"] = "formula"
         img_node.attrib["class"] = "math"
 
@@ -113,43 +180,350 @@ class Plugin:
         copy_node.tail = node.tail
         node.getparent().replace(node, copy_node)
 
-        # keep track of images for flush
-        self._nodes.append(img_node)
-        self._counter += 1
+        if occurrences is not None:
+            occurrences.append(img_node)
+            return copy_node
+
+        self._occurrences[node.text] = [img_node]
+
+        if (image := self._restore_formula(node.text)) is not None:
+            self._images[node.text] = image
+        else:
+            # keep track of images for flush
+            self._nodes.append((img_node, node.text))
 
         return copy_node
 
-    def _latex_to_dvi_to_gif(self):
-        """Write formulae to LaTeX file, compile and extract images."""
+    @staticmethod
+    def _open_cache(config):
+        """Open the persistent formula cache, unless it is disabled."""
+
+        if not is_enabled(config, "math_cache") or not (cache_dir := get_cache_dir(config)):
+            return None
+
+        try:
+            max_size = parse_size(config.get("math_cache_size", "64M"))
+        except ECMDSError as e:
+            raise ECMDSPluginError(e.msg(), "math")
+
+        return ECMDSDiskCache(cache_dir / "math", max_size=max_size)
+
+    def _formula_key(self, formula):
+        if self._output == "svg":
+            return json.dumps([formula, SVG_PREAMBLE, "svg"])
+        return json.dumps([formula, PREAMBLE, "gif", self._dpi])
+
+    def _restore_formula(self, formula):
+        """Return depth and image of @formula from a cache or None."""
+
+        key = self._formula_key(formula)
+
+        for index, cache in enumerate(self._caches):
+            if (data := cache.get("math", key)) is not None:
+                break
+        else:
+            return None
+
+        # fill in the caches that missed
+        for cache in self._caches[:index]:
+            cache.put("math", key, data)
+
+        depth, _, image = data.partition(b"\n")
+        return depth.decode("ascii"), image
+
+    def _store_formula(self, formula, depth, image):
+        """Keep the image and baseline offset of @formula for later builds."""
+
+        data = depth.encode("ascii") + b"\n" + image
+        for cache in self._caches:
+            cache.put("math", self._formula_key(formula), data)
+
+    def _place_image(self, occurrences, depth, image):
+        """Write @image to the file the img nodes in @occurrences refer to, or
+        put it into the page directly, if it is a small SVG, and align the
+        formula with the baseline."""
+
+        style = f"vertical-align: -{depth};"
+
+        if self._output == "svg" and len(image) <= self._inline_size:
+            for img_node in occurrences:
+                self._inline_svg(img_node, image, style)
+            return
 
-        # open a temporary file for TeX output
-        tmp_tex_file_path = Path(tempfile.mkstemp(suffix=".tex", dir=self._tmp_dir)[-1])
+        try:
+            with open(occurrences[0].attrib["src"], "wb") as f:
+                f.write(image)
+        except IOError:
+            raise ECMDSPluginError(f"Could not write image {occurrences[0].attrib['src']}.", "math")
+
+        for img_node in occurrences:
+            img_node.attrib["style"] = style
+
+    def _inline_svg(self, img_node, image, style):
+        """Replace @img_node with the SVG drawing in @image."""
+
+        try:
+            svg_node = etree.fromstring(image)
+        except etree.XMLSyntaxError as e:
+            raise ECMDSPluginError(f"Invalid SVG image for {img_node.attrib['src']}: {e}", "math")
+
+        # glyph definitions of different formulae on one page must not clash
+        self._inline_counter += 1
+        prefix = "m%06d-" % self._inline_counter
+
+        for element in svg_node.iter(etree.Element):
+            for name, value in element.attrib.items():
+                if name == "id":
+                    element.attrib[name] = prefix + value
+                elif name in [XLINK_HREF, "href"] and value.startswith("#"):
+                    element.attrib[name] = "#" + prefix + value[1:]
+                elif "url(#" in value:
+                    element.attrib[name] = value.replace("url(#", "url(#" + prefix)
+
+        svg_node.attrib["class"] = "math"
+        svg_node.attrib["style"] = style
+        svg_node.attrib["role"] = "img"
+        svg_node.attrib["aria-label"] = img_node.attrib.get("alt", "formula")
+        svg_node.tail = img_node.tail
+
+        img_node.getparent().replace(img_node, svg_node)
+
+    def _latex_to_dvi_to_images(self):
+        """Split the formulae into shards, which are compiled and converted to
+        images concurrently, and collect the images in document order."""
+
+        num_shards = min(self._max_shards, -(-len(self._nodes) // MIN_SHARD_SIZE))
+        shard_size = -(-len(self._nodes) // num_shards)
+        shards = [self._nodes[start : start + shard_size] for start in range(0, len(self._nodes), shard_size)]
+
+        # a single LaTeX run would load the packages only once anyway
+        format_build_s = 0.0
+        if self._preload_format and len(shards) > 1:
+            format_build_s = self._load_format()
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            images = [image for shard_images in executor.map(self._render_shard, shards) for image in shard_images]
+
+        for (_, formula), (depth, image) in zip(self._nodes, images):
+            self._images[formula] = (depth, image)
+            self._store_formula(formula, depth, image)
+
+        self._report_passes(len(shards), format_build_s)
+
+    def _preamble(self):
+        return SVG_PREAMBLE if self._output == "svg" else PREAMBLE
+
+    def _load_format(self):
+        """Make sure the format file exists. It is kept in the persistent cache,
+        if there is one, so that it is built only once for all documents and
+        runs, or else in the temporary directory, which is emptied after each
+        document. Returns the time spent on building it."""
+
+        # cleaned up or evicted from the cache
+        if self._format_file and not self._format_file.is_file():
+            self._format_file = None
+
+        if self._format_file is not None:
+            return 0.0
+
+        key = self._get_format_key() if self._disk_cache is not None else None
+
+        if key and (file_path := self._disk_cache.get_file("format", key)) is not None:
+            self._format_file = file_path
+            return 0.0
+
+        format_build_s = self._build_format()
+
+        if key and self._format_file:
+            self._disk_cache.put_file("format", key, self._format_file)
+
+        return format_build_s
+
+    def _get_format_key(self):
+        """Identify the format by the preamble and the version of LaTeX, which
+        has to match the one loading it. Returns None, if the version is
+        unknown."""
+
+        if self._format_key is None:
+            try:
+                version = self._run_latex("-version")
+            except ECMDSPluginError:
+                version = None
+            self._format_key = json.dumps([self._preamble(), version]) if version else ""
+
+        return self._format_key
+
+    def _build_format(self):
+        """Dump the packages loaded by the preamble into a format file, which
+        LaTeX loads much faster than the packages themselves. Returns the time
+        taken."""
+
+        format_dir = Path(tempfile.mkdtemp(prefix="math-format-", dir=self._tmp_dir))
+        preamble_file_path = format_dir / "preamble.tex"
+        start = time.perf_counter()
+
+        try:
+            with open(preamble_file_path, "w", encoding="utf-8") as preamble_file:
+                preamble_file.write(self._preamble().removesuffix("\\begin{document}"))
+                preamble_file.write("\n\\dump\n")
+            self._run_latex("-ini", "-jobname=preamble", "&latex", preamble_file_path, cwd=format_dir)
+        except (IOError, ECMDSPluginError):
+            pass
+
+        # fall back to loading the packages in every run
+        format_file = format_dir / "preamble.fmt"
+        self._format_file = format_file if format_file.is_file() else False
+
+        return time.perf_counter() - start
+
+    def _render_shard(self, nodes):
+        """Write the formulae of @nodes to a LaTeX file in a directory of its
+        own, compile it and convert it to images. Returns depth and image
+        data per formula."""
+
+        shard_dir = Path(tempfile.mkdtemp(prefix="math-", dir=self._tmp_dir))
+        tex_file_path = shard_dir / "formulae.tex"
+
+        if self._format_file:
+            # cache entries aren't named like format files
+            try:
+                os.link(self._format_file, shard_dir / "preamble.fmt")
+            except OSError:
+                try:
+                    shutil.copyfile(self._format_file, shard_dir / "preamble.fmt")
+                except OSError:
+                    raise ECMDSPluginError("Could not copy the preloaded LaTeX format.", "math")
+            header, options = "\\begin{document}", ["-fmt=preamble"]
+        else:
+            header, options = self._preamble(), []
 
         try:
-            with open(tmp_tex_file_path, "w", encoding="utf-8") as tex_file:
-                tex_file.write(self.out.getvalue())
+            with open(tex_file_path, "w", encoding="utf-8") as tex_file:
+                tex_file.write(header)
+                # give each formula one page
+                for _, formula in nodes:
+                    tex_file.write("$%s$\n\\clearpage{}\n" % formula)
+                tex_file.write("\\end{document}\n")
         except IOError:
             raise ECMDSPluginError("Error while writing temporary TeX file.", "math")
 
+        # a second pass is only needed, if the first one left information
+        passes = []
         for _ in range(2):
+            start = time.perf_counter()
             try:
-                self._run_latex(tmp_tex_file_path, cwd=self._tmp_dir)
+                self._run_latex(*options, tex_file_path, cwd=shard_dir)
             except ECMDSPluginError:
                 raise ECMDSPluginError("Could not compile temporary TeX file.", "math")
+            passes.append(time.perf_counter() - start)
+
+            if not self._needs_rerun(tex_file_path):
+                break
+
+        self._shard_passes.append(passes)
 
         # determine dvi file name
-        dvi_file_path = self._tmp_dir / tmp_tex_file_path.with_suffix(".dvi").name
+        dvi_file_path = tex_file_path.with_suffix(".dvi")
+
+        if self._output == "svg":
+            images = self._dvi_to_svg(dvi_file_path)
+        else:
+            images = self._dvi_to_gif(dvi_file_path)
+
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+        # one page per formula
+        if len(images) < len(nodes):
+            raise ECMDSPluginError(f"Missing image for formula on page {len(images) + 1}.", "math")
+
+        return images
+
+    @staticmethod
+    def _needs_rerun(tex_file_path):
+        """Check the log for rerun warnings and the aux file for data, that
+        the next pass would read, e.g. Unicode pages used by ucs."""
+
+        try:
+            aux = tex_file_path.with_suffix(".aux").read_text(encoding="utf-8", errors="replace")
+        except IOError:
+            aux = ""
+
+        for line in aux.splitlines():
+            if line.strip() and not TRIVIAL_AUX_PATTERN.fullmatch(line.strip()):
+                return True
 
-        # convert dvi file to GIF image
         try:
-            result = self._run_dvipng(dvi_file_path)
+            log = tex_file_path.with_suffix(".log").read_text(encoding="utf-8", errors="replace")
+        except IOError:
+            return True
+
+        return RERUN_PATTERN.search(log) is not None
+
+    def _report_passes(self, num_shards, format_build_s):
+        """Add the LaTeX passes run and an estimate of the time saved by
+        skipping passes to the statistics. @format_build_s is the time spent
+        on building the format during this flush."""
+
+        passes = [elapsed for shard_passes in self._shard_passes for elapsed in shard_passes]
+        skipped = [shard_passes[0] for shard_passes in self._shard_passes if len(shard_passes) == 1]
+
+        # a skipped pass would have taken as long as the first one
+        saved_s = sum(skipped)
+
+        self.statistics.update(
+            {
+                "shards": num_shards,
+                "latex_passes": len(passes),
+                "latex_passes_skipped": len(skipped),
+                "latex_s": sum(passes),
+                "format_s": format_build_s,
+                "saved_s": saved_s,
+            }
+        )
+
+        self._shard_passes = []
+
+    def _dvi_to_gif(self, dvi_file_path):
+        """Convert each page of the dvi file to a GIF image."""
+
+        try:
+            result = self._run_dvipng("-o", dvi_file_path.parent / "p%06d.gif", dvi_file_path)
         except ECMDSPluginError:
             raise ECMDSPluginError(f"Could not convert dvi file {dvi_file_path} to GIF images.", "math")
 
         # look for [??? depth=???px]
-        rexpr = re.compile("\\[[0-9]* depth=[0-9]*\\]")
+        rexpr = re.compile("\\[([0-9]*) depth=([0-9]*)\\]")
+
+        images = []
+        for match in rexpr.finditer(result):
+            page, depth = match.groups()
+            try:
+                images.append((depth + "px", (dvi_file_path.parent / ("p%06d.gif" % int(page))).read_bytes()))
+            except (IOError, ValueError):
+                raise ECMDSPluginError(f"Missing image for formula on page {page}.", "math")
+
+        return images
+
+    def _dvi_to_svg(self, dvi_file_path):
+        """Convert each page of the dvi file to an SVG drawing."""
+
+        try:
+            result = self._run_dvisvgm("--output=" + str(dvi_file_path.parent / "p%p.svg"), dvi_file_path)
+        except ECMDSPluginError:
+            raise ECMDSPluginError(f"Could not convert dvi file {dvi_file_path} to SVG images.", "math")
+
+        # dvisvgm may pad page numbers with zeros
+        svg_files = {int(file_path.stem[1:]): file_path for file_path in dvi_file_path.parent.glob("p*.svg")}
+
+        # reports are introduced by "processing page ???" and contain depth=???pt
+        reports = re.split("processing page ([0-9]+)", result)
+
+        images = []
+        for page, report in zip(reports[1::2], reports[2::2]):
+            match = re.search("depth=(-?[0-9.]+)pt", report)
+            try:
+                images.append((f"{match.group(1) if match else 0}pt", svg_files[int(page)].read_bytes()))
+            except (IOError, KeyError):
+                raise ECMDSPluginError(f"Missing image for formula on page {page}.", "math")
 
-        # add style property to node
-        for match, node in zip(rexpr.finditer(result), self._nodes):
-            align = match.group().split("=")[1].strip(" []")
-            node.attrib["style"] = "vertical-align: -" + align + "px;"
+        return images
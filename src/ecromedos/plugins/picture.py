@@ -3,14 +3,21 @@
 # License: MIT
 # URL:     http://www.ecromedos.net
 
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
 from pathlib import Path
 import re
 import shutil
 import tempfile
 
 from ecromedos.argumentparser import GeneratorType
-from ecromedos.error import ECMDSPluginError
-from ecromedos.helpers import ExternalTool
+from ecromedos.diskcache import ECMDSDiskCache, parse_size
+from ecromedos.error import ECMDSError, ECMDSPluginError
+from ecromedos.helpers import ExternalTool, get_cache_dir, is_enabled
+from ecromedos.imageconvert import ECMDSPillowConverter, pillow_available
+from ecromedos.imagesize import image_size
+from ecromedos.incremental import file_digest
 
 
 def getInstance(config):
@@ -18,6 +25,10 @@ def getInstance(config):
     return Plugin(config)
 
 
+# formats that gain detail when rendered at a larger width
+VECTOR_SUFFIXES = [".eps", ".pdf", ".svg"]
+
+
 class Plugin:
     _DEFAULT_RESOLUTION_DPI = 100
 
@@ -25,15 +36,43 @@ class Plugin:
         self._counter = 1
         self.imgmap = {}
         self.imgwidth = {}
+        self.imgsrcset = {}
+
+        # widths of source images by path and modification time
+        self._widths = {}
 
-        self._run_convert = ExternalTool(
-            "convert", "-antialias", "-density", config.get("convert_dpi", self._DEFAULT_RESOLUTION_DPI)
-        )
+        self._dpi = config.get("convert_dpi", self._DEFAULT_RESOLUTION_DPI)
+        self._run_convert = ExternalTool("convert", "-antialias", "-density", self._dpi)
         self._run_identify = ExternalTool("identify")
 
+        # converts common raster images in-process, if selected
+        self._pillow = self._open_backend(config)
+
         # temporary directory
         self._tmp_dir = Path(config["tmp_dir"])
 
+        # results of the previous build in incremental mode and of all
+        # earlier runs, looked up in this order
+        self._build_cache = config.get("build_cache")
+        self._disk_cache = self._open_cache(config)
+
+        # conversions queued by process() and run in parallel on flush(), all
+        # widths of an image for XHTML are made in one job
+        self._jobs = []
+        self._variants = {}
+
+        # extra pixel densities for high resolution screens
+        try:
+            densities = config.get("picture_srcset", "").replace(",", " ").split()
+            self._densities = [d for d in (float(d.removesuffix("x")) for d in densities) if d > 1]
+        except ValueError:
+            raise ECMDSPluginError("The value of picture_srcset must be a list of densities like 2x.", "picture")
+
+        try:
+            self._max_workers = max(1, int(config.get("picture_workers") or os.cpu_count() or 1))
+        except ValueError:
+            raise ECMDSPluginError("The value of picture_workers must be a number.", "picture")
+
     def process(self, node, format):
         """Prepare @node for target @format."""
 
@@ -47,16 +86,25 @@ class Plugin:
         return node
 
     def flush(self):
-        # reset counter
-        self._counter = 1
-        self.imgmap = {}
-        self.imgwidth = {}
+        try:
+            self._run_jobs()
+        finally:
+            # reset counter
+            self._counter = 1
+            self.imgmap = {}
+            self.imgwidth = {}
+            self.imgsrcset = {}
+            self._jobs = []
+            self._variants = {}
 
     def LaTeX_prepareImg(self, node, format="eps"):
         # get image src path
         src = self._get_image_source_path(node)
         dst = ""
 
+        if self._build_cache is not None:
+            self._build_cache.add_dependency(src)
+
         # check if we used this image before
         try:
             dst = self.imgmap[src][0]
@@ -66,10 +114,11 @@ class Plugin:
 
             if not (extension := src.suffix[1:]) == format:
                 if extension == ".eps" and format == "pdf":
-                    self._eps_to_pdf(src, dst)
+                    self._queue(node, self._eps_to_pdf, src, dst)
                 else:
-                    self._convert_image(src, dst)
+                    self._queue(node, self._convert_image, src, dst)
             else:
+                Path(dst).unlink(missing_ok=True)
                 shutil.copyfile(src, dst)
 
             self.imgmap[src] = [dst]
@@ -82,12 +131,15 @@ class Plugin:
         src = self._get_image_source_path(node)
         dst = ""
 
+        if self._build_cache is not None:
+            self._build_cache.add_dependency(src)
+
         width = node.attrib.get("screen-width", None)
 
         if width:
             width = re.match("[1-9][0-9]*", width).group()
         else:
-            width = self._identify_width(src)
+            width = self._image_width(src)
 
         try:
             imglist = self.imgmap[src]
@@ -107,18 +159,33 @@ class Plugin:
 
             if ext.casefold() in ["jpg", "gif", "png"]:
                 dst = "img%06d.%s" % (self._counter, ext.lower())
-                self._convert_image(src, dst, width)
             else:
                 dst = "img%06d.jpg" % (self._counter,)
-                self._convert_image(src, dst, width)
+
+            dst = self._add_variant(node, src, dst, width)
+            srcset = [f"{dst} 1x"]
+
+            # larger variants for high resolution screens, but no upscaled bitmaps
+            for density in self._densities:
+                variant_width = round(int(width) * density)
+                if src.suffix.lower() not in VECTOR_SUFFIXES and variant_width > int(self._image_width(src)):
+                    continue
+
+                variant_dst = "%s-%gx%s" % (Path(dst).stem, density, Path(dst).suffix)
+                variant_dst = self._add_variant(node, src, variant_dst, str(variant_width))
+                srcset.append(f"{variant_dst} {density:g}x")
 
             self.imgwidth[dst] = width
+            self.imgsrcset[dst] = ", ".join(srcset) if len(srcset) > 1 else None
             self.imgmap.setdefault(src, []).append(dst)
             self._counter += 1
 
         # set src attribute to new file
         node.attrib["src"] = dst
 
+        if srcset := self.imgsrcset.get(dst):
+            node.attrib["srcset"] = srcset
+
     @staticmethod
     def _get_image_source_path(node):
         # location of image
@@ -143,7 +210,218 @@ class Plugin:
 
         return src
 
+    @staticmethod
+    def _open_cache(config):
+        """Open the persistent image cache, unless it is disabled."""
+
+        if not is_enabled(config, "picture_cache") or not (cache_dir := get_cache_dir(config)):
+            return None
+
+        try:
+            max_size = parse_size(config.get("picture_cache_size", "256M"))
+        except ECMDSError as e:
+            raise ECMDSPluginError(e.msg(), "picture")
+
+        return ECMDSDiskCache(cache_dir / "picture", max_size=max_size)
+
+    def _queue(self, node, convert, src, dst, *args):
+        """Schedule the conversion of @src to @dst for the next flush()."""
+        self._jobs.append((node.sourceline, self._cached, (convert, src, dst, *args)))
+
+    def _add_variant(self, node, src, dst, width):
+        """Schedule scaling @src to @width for @dst, together with all other
+        widths of @src. Returns the name of the file that will hold it, which
+        is that of an earlier variant of the same width, if there is one."""
+
+        sourceline, variants = self._variants.setdefault(src, (node.sourceline, []))
+
+        for variant_dst, variant_width in variants:
+            if variant_width == width:
+                return variant_dst
+
+        variants.append((dst, width))
+        return dst
+
+    def _run_jobs(self):
+        """Run the queued conversions in a pool of threads, each waiting for
+        its own convert process. Stop at the first error, which names the
+        line of the img tag."""
+
+        jobs = self._jobs + [
+            (sourceline, self._cached_variants, (src, variants))
+            for src, (sourceline, variants) in self._variants.items()
+        ]
+
+        if not jobs:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(jobs))) as executor:
+            futures = [(sourceline, executor.submit(self._run_job, job, *args)) for sourceline, job, args in jobs]
+
+            for sourceline, future in futures:
+                try:
+                    future.result()
+                except ECMDSPluginError as e:
+                    executor.shutdown(cancel_futures=True)
+                    msg = f"{e.msg().rstrip('.')} as specified in 'img' tag on line {sourceline}."
+                    raise ECMDSPluginError(msg, "picture")
+
+    @staticmethod
+    def _run_job(job, *args):
+        """Run @job, reporting failures to place files as plugin errors."""
+
+        try:
+            return job(*args)
+        except OSError as e:
+            raise ECMDSPluginError(f"Could not write image file: {e}", "picture")
+
+    @staticmethod
+    def _open_backend(config):
+        """Select the converter for raster images by picture_backend."""
+
+        backend = config.get("picture_backend", "imagemagick")
+
+        if backend == "imagemagick":
+            return None
+        if backend == "pillow":
+            return ECMDSPillowConverter()
+        if backend == "auto":
+            return ECMDSPillowConverter() if pillow_available() else None
+
+        msg = f"Unknown picture_backend '{backend}', expected imagemagick, pillow or auto."
+        raise ECMDSPluginError(msg, "picture")
+
+    def _cached(self, convert, src, dst, *args):
+        """Run @convert, unless the same file was converted in the same way by
+        the previous build or any earlier run."""
+
+        # don't write through a hard link into the persistent cache
+        Path(dst).unlink(missing_ok=True)
+
+        if self._build_cache is None and self._disk_cache is None:
+            return convert(src, dst, *args)
+
+        key = self._image_key(convert, src, dst, *args)
+
+        if not self._restore(key, dst):
+            convert(src, dst, *args)
+            self._store(key, dst)
+
+    def _cached_variants(self, src, variants):
+        """Scale @src to all (dst, width) @variants, which are not found in a
+        cache, decoding it only once."""
+
+        for dst, _ in variants:
+            Path(dst).unlink(missing_ok=True)
+
+        if self._build_cache is None and self._disk_cache is None:
+            return self._convert_variants(src, variants)
+
+        keys = {dst: self._image_key(self._convert_image, src, dst, width) for dst, width in variants}
+
+        if missing := [(dst, width) for dst, width in variants if not self._restore(keys[dst], dst)]:
+            self._convert_variants(src, missing)
+            for dst, _ in missing:
+                self._store(keys[dst], dst)
+
+    def _restore(self, key, dst):
+        """Write the file stored under @key to @dst. Files from the persistent
+        cache are hard linked into place, or copied where that is not
+        possible. Returns False, if @key is not in a cache."""
+
+        if self._build_cache is not None and (data := self._build_cache.get("picture", key)) is not None:
+            with open(dst, "wb") as f:
+                f.write(data)
+            return True
+
+        if self._disk_cache is not None and (entry_path := self._disk_cache.get_file("picture", key)) is not None:
+            try:
+                try:
+                    os.link(entry_path, dst)
+                except OSError:
+                    shutil.copyfile(entry_path, dst)
+            except OSError:
+                # evicted meanwhile
+                return False
+
+            if self._build_cache is not None:
+                self._build_cache.put("picture", key, Path(dst).read_bytes())
+            return True
+
+        return False
+
+    def _store(self, key, dst):
+        if self._disk_cache is not None:
+            self._disk_cache.put_file("picture", key, dst)
+        if self._build_cache is not None:
+            self._build_cache.put("picture", key, Path(dst).read_bytes())
+
+    def _image_key(self, convert, src, dst, *args):
+        # the destination format also decides on removing the alpha channel
+        backend = "imagemagick" if self._pillow is None else "pillow"
+        return json.dumps([convert.__name__, backend, file_digest(src), Path(dst).suffix, self._dpi, *args])
+
+    def _image_width(self, src):
+        """Return the width of @src in pixels as a string. It is read from the
+        file header, only exotic formats are passed to identify."""
+
+        key = (src, src.stat().st_mtime_ns)
+
+        if (width := self._widths.get(key)) is None:
+            if (size := image_size(src)) is not None:
+                width = str(size[0])
+            else:
+                width = self._identify_width_cached(src)
+            self._widths[key] = width
+
+        return width
+
+    def _identify_width_cached(self, src):
+        caches = [cache for cache in [self._build_cache, self._disk_cache] if cache is not None]
+        if not caches:
+            return self._identify_width(src)
+
+        key = json.dumps(["width", file_digest(src)])
+
+        for cache in caches:
+            if (data := cache.get("picture", key)) is not None:
+                return data.decode("utf-8")
+
+        width = self._identify_width(src)
+        for cache in caches:
+            cache.put("picture", key, width.encode("utf-8"))
+        return width
+
+    def _convert_variants(self, src, variants):
+        """Scale @src to all (dst, width) @variants in one run of convert,
+        which writes a scaled copy of the image for each but the last."""
+
+        if len(variants) == 1:
+            return self._convert_image(src, *variants[0])
+
+        if self._pillow is not None and self._pillow.convert_variants(src, variants):
+            return
+
+        args = []
+
+        # all variants have the same format
+        if not variants[0][0][-4:] in [".png", ".pdf", ".svg", ".eps"]:
+            args += ["-alpha", "remove"]
+
+        for dst, width in variants[:-1]:
+            args += ["(", "+clone", "-scale", width + "x", "-write", dst, "+delete", ")"]
+
+        dst, width = variants[-1]
+
+        try:
+            self._run_convert(src, *args, "-scale", width + "x", dst)
+        except ECMDSPluginError:
+            raise ECMDSPluginError(f"Could not convert graphics file {src}.", "picture")
+
     def _convert_image(self, src, dst, width=None):
+        if self._pillow is not None and self._pillow.convert(src, dst, width):
+            return
+
         # build command line
         args = ["-scale", width + "x"] if width else []
 
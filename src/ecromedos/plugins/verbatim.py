@@ -3,6 +3,8 @@
 # License: MIT
 # URL:     http://www.ecromedos.net
 
+from ecromedos.latexescape import escape_verbatim
+
 
 def getInstance(config):
     """Returns a plugin instance."""
@@ -37,80 +39,9 @@ class Plugin:
 
     def XHTML_verbatimString(self, string, tab_spaces):
         """Replaces tabs with spaces."""
-
-        frame_start = 0
-        frame_end = 0
-        parts = []
-        length = len(string)
-        while frame_end < length:
-            ch = string[frame_end]
-            if ch == "\t":
-                parts.append(string[frame_start:frame_end])
-                parts.append(" " * tab_spaces)
-                frame_end += 1
-                frame_start = frame_end
-            else:
-                frame_end += 1
-
-        if frame_end > frame_start:
-            parts.append(string[frame_start:frame_end])
-
-        return "".join(parts)
+        return string.replace("\t", " " * tab_spaces)
 
     def LaTeX_verbatimString(self, string, tab_spaces):
         """Replace any character that could have a special meaning in some
         context in LaTeX with a macro. But don't touch whitespace."""
-
-        lookup_table = {
-            "[": "{[}",
-            "]": "{]}",
-            "{": "\\{{}",
-            "}": "\\}{}",
-            "#": "\\#{}",
-            "&": "\\&{}",
-            "_": "\\_{}",
-            "%": "\\%{}",
-            "$": "\\${}",
-            "^": "\\^{}",
-            "\\": "\\textbackslash{}",
-            "~": "\\textasciitilde{}",
-            "-": "{}{-}{}",
-            ":": "{}{:}{}",
-            ";": "{}{;}{}",
-            "!": "{}{!}{}",
-            "?": "{}{?}{}",
-            '"': '{}{"}{}',
-            "`": "{}{`}{}",
-            "'": "{}{'}{}",
-            "=": "{}{=}{}",
-            "\t": "\t",
-        }
-
-        frame_start = 0
-        frame_end = 0
-        parts = []
-        length = len(string)
-
-        while frame_end < length:
-            ch = string[frame_end]
-            # look for translation
-            try:
-                escape_sequence = lookup_table[ch]
-            except KeyError:
-                escape_sequence = ""
-            if escape_sequence:
-                if frame_end > frame_start:
-                    parts.append(string[frame_start:frame_end])
-                if ch == "\t":
-                    parts.append(" " * tab_spaces)
-                else:
-                    parts.append(escape_sequence)
-                frame_end += 1
-                frame_start = frame_end
-            else:
-                frame_end += 1
-
-        if frame_end > frame_start:
-            parts.append(string[frame_start:frame_end])
-
-        return "".join(parts)
+        return escape_verbatim(string, tab_spaces)
@@ -9,6 +9,41 @@ import sys
 
 from ecromedos.error import ECMDSError
 from ecromedos.helpers import progress
+from ecromedos.metrics import ECMDSMetrics, ECMDSPluginProfile
+
+
+class _DispatchPlan:
+    """The plugins map resolved for one target format: the plugin instances to
+    call per tag and for text, without plugins, which declare through an
+    accepts(format) method that they have nothing to do for the format."""
+
+    def __init__(self, plugins_map, plugins, target_format):
+        def resolve(plugin_names):
+            chain = []
+            for plugin_name in plugin_names:
+                # unknown plugins are reported when they are needed
+                plugin = plugins.get(plugin_name)
+                if plugin is not None and hasattr(plugin, "accepts") and not plugin.accepts(target_format):
+                    continue
+                chain.append((plugin_name, plugin))
+            return tuple(chain)
+
+        self.elements = {}
+        for tag, plugin_names in plugins_map.items():
+            if tag != "@text" and (chain := resolve(plugin_names)):
+                self.elements[tag] = chain
+
+        self.text = resolve(plugins_map.get("@text", []))
+
+        # plugins, which look at the whole document before the walk
+        self.preparers = []
+        for chain in self.elements.values():
+            for plugin_name, plugin in chain:
+                if hasattr(plugin, "prepare") and (plugin_name, plugin) not in self.preparers:
+                    self.preparers.append((plugin_name, plugin))
+
+        # copy elements are visited as well, to skip over their content
+        self.tags = frozenset(self.elements) | {"copy"}
 
 
 class ECMDSPreprocessor:
@@ -16,6 +51,14 @@ class ECMDSPreprocessor:
         self._configuration = configuration
         self._plugins_map = plugins_map
         self._plugins = self._load_plugins()
+        self._plans = {}
+
+        # number of slowest plugin calls to report, 0 disables profiling
+        try:
+            self._profile_slowest = int(configuration.get("profile_plugins") or 0)
+        except ValueError:
+            raise ECMDSError("The value of profile_plugins must be a number.")
+        self._profile = None
 
     def _iter_plugin_paths(self):
         try:
@@ -55,30 +98,100 @@ class ECMDSPreprocessor:
 
         return plugins
 
+    def reloadPlugins(self):
+        """Discard all plugin instances and their state and load them anew."""
+        self._plugins = self._load_plugins()
+        self._plans = {}
+
     @progress(description="Preprocessing document tree...", final_status="DONE")
-    def prepareDocument(self, document, target_format):
-        """Prepare document tree for transformation."""
+    def prepareDocument(self, document, target_format, metrics=None):
+        """Prepare document tree for transformation.
+
+        Plugins see elements and text in document order. The content of copy
+        elements and of elements marked final is left alone. If no text
+        plugin applies to the target format, only elements with plugins
+        registered for their tag are visited, which lxml finds without
+        handing every node to Python.
+
+        Element plugins with a prepare(root, format) method are given the
+        whole tree before the walk, e.g. to process their elements in bulk.
+
+        The number of elements and text nodes visited, the time spent in the
+        plugins' flush() and the plugins' statistics are recorded in @metrics,
+        as is the plugin profile, if profiling is enabled."""
+
+        metrics = metrics or ECMDSMetrics()
+
+        if (plan := self._plans.get(target_format)) is None:
+            plan = self._plans[target_format] = _DispatchPlan(self._plugins_map, self._plugins, target_format)
+
+        if self._profile_slowest > 0:
+            self._profile = metrics.plugin_profile = ECMDSPluginProfile(slowest=self._profile_slowest)
+        else:
+            self._profile = None
+
+        root = document.getroot()
+
+        if plan.preparers:
+            with metrics.phase("prepare"):
+                self._prepare_plugins(plan.preparers, root, target_format)
+
+        # final markers can't be found by tag, look at every node if the source has them
+        if plan.text or root.xpath("boolean(//@final)"):
+            elements, strings = self._walk_all(root, plan, target_format)
+            metrics.count("preprocess", "traversal", "full")
+        else:
+            elements, strings = self._walk_tagged(root, plan, target_format), 0
+            metrics.count("preprocess", "traversal", "targeted")
+
+        metrics.count("preprocess", "elements", elements)
+        metrics.count("preprocess", "text_nodes", strings)
+
+        # call post-actions
+        with metrics.phase("flush"):
+            self._flush_plugins()
+
+        for plugin_name, plugin in self._plugins.items():
+            if statistics := getattr(plugin, "statistics", None):
+                metrics.plugin_statistics[plugin_name] = dict(statistics)
+
+        return document
 
-        node = document.getroot()
+    def _walk_all(self, root, plan, format):
+        """Visit every element, text and tail in document order."""
+
+        elements = 0
+        strings = 0
+        element_chains = plan.elements
+        text_chain = plan.text
+
+        node = root
 
         while node is not None:
-            node = self._process_node(node, target_format)
+            if self._profile is not None:
+                self._profile.locate(node)
+
+            if chain := element_chains.get(node.tag):
+                node = self._dispatch(chain, node, format)
+            elements += 1
 
             if node.tag == "copy" or node.attrib.get("final", "no") == "yes":
                 is_final = True
             else:
                 is_final = False
 
-            if not is_final and node.text:
-                node.text = self._process_node(node.text, target_format)
+            if text_chain and not is_final and node.text:
+                node.text = self._dispatch(text_chain, node.text, format)
+                strings += 1
 
             if not is_final and len(node) != 0:
                 node = node[0]
                 continue
 
             while node is not None:
-                if node.tail:
-                    node.tail = self._process_node(node.tail, target_format)
+                if text_chain and node.tail:
+                    node.tail = self._dispatch(text_chain, node.tail, format)
+                    strings += 1
 
                 following_sibling = node.getnext()
 
@@ -88,31 +201,89 @@ class ECMDSPreprocessor:
 
                 node = node.getparent()
 
-        # call post-actions
-        self._flush_plugins()
+        return elements, strings
 
-        return document
+    def _walk_tagged(self, root, plan, format):
+        """Visit only elements with plugins registered for their tag.
 
-    def _process_node(self, node, format):
-        """Check if there is a filter registered for node."""
+        To keep lxml's tag matching cheap, only tags occurring in the document
+        are looked for. Elements returned by plugins in place of the original
+        or with a different number of children are checked for new tags."""
 
-        plugins = self._plugins_map.get("@text" if isinstance(node, str) else node.tag, [])
+        elements = 0
+        element_chains = plan.elements
 
-        # pass node through plugins
-        for plugin_name in plugins:
-            try:
-                plugin = self._plugins[plugin_name]
-            except KeyError:
+        # lxml builds its tag matcher on every call, keep it small
+        tags = {node.tag for node in root.iter(*plan.tags)} | {"copy"}
+
+        node = root if root.tag in tags else self._next_element(root, tags, descend=True)
+
+        while node is not None:
+            if self._profile is not None:
+                self._profile.locate(node)
+
+            if chain := element_chains.get(node.tag):
+                num_children = len(node)
+                result = self._dispatch(chain, node, format)
+                # plugins replace elements or add content, e.g. the index
+                if result is not node or len(result) != num_children:
+                    tags.update(plan.tags.intersection(element.tag for element in result.iter()))
+                node = result
+            elements += 1
+
+            is_final = node.tag == "copy" or node.attrib.get("final", "no") == "yes"
+            node = self._next_element(node, tags, descend=not is_final)
+
+        return elements
+
+    @staticmethod
+    def _next_element(node, tags, descend):
+        """Find the next element in document order after @node, which has one
+        of the given @tags. Unless @descend is set, @node's content is skipped."""
+
+        if descend and len(node) != 0:
+            for element in node.iterdescendants(*tags):
+                return element
+
+        while node is not None:
+            for sibling in node.itersiblings():
+                if sibling.tag in tags:
+                    return sibling
+                if len(sibling) != 0:
+                    for element in sibling.iterdescendants(*tags):
+                        return element
+            node = node.getparent()
+
+        return None
+
+    def _dispatch(self, chain, node, format):
+        """Pass node through the plugins in @chain."""
+
+        for plugin_name, plugin in chain:
+            if plugin is None:
                 raise ECMDSError(f"No plugin named {plugin_name} registered.")
-            else:
-                try:
+            try:
+                if self._profile is None:
                     node = plugin.process(node, format)
-                except Exception as ex:
-                    raise ECMDSError(f"Plugin {plugin_name} caused an exception: {ex}")
+                else:
+                    node = self._profile.process(plugin_name, plugin, node, format)
+            except Exception as ex:
+                raise ECMDSError(f"Plugin {plugin_name} caused an exception: {ex}")
 
         return node
 
+    def _prepare_plugins(self, preparers, root, format):
+        """Let plugins look at the document before it is walked."""
+        for plugin_name, plugin in preparers:
+            try:
+                plugin.prepare(root, format)
+            except Exception as ex:
+                raise ECMDSError(f"Plugin {plugin_name} caused an exception: {ex}")
+
     def _flush_plugins(self):
         """Call flush function of all registered plugins."""
-        for plugin in self._plugins.values():
-            plugin.flush()
+        for plugin_name, plugin in self._plugins.items():
+            if self._profile is None:
+                plugin.flush()
+            else:
+                self._profile.flush(plugin_name, plugin)
@@ -0,0 +1,192 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import json
+import os
+from pathlib import Path
+import socket
+import signal
+import socketserver
+import sys
+import tempfile
+import time
+
+from ecromedos.argumentparser import GeneratorType
+from ecromedos.error import ECMDSError, ECMDSServerUnavailable
+from ecromedos.pipeline import ECMDSPipeline
+
+
+class ECMDSRenderServer(socketserver.UnixStreamServer):
+    """Long-lived render server listening on a Unix domain socket.
+
+    The server keeps one pipeline per target format in memory and rebuilds it,
+    when configuration, plugin or stylesheet files change on disk. Requests
+    are handled one after another, because rendering changes into the output
+    directory of the job.
+
+    The protocol is line-based: a client sends one JSON object per job,
+
+        {"source_file": ..., "output_dir": ..., "format": ..., "parameters": {...}}
+
+    and receives one JSON object with the fields "status", "elapsed" and, in
+    case of success, "metrics" or, in case of failure, "message"."""
+
+    def __init__(self, socket_path, config_file_path, validation_enabled=None, options=None):
+        self._socket_path = Path(socket_path)
+        self._config_file_path = config_file_path
+        self._validation_enabled = validation_enabled
+        self._options = options
+        self._pipelines = {}
+
+        if self._socket_path.is_socket():
+            self._remove_stale_socket()
+
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix="ecmds-")
+        super().__init__(str(self._socket_path), ECMDSRenderRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self._socket_path.unlink(missing_ok=True)
+        self._tmp_dir.cleanup()
+
+    def _remove_stale_socket(self):
+        """Remove the socket left behind by a server, which is gone, but not
+        the one of a server, which is still running."""
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(self._socket_path))
+            except (FileNotFoundError, ConnectionRefusedError):
+                self._socket_path.unlink(missing_ok=True)
+                return
+            except OSError as e:
+                raise ECMDSError(f"Could not check the socket at {self._socket_path}: {e}")
+
+        raise ECMDSError(f"A render server is already listening at {self._socket_path}.")
+
+    def get_pipeline(self, target_format):
+        """Return a warm pipeline for @target_format, rebuild it if it is stale."""
+
+        pipeline = self._pipelines.get(target_format)
+
+        if pipeline is not None and pipeline.is_stale():
+            print(f" * Reloading pipeline for {pipeline.target_format}.")
+            pipeline = None
+
+        if pipeline is None:
+            format_tmp_dir = Path(self._tmp_dir.name) / str(target_format or "default")
+            format_tmp_dir.mkdir(exist_ok=True)
+
+            pipeline = ECMDSPipeline(
+                config_file_path=self._config_file_path,
+                target_format=target_format,
+                validation_enabled=self._validation_enabled,
+                tmp_dir=format_tmp_dir,
+                options=self._options,
+            )
+            self._pipelines[target_format] = pipeline
+
+        return pipeline
+
+    def render(self, job):
+        """Execute a single render @job and return the response object."""
+
+        start = time.perf_counter()
+
+        try:
+            source_file = job["source_file"]
+        except KeyError:
+            return {"status": "error", "message": "Missing 'source_file' in request.", "elapsed": 0.0}
+
+        try:
+            target_format = GeneratorType(job["format"]) if job.get("format") else None
+        except ValueError:
+            return {"status": "error", "message": f"Unknown output format '{job['format']}'.", "elapsed": 0.0}
+
+        try:
+            pipeline = self.get_pipeline(target_format)
+            pipeline.render(
+                source_file,
+                output_dir=job.get("output_dir"),
+                xsl_parameters=job.get("parameters", {}),
+                verbose=False,
+            )
+        except ECMDSError as e:
+            status = {"status": "error", "message": e.msg()}
+        except Exception as e:
+            status = {"status": "error", "message": f"Unexpected error: {e}"}
+        else:
+            status = {"status": "ok", "metrics": pipeline.metrics.as_dict()}
+
+        status["elapsed"] = time.perf_counter() - start
+        print(f" * {source_file}: {status['status']} ({status['elapsed']:.3f}s)")
+        return status
+
+
+class ECMDSRenderRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                response = {"status": "error", "message": f"Malformed request: {e}", "elapsed": 0.0}
+            else:
+                response = self.server.render(job)
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def submit_job(socket_path, source_file, output_dir=None, target_format=None, xsl_parameters=None):
+    """Send a render job to the server listening on @socket_path and wait for the
+    result. Raises ECMDSServerUnavailable, if no server is listening."""
+
+    job = {
+        "source_file": str(Path(source_file).absolute()),
+        "output_dir": str(Path(output_dir or os.getcwd()).absolute()),
+        "format": target_format,
+        "parameters": xsl_parameters or {},
+    }
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(socket_path))
+            except (FileNotFoundError, ConnectionRefusedError):
+                raise ECMDSServerUnavailable(f"No render server is listening at {socket_path}.")
+            with sock.makefile("rwb") as stream:
+                stream.write(json.dumps(job).encode("utf-8") + b"\n")
+                stream.flush()
+                response = stream.readline()
+    except OSError as e:
+        raise ECMDSError(f"Could not talk to render server at {socket_path}: {e}")
+
+    try:
+        response = json.loads(response)
+    except ValueError:
+        raise ECMDSError(f"Invalid response from render server at {socket_path}.")
+
+    if response.get("status") != "ok":
+        raise ECMDSError(response.get("message", "Render server reported an unknown error."))
+
+    return response
+
+
+def serve(socket_path, config_file_path, validation_enabled=None, options=None):
+    """Run the render server until interrupted or terminated."""
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    with ECMDSRenderServer(
+        socket_path, config_file_path, validation_enabled=validation_enabled, options=options
+    ) as server:
+        print(f" * Listening on {socket_path}", file=sys.stderr)
+        server.serve_forever()
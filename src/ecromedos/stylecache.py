@@ -0,0 +1,105 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import os
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import lxml.etree as etree
+
+from ecromedos.error import ECMDSError
+
+# compiled stylesheets by (style_dir, target_format), shared by all processors
+_compiled_stylesheets = {}
+
+
+class ECMDSStylesheetCache:
+    """Loads and compiles the stylesheets for a target format.
+
+    Compiled stylesheets are kept in memory per (style_dir, target_format) and
+    are shared between all processors in the process. An entry is reused as
+    long as none of the files in its include closure, i.e. the main
+    stylesheet and everything reachable through xsl:include and xsl:import,
+    changed on disk."""
+
+    def load(self, style_dir, target_format):
+        """Return the compiled stylesheet for @target_format in @style_dir."""
+
+        file_path = (Path(style_dir) / target_format / "ecmds.xsl").absolute()
+        key = self._key(style_dir, target_format)
+
+        if (entry := _compiled_stylesheets.get(key)) is not None:
+            fingerprint, stylesheet = entry
+            if self._fingerprint(fingerprint.keys()) == fingerprint:
+                return stylesheet
+
+        recorder = _ClosureRecorder(file_path)
+        tree = self._parse(file_path, recorder)
+
+        try:
+            stylesheet = etree.XSLT(tree)
+        except Exception as e:
+            raise ECMDSError(str(e))
+
+        _compiled_stylesheets[key] = (self._fingerprint(recorder.closure), stylesheet)
+        return stylesheet
+
+    def closure(self, style_dir, target_format):
+        """Return the files the stylesheet for @target_format in @style_dir
+        was compiled from, or an empty list, if it wasn't loaded."""
+
+        if (entry := _compiled_stylesheets.get(self._key(style_dir, target_format))) is None:
+            return []
+
+        fingerprint, _ = entry
+        return list(fingerprint)
+
+    @staticmethod
+    def clear():
+        """Drop all compiled stylesheets held in memory."""
+        _compiled_stylesheets.clear()
+
+    # PRIVATE
+
+    @staticmethod
+    def _key(style_dir, target_format):
+        return (str(Path(style_dir).absolute()), str(target_format))
+
+    @staticmethod
+    def _fingerprint(file_paths):
+        """Map each file to its modification time and size."""
+
+        fingerprint = {}
+        for file_path in file_paths:
+            try:
+                st = os.stat(file_path)
+                fingerprint[file_path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                fingerprint[file_path] = None
+        return fingerprint
+
+    @staticmethod
+    def _parse(file_path, resolver):
+        parser = etree.XMLParser(no_network=True)
+        parser.resolvers.add(resolver)
+        try:
+            return etree.parse(str(file_path), parser=parser)
+        except Exception as e:
+            raise ECMDSError(f"Could not load stylesheet:\n {e}")
+
+
+class _ClosureRecorder(etree.Resolver):
+    """Takes note of every file libxslt loads while compiling a stylesheet."""
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.closure = [str(file_path)]
+
+    def resolve(self, url, pubid, context):
+        if url and url.startswith("file:"):
+            url = unquote(urlparse(url).path)
+        if url and (file_path := os.path.normpath(url)) not in self.closure:
+            self.closure.append(file_path)
+        return None
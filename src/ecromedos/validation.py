@@ -0,0 +1,115 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import hashlib
+import os
+from pathlib import Path
+
+import lxml.etree as etree
+
+from ecromedos.error import ECMDSError
+
+# loaded DTDs by file path, shared by all processors and resolvers
+_dtds = {}
+
+
+class ECMDSDTD:
+    """A DTD file loaded into memory, both as raw text for the parser's
+    resolver and as validator."""
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+
+        try:
+            with open(self.file_path, "rb") as fp:
+                self.data = fp.read()
+            self.validator = etree.DTD(self.file_path)
+        except (IOError, etree.DTDParseError) as e:
+            raise ECMDSError(f"Could not load DTD {self.file_path}:\n {e}")
+
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+
+def _signature(file_path):
+    try:
+        st = os.stat(file_path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def load_dtd(style_dir):
+    """Return the process-wide instance of the ecromedos DTD in @style_dir,
+    loading it only if it is not in memory yet or changed on disk."""
+
+    file_path = str((Path(style_dir) / "DTD" / "ecromedos.dtd").absolute())
+    signature = _signature(file_path)
+
+    if (entry := _dtds.get(file_path)) is None or entry[0] != signature:
+        entry = _dtds[file_path] = (signature, ECMDSDTD(file_path))
+
+    return entry[1]
+
+
+class ECMDSValidationCache:
+    """Remembers documents that passed validation.
+
+    A document is identified by the content of its source file, the files
+    pulled in through external entities and the DTD. A marker file is kept
+    per identifier in @cache_dir, so that the information survives between
+    runs."""
+
+    def __init__(self, cache_dir):
+        self._cache_dir = Path(cache_dir) / "validated"
+        self._validated = set()
+
+    def digest(self, document, dtd):
+        """Compute the identifier of @document or None, if any of its
+        sources can't be read."""
+
+        if not (url := document.docinfo.URL):
+            return None
+
+        source_file = Path(url)
+        file_paths = [source_file]
+
+        if (internal_dtd := document.docinfo.internalDTD) is not None:
+            for entity in internal_dtd.iterentities():
+                if entity.system_url:
+                    file_paths.append(source_file.parent / entity.system_url)
+
+        h = hashlib.sha256(dtd.digest.encode("utf-8"))
+
+        try:
+            for file_path in file_paths:
+                with open(file_path, "rb") as fp:
+                    h.update(str(file_path).encode("utf-8") + b"\0")
+                    h.update(hashlib.sha256(fp.read()).digest())
+        except IOError:
+            return None
+
+        return h.hexdigest()
+
+    def __contains__(self, digest):
+        if digest is None:
+            return False
+        if digest in self._validated:
+            return True
+        if (self._cache_dir / digest).exists():
+            self._validated.add(digest)
+            return True
+        return False
+
+    def add(self, digest):
+        if digest is None:
+            return
+
+        self._validated.add(digest)
+
+        try:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            (self._cache_dir / digest).touch()
+        except OSError:
+            pass
@@ -0,0 +1,164 @@
+# Desc:    This file is part of the ecromedos Document Preparation System
+# Author:  Tobias Koch <tobias@tobijk.de>
+# License: MIT
+# URL:     http://www.ecromedos.net
+
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from ecromedos.error import ECMDSError
+from ecromedos.incremental import document_sources
+from ecromedos.metrics import print_plugin_profile, write_metrics
+from ecromedos.pipeline import ECMDSPipeline
+
+
+def _mtime(file_path):
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ECMDSWatcher:
+    """Re-renders a document whenever one of its sources changes.
+
+    Watched are the document, the files it pulls in through external
+    entities and the images it references, all of which are rediscovered
+    after every build. Configuration, plugin and stylesheet files are covered
+    by the pipeline, which is rebuilt when any of them changes. Otherwise the
+    pipeline, with its compiled stylesheet and plugin instances, stays warm
+    between builds. The configuration file is watched in any case, so that
+    fixing it rebuilds a pipeline, which failed to build.
+
+    Files are polled, which works on every platform and file system. A build
+    starts once no further change was seen for @debounce seconds, so that a
+    burst of saves triggers only one rebuild."""
+
+    def __init__(
+        self,
+        source_file,
+        config_file_path,
+        target_format=None,
+        validation_enabled=None,
+        output_dir=None,
+        xsl_parameters=None,
+        options=None,
+        metrics_file=None,
+        interval=0.25,
+        debounce=0.2,
+    ):
+        self._source_file = Path(source_file).absolute()
+        self._config_file_path = Path(config_file_path).absolute()
+        self._target_format = target_format
+        self._validation_enabled = validation_enabled
+        self._output_dir = output_dir
+        self._xsl_parameters = xsl_parameters or {}
+        self._options = options
+        self._metrics_file = metrics_file
+        self._interval = interval
+        self._debounce = debounce
+        self._pipeline = None
+        self._dependencies = [self._source_file]
+        self._sleep = time.sleep
+
+    def snapshot(self):
+        """Map all watched files to their modification times."""
+        return {str(file_path): _mtime(file_path) for file_path in [*self._dependencies, self._config_file_path]}
+
+    def build(self, tmp_dir):
+        """Render the document once and report the time spent per phase."""
+
+        start = time.perf_counter()
+
+        try:
+            if self._pipeline is None or self._pipeline.is_stale():
+                # don't keep polling a stale pipeline, if the new one fails
+                self._pipeline = None
+                self._pipeline = ECMDSPipeline(
+                    config_file_path=self._config_file_path,
+                    target_format=self._target_format,
+                    validation_enabled=self._validation_enabled,
+                    tmp_dir=tmp_dir,
+                    options=self._options,
+                )
+
+            document = self._pipeline.load(self._source_file, verbose=False)
+            self._dependencies = self._find_dependencies(document)
+            self._pipeline.render_document(
+                document, output_dir=self._output_dir, xsl_parameters=self._xsl_parameters, verbose=False
+            )
+            if self._metrics_file:
+                write_metrics(self._metrics_file, [self._pipeline.metrics.as_dict()])
+        except ECMDSError as e:
+            print(f" * Build failed after {time.perf_counter() - start:.3f}s:\n{e.msg()}", file=sys.stderr)
+            return False
+
+        phases = ", ".join(f"{phase} {elapsed:.3f}s" for phase, elapsed in self._pipeline.timings.items())
+        print(f" * Built in {time.perf_counter() - start:.3f}s ({phases})")
+
+        if (profile := self._pipeline.metrics.plugin_profile) is not None:
+            print_plugin_profile(profile.as_dict())
+        return True
+
+    def run(self):
+        """Build, then rebuild on every change until interrupted."""
+
+        if self._output_dir is not None:
+            try:
+                Path(self._output_dir).mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                raise ECMDSError(f"Could not create output directory {self._output_dir}: {e}")
+
+        with tempfile.TemporaryDirectory(prefix="ecmds-") as tmp_dir:
+            self.build(tmp_dir)
+            snapshot = self.snapshot()
+
+            print(f" * Watching {len(snapshot)} files for changes, press Ctrl+C to stop.")
+
+            while True:
+                changed = self.wait_for_change(snapshot)
+                print(f" * Changed: {', '.join(changed) or 'configuration or stylesheets'}")
+
+                self.build(tmp_dir)
+                snapshot = self.snapshot()
+
+    def wait_for_change(self, snapshot):
+        """Poll until a watched file differs from @snapshot or the pipeline is
+        stale and no further change was seen for the debounce time. Returns
+        the names of the changed files."""
+
+        while True:
+            self._sleep(self._interval)
+            if (current := self.snapshot()) != snapshot or self._pipeline_is_stale():
+                break
+
+        # wait for the burst of changes to settle
+        while True:
+            self._sleep(self._debounce)
+            if (settled := self.snapshot()) == current:
+                break
+            current = settled
+
+        return [Path(p).name for p in current if current[p] != snapshot.get(p)]
+
+    # PRIVATE
+
+    def _pipeline_is_stale(self):
+        return self._pipeline is not None and self._pipeline.is_stale()
+
+    def _find_dependencies(self, document):
+        """Collect the document, its entity files and referenced images."""
+
+        dependencies = document_sources(document) or [self._source_file]
+        base_dir = self._source_file.parent
+
+        for node in document.iter("img"):
+            if src := node.attrib.get("src"):
+                file_path = base_dir / src
+                if file_path not in dependencies:
+                    dependencies.append(file_path)
+
+        return dependencies
@@ -16,6 +16,11 @@
         <xsl:attribute name="src">
             <xsl:value-of select="@src"/>
         </xsl:attribute>
+        <xsl:if test="@srcset">
+            <xsl:attribute name="srcset">
+                <xsl:value-of select="@srcset"/>
+            </xsl:attribute>
+        </xsl:if>
     </img>
 </xsl:template>
 
@@ -76,6 +81,11 @@
             <xsl:attribute name="src">
                 <xsl:value-of select="img/@src"/>
             </xsl:attribute>
+            <xsl:if test="img/@srcset">
+                <xsl:attribute name="srcset">
+                    <xsl:value-of select="img/@srcset"/>
+                </xsl:attribute>
+            </xsl:if>
         </img>
         <xsl:if test="caption">
         <span style="display: block; font-size: xx-small;">
@@ -149,6 +159,11 @@
                                 <xsl:attribute name="src">
                                     <xsl:value-of select="img/@src"/>
                                 </xsl:attribute>
+                                <xsl:if test="img/@srcset">
+                                    <xsl:attribute name="srcset">
+                                        <xsl:value-of select="img/@srcset"/>
+                                    </xsl:attribute>
+                                </xsl:if>
                             </img>
                         </td>
                     </tr>
@@ -0,0 +1,129 @@
+"""Benchmark for syntax highlighting on a code heavy document, comparing the
+previous formatter, which wrote markup to a stream that was then parsed, to
+format_markup() and parsing its result, with and without line numbers.
+Lexing is measured apart, as it is the same for both."""
+
+import io
+import re
+import sys
+import time
+from xml.sax.saxutils import escape as xmlescape
+
+import lxml.etree as etree
+from pygments.formatter import Formatter
+from pygments.lexers import get_lexer_by_name
+from pygments_style_github import GithubStyle
+
+from ecromedos.argumentparser import ECMDS_INSTALL_DIR
+from ecromedos.highlight.formatter import ECMLPygmentsFormatter
+
+ROUNDS = 5
+
+
+class LegacyFormatter(Formatter):
+    """The formatter as it was, writing ECML markup."""
+
+    def __init__(self, **options):
+        Formatter.__init__(self, **options)
+        self.tstyle = dict(options["style"])
+        self.bgcolor = options["style"].background_color
+        self.emit_line_numbers = options["emit_line_numbers"]
+        self.line_no = options["startline"]
+        self.line_step = options["line_step"]
+        self.output_format = options["output_format"]
+        self.new_line = True
+
+    def format(self, tokensource, outfile):
+        outfile.write('<code bgcolor="#%s">' % self.bgcolor.lower().lstrip("#"))
+
+        for ttype, tvalue in tokensource:
+            while ttype not in self.tstyle:
+                ttype = ttype.parent
+
+            if self.emit_line_numbers or self.output_format.endswith("latex"):
+                for line in tvalue.splitlines(True):
+                    if self.emit_line_numbers and self.new_line:
+                        outfile.write("<b>%04d</b> " % self.line_no)
+                        self.new_line = False
+                    self.write(ttype, line, outfile)
+                    if re.search(r"\r|(?:\r)?\n$", line):
+                        self.line_no += self.line_step
+                        self.new_line = True
+            else:
+                self.write(ttype, tvalue, outfile)
+
+        outfile.write("</code>")
+
+    def write(self, ttype, tvalue, outfile):
+        style = self.tstyle[ttype]
+
+        if style["color"]:
+            outfile.write('<color rgb="#%s">' % style["color"].lower().lstrip("#"))
+        if style["underline"]:
+            outfile.write("<u>")
+        if style["italic"]:
+            outfile.write("<i>")
+        if style["bold"]:
+            outfile.write("<b>")
+        outfile.write(xmlescape(tvalue))
+        if style["bold"]:
+            outfile.write("</b>")
+        if style["italic"]:
+            outfile.write("</i>")
+        if style["underline"]:
+            outfile.write("</u>")
+        if style["color"]:
+            outfile.write("</color>")
+
+
+def make_listings():
+    """All Python modules of ecromedos, as listings in a manual."""
+    return [file_path.read_text(encoding="utf-8") for file_path in sorted(ECMDS_INSTALL_DIR.rglob("*.py"))]
+
+
+def lex(listings):
+    lexer = get_lexer_by_name("python")
+    return [list(lexer.get_tokens(code)) for code in listings]
+
+
+def legacy(tokens, options):
+    outfile = io.StringIO()
+    LegacyFormatter(**options).format(iter(tokens), outfile)
+    return etree.fromstring(outfile.getvalue())
+
+
+def markup(tokens, options):
+    return etree.fromstring(ECMLPygmentsFormatter(**options).format_markup(iter(tokens)))
+
+
+def measure(func):
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def main():
+    listings = make_listings()
+    token_lists = lex(listings)
+
+    print(f"{len(listings)} listings, {sum(code.count(chr(10)) for code in listings)} lines")
+    print(f"{'line numbers':<13} {'formatter':<10} {'min (ms)':>10} {'mean (ms)':>10}")
+
+    best, mean = measure(lambda: lex(listings))
+    print(f"{'':<13} {'(lexing)':<10} {best:>10.1f} {mean:>10.1f}")
+
+    for line_numbers in [False, True]:
+        options = dict(
+            emit_line_numbers=line_numbers, startline=1, line_step=1, style=GithubStyle, output_format="xhtml"
+        )
+
+        for name, func in [("legacy", legacy), ("markup", markup)]:
+            best, mean = measure(lambda: [func(tokens, options) for tokens in token_lists])
+            print(f"{str(line_numbers).lower():<13} {name:<10} {best:>10.1f} {mean:>10.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
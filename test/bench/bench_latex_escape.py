@@ -0,0 +1,240 @@
+"""Benchmark for escaping text and verbatim listings for LaTeX, comparing the
+previous character by character loops of the text and verbatim plugins to
+the translate tables of ecromedos.latexescape, on the text and tail strings
+of a synthetic book and on all Python modules of ecromedos as listings."""
+
+import sys
+import time
+
+import lxml.etree as etree
+
+from ecromedos.argumentparser import ECMDS_INSTALL_DIR
+from ecromedos.latexescape import escape_text, escape_verbatim
+
+ROUNDS = 5
+PARAGRAPHS = 20000
+
+
+class LegacyText:
+    """LaTeX_sanitizeString of the text plugin as it was."""
+
+    def __init__(self):
+        self.lstrip = False
+
+    def escape(self, string):
+        lookup_table = {
+            "[": "{[}",
+            "]": "{]}",
+            "{": "\\{{}",
+            "}": "\\}{}",
+            "#": "\\#{}",
+            "&": "\\&{}",
+            "_": "\\_{}",
+            "%": "\\%{}",
+            "$": "\\${}",
+            "^": "\\^{}",
+            "\\": "\\textbackslash{}",
+            "~": "\\textasciitilde{}",
+            "-": "{}{\\string-}{}",
+            ":": "{}{\\string:}{}",
+            ";": "{}{\\string;}{}",
+            "!": "{}{\\string!}{}",
+            "?": "{}{\\string?}{}",
+            '"': '{}{\\string"}{}',
+            "`": "{}{\\string`}{}",
+            "'": "{}{\\string'}{}",
+            "=": "{}{\\string=}{}",
+            "\n": "\n",
+        }
+
+        frame_start = 0
+        frame_end = 0
+        parts = []
+        length = len(string)
+
+        if self.lstrip:
+            while frame_end < length:
+                ch = string[frame_end]
+                if not ch.isspace():
+                    self.lstrip = False
+                    break
+                frame_end += 1
+                if ch == "\n":
+                    frame_start = frame_end
+            if frame_end > frame_start:
+                parts.append(string[frame_start:frame_end])
+                frame_start = frame_end
+
+        while frame_end < length:
+            ch = string[frame_end]
+            try:
+                escape_sequence = lookup_table[ch]
+            except KeyError:
+                escape_sequence = ""
+            if escape_sequence:
+                if frame_end > frame_start:
+                    parts.append(string[frame_start:frame_end])
+                if ch == "\n":
+                    if not self.lstrip:
+                        parts.append(ch)
+                        self.lstrip = True
+                    frame_end += 1
+                    frame_start = frame_end
+                    while frame_end < length:
+                        ch = string[frame_end]
+                        if not ch.isspace():
+                            self.lstrip = False
+                            break
+                        frame_end += 1
+                        if ch == "\n":
+                            frame_start = frame_end
+                    if frame_end > frame_start:
+                        parts.append(string[frame_start:frame_end])
+                        frame_start = frame_end
+                else:
+                    parts.append(escape_sequence)
+                    frame_end += 1
+                    frame_start = frame_end
+            else:
+                frame_end += 1
+
+        if frame_end > frame_start:
+            parts.append(string[frame_start:frame_end])
+
+        return "".join(parts)
+
+
+def legacy_verbatim(string, tab_spaces):
+    """LaTeX_verbatimString of the verbatim plugin as it was."""
+
+    lookup_table = {
+        "[": "{[}",
+        "]": "{]}",
+        "{": "\\{{}",
+        "}": "\\}{}",
+        "#": "\\#{}",
+        "&": "\\&{}",
+        "_": "\\_{}",
+        "%": "\\%{}",
+        "$": "\\${}",
+        "^": "\\^{}",
+        "\\": "\\textbackslash{}",
+        "~": "\\textasciitilde{}",
+        "-": "{}{-}{}",
+        ":": "{}{:}{}",
+        ";": "{}{;}{}",
+        "!": "{}{!}{}",
+        "?": "{}{?}{}",
+        '"': '{}{"}{}',
+        "`": "{}{`}{}",
+        "'": "{}{'}{}",
+        "=": "{}{=}{}",
+        "\t": "\t",
+    }
+
+    frame_start = 0
+    frame_end = 0
+    parts = []
+    length = len(string)
+
+    while frame_end < length:
+        ch = string[frame_end]
+        try:
+            escape_sequence = lookup_table[ch]
+        except KeyError:
+            escape_sequence = ""
+        if escape_sequence:
+            if frame_end > frame_start:
+                parts.append(string[frame_start:frame_end])
+            if ch == "\t":
+                parts.append(" " * tab_spaces)
+            else:
+                parts.append(escape_sequence)
+            frame_end += 1
+            frame_start = frame_end
+        else:
+            frame_end += 1
+
+    if frame_end > frame_start:
+        parts.append(string[frame_start:frame_end])
+
+    return "".join(parts)
+
+
+def make_strings():
+    """The text and tails of a synthetic, indented book, in document order."""
+
+    paragraphs = "".join(
+        f"""
+      <p>
+        Paragraph {p} -- with <b>bold</b>, <i>italic</i> and <tt>code_{p}</tt>: costs
+        $5 &amp; 10% more; isn't that "nice"? Try ~/.ecmds[{p}]!
+      </p>
+"""
+        for p in range(PARAGRAPHS)
+    )
+    root = etree.fromstring(f"<book><chapter><title>Chapter</title>{paragraphs}</chapter></book>")
+
+    return [s for node in root.iter() for s in [node.text, node.tail] if s]
+
+
+def make_listings():
+    return [file_path.read_text(encoding="utf-8") for file_path in sorted(ECMDS_INSTALL_DIR.rglob("*.py"))]
+
+
+def legacy_text(strings):
+    escaper = LegacyText()
+    return [escaper.escape(string) for string in strings]
+
+
+def translate_text(strings):
+    lstrip = False
+    results = []
+    for string in strings:
+        string, lstrip = escape_text(string, lstrip)
+        results.append(string)
+    return results
+
+
+def measure(func):
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def main():
+    strings = make_strings()
+    listings = make_listings()
+
+    print(f"{len(strings)} strings, {sum(map(len, strings))} characters of text")
+    print(f"{len(listings)} listings, {sum(map(len, listings))} characters of code")
+    print(f"{'input':<10} {'escaping':<10} {'min (ms)':>10} {'mean (ms)':>10}")
+
+    for kind, candidates in [
+        ("text", [("legacy", lambda: legacy_text(strings)), ("translate", lambda: translate_text(strings))]),
+        (
+            "verbatim",
+            [
+                ("legacy", lambda: [legacy_verbatim(code, 4) for code in listings]),
+                ("translate", lambda: [escape_verbatim(code, 4) for code in listings]),
+            ],
+        ),
+    ]:
+        results = []
+        for name, func in candidates:
+            result, best, mean = measure(func)
+            results.append(result)
+            print(f"{kind:<10} {name:<10} {best:>10.1f} {mean:>10.1f}")
+
+        if results[0] != results[1]:
+            print(f"Escaped {kind} differs from the previous implementation.", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Benchmark for math rendering, comparing GIF bitmaps (latex and dvipng) to
+SVG drawings (latex and dvisvgm), both written to files and inlined, by
+render time and total bytes of output. Requires latex, dvipng and dvisvgm."""
+
+import contextlib
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+
+import lxml.etree as etree
+
+import ecromedos.plugins.math as math
+
+FORMULAE = 500
+
+# a mix of short inline formulae and longer displayed ones
+TEMPLATES = [
+    "x_{%d}",
+    "\\alpha^{%d} + \\beta",
+    "\\sum_{i=1}^{%d} i^2 = \\frac{n(n+1)(2n+1)}{6}",
+    "\\int_0^{%d} e^{-x^2}\\,dx",
+    "\\begin{pmatrix} a &amp; %d \\\\ c &amp; d \\end{pmatrix}",
+]
+
+
+def make_document():
+    formulae = "".join(f"<m>{TEMPLATES[i % len(TEMPLATES)] % i}</m> " for i in range(FORMULAE))
+    return f"<p>{formulae}</p>"
+
+
+def render(config):
+    """Render all formulae, return the time taken and bytes in files and page."""
+
+    root = etree.fromstring(make_document())
+
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.chdir(tmp_dir):
+        plugin = math.getInstance({"tmp_dir": tmp_dir, **config})
+
+        start = time.perf_counter()
+        for node in root.findall("./m"):
+            plugin.process(node, "xhtml")
+        plugin.flush()
+        elapsed = time.perf_counter() - start
+
+        file_bytes = sum(p.stat().st_size for p in Path(".").glob("m*.*"))
+
+    page_bytes = len(etree.tostring(root))
+    return elapsed, file_bytes, page_bytes
+
+
+def main():
+    missing = [tool for tool in ["latex", "dvipng", "dvisvgm"] if shutil.which(tool) is None]
+    if missing:
+        print(f"This benchmark requires {', '.join(missing)}.", file=sys.stderr)
+        return 1
+
+    print(f"{FORMULAE} formulae, {os.cpu_count()} CPUs")
+    print(f"{'output':<12} {'time (s)':>9} {'files (KiB)':>12} {'page (KiB)':>11}")
+
+    for name, config in [
+        ("gif", {"math_output": "gif"}),
+        ("svg", {"math_output": "svg"}),
+        ("svg inline", {"math_output": "svg", "math_inline_size": "4K"}),
+    ]:
+        elapsed, file_bytes, page_bytes = render(config)
+        print(f"{name:<12} {elapsed:>9.2f} {file_bytes / 1024:>12.1f} {page_bytes / 1024:>11.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
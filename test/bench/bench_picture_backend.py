@@ -0,0 +1,85 @@
+"""Benchmark for image conversion in the picture plugin, comparing one
+ImageMagick process per image to in-process conversion with Pillow, on
+synthetic screenshots scaled for XHTML as PNG and JPEG. Requires Pillow and
+ImageMagick."""
+
+import contextlib
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+
+import lxml.etree as etree
+
+import ecromedos.imageconvert as imageconvert
+import ecromedos.plugins.picture as picture
+
+SCREENSHOTS = 100
+
+
+def make_screenshot(file_path, index):
+    """Draw a window with a title bar, a sidebar and lines of text and save
+    it in the format given by the suffix of @file_path."""
+
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1280, 800), (246, 246, 246))
+    draw = ImageDraw.Draw(image)
+
+    draw.rectangle((0, 0, 1280, 32), fill=(52, 73, 94))
+    draw.rectangle((0, 32, 240, 800), fill=(230, 233, 237))
+
+    for line in range(40):
+        y = 48 + line * 18
+        draw.text((256, y), f"Screenshot {index}, line {line}: some text in a window", fill=(30, 30, 30))
+        if line % 8 == 0:
+            draw.rectangle((16, y, 224, y + 12), fill=(41, 128, 185))
+
+    image.save(file_path)
+
+
+def convert(sources, config):
+    """Convert all screenshots, return the time taken."""
+
+    root = etree.fromstring(
+        "<root>%s</root>"
+        % "".join(
+            f'<img src="{src}" screen-width="{width}px"/>' for src in sources for width in ["640", "320"]
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.chdir(tmp_dir):
+        plugin = picture.getInstance({"tmp_dir": tmp_dir, "cache_dir": "", **config})
+
+        start = time.perf_counter()
+        for node in root.findall("./img"):
+            plugin.process(node, "xhtml")
+        plugin.flush()
+        return time.perf_counter() - start
+
+
+def main():
+    if not imageconvert.pillow_available() or shutil.which("convert") is None:
+        print("This benchmark requires Pillow and ImageMagick.", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpus = []
+        for index in range(SCREENSHOTS):
+            file_path = Path(corpus_dir) / f"screenshot{index:03d}.{'png' if index % 2 else 'jpg'}"
+            make_screenshot(file_path, index)
+            corpus.append(file_path)
+
+        print(f"{len(corpus)} screenshots, 2 sizes each, {os.cpu_count()} CPUs")
+        print(f"{'backend':<12} {'workers':>8} {'time (s)':>9}")
+
+        for workers in ["1", str(os.cpu_count() or 1)]:
+            for backend in ["imagemagick", "pillow"]:
+                elapsed = convert(corpus, {"picture_backend": backend, "picture_workers": workers})
+                print(f"{backend:<12} {workers:>8} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Benchmark for the preprocessor's tree traversal on a synthetic book with
+many paragraphs, comparing the previous node-by-node walk, which looked up
+every element and string in the plugins map, to the dispatch plan with
+tag-targeted traversal (XHTML) and full traversal (LaTeX, where the text
+plugin needs to see every string)."""
+
+import sys
+import tempfile
+import time
+
+import lxml.etree as etree
+
+from ecromedos.argumentparser import ECMDS_INSTALL_DIR
+from ecromedos.configreader import ECMDSConfigReader
+from ecromedos.preprocessor import ECMDSPreprocessor
+
+ROUNDS = 5
+CHAPTERS = 50
+PARAGRAPHS = 1000
+
+
+def make_document():
+    chapters = []
+    for c in range(CHAPTERS):
+        paragraphs = "".join(
+            f"<p>Paragraph {p} with <b>bold</b>, <i>italic</i> and <tt>code_{p}</tt> in it.</p>\n"
+            for p in range(PARAGRAPHS)
+        )
+        chapters.append(
+            f"<chapter><title>Chapter {c}</title><section><title>Section</title>{paragraphs}</section></chapter>"
+        )
+    return f"<book><head><title>Benchmark</title><author>Nobody</author></head>{''.join(chapters)}</book>"
+
+
+def legacy_prepare(preprocessor, document, target_format):
+    """The walk as it was, before plugin dispatch plans."""
+
+    def process_node(node):
+        for plugin_name in preprocessor._plugins_map.get("@text" if isinstance(node, str) else node.tag, []):
+            node = preprocessor._plugins[plugin_name].process(node, target_format)
+        return node
+
+    node = document.getroot()
+
+    while node is not None:
+        node = process_node(node)
+        is_final = node.tag == "copy" or node.attrib.get("final", "no") == "yes"
+
+        if not is_final and node.text:
+            node.text = process_node(node.text)
+
+        if not is_final and len(node) != 0:
+            node = node[0]
+            continue
+
+        while node is not None:
+            if node.tail:
+                node.tail = process_node(node.tail)
+            following_sibling = node.getnext()
+            if following_sibling is not None:
+                node = following_sibling
+                break
+            node = node.getparent()
+
+    preprocessor._flush_plugins()
+
+
+def measure(data, func):
+    timings = []
+    for _ in range(ROUNDS):
+        document = etree.ElementTree(etree.fromstring(data))
+        start = time.perf_counter()
+        func(document)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def main():
+    data = make_document()
+
+    print(f"{CHAPTERS * PARAGRAPHS} paragraphs, {data.count('<') - data.count('</')} elements")
+    print(f"{'format':<10} {'walk':<8} {'min (ms)':>10} {'mean (ms)':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for target_format in ["xhtml", "latex"]:
+            configuration, plugins_map = ECMDSConfigReader().readConfig(
+                config_file_path=ECMDS_INSTALL_DIR / "defaults" / "ecmds.conf",
+                target_format=target_format,
+                validation_enabled=False,
+                tmp_dir=tmp_dir,
+            )
+            preprocessor = ECMDSPreprocessor(configuration, plugins_map)
+
+            for walk, func in [
+                ("legacy", lambda document: legacy_prepare(preprocessor, document, target_format)),
+                ("plan", lambda document: preprocessor.prepareDocument(document, target_format, verbose=False)),
+            ]:
+                best, mean = measure(data, func)
+                print(f"{target_format:<10} {walk:<8} {best:>10.1f} {mean:>10.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
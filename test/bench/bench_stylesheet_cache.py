@@ -0,0 +1,43 @@
+"""Startup benchmark for loading the stylesheets, comparing a cold load
+(parse, resolve includes, compile) to a warm load from the in-memory cache."""
+
+import sys
+import time
+
+from ecromedos.argumentparser import ECMDS_INSTALL_DIR, GeneratorType
+from ecromedos.stylecache import ECMDSStylesheetCache
+
+ROUNDS = 20
+STYLE_DIR = ECMDS_INSTALL_DIR / "xslt"
+
+
+def measure(func):
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def main():
+    cache = ECMDSStylesheetCache()
+
+    print(f"{'format':<10} {'mode':<6} {'min (ms)':>10} {'mean (ms)':>10}")
+
+    for target_format in GeneratorType:
+
+        def cold():
+            ECMDSStylesheetCache.clear()
+            cache.load(STYLE_DIR, target_format)
+
+        def warm():
+            cache.load(STYLE_DIR, target_format)
+
+        for mode, func in [("cold", cold), ("warm", warm)]:
+            best, mean = measure(func)
+            print(f"{target_format:<10} {mode:<6} {best:>10.2f} {mean:>10.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
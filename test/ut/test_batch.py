@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from importlib.resources import files
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.batch import expand_sources, output_dirs_for, render_batch
+from ecromedos.error import ECMDSError
+
+CONFIG_FILE_PATH = Path(str(files("ecromedos"))) / "defaults" / "ecmds.conf"
+
+DOCUMENT = """\
+<article lang="en_US" secsplitdepth="0">
+  <head><title>Test</title><author>Nobody</author></head>
+  <section><title>One</title><p>Batch</p></section>
+</article>
+"""
+
+# takes the place of the data plugin, which handles the root element, and
+# writes the sizes of the worker pools into the output directory
+RECORDING_PLUGIN = """\
+import json
+
+def getInstance(config):
+    return Plugin(config)
+
+class Plugin:
+    def __init__(self, config):
+        self.settings = {
+            name: config.get(name) for name in ["highlight_workers", "math_shards", "picture_workers"]
+        }
+
+    def process(self, node, format):
+        with open("workers.json", "w") as fp:
+            json.dump(self.settings, fp)
+        return node
+
+    def flush(self):
+        pass
+"""
+
+
+class UTTestBatch(unittest.TestCase):
+    def test_expandManifestAndGlobs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            (tmpdir / "a").mkdir()
+            for name in ["a/one.xml", "a/two.xml", "b.xml"]:
+                (tmpdir / name).touch()
+            (tmpdir / "manifest.txt").write_text("# documents\na/*.xml\n\nb.xml\n")
+
+            sources = expand_sources([f"@{tmpdir / 'manifest.txt'}", str(tmpdir / "b.xml")])
+
+            expected_sources = [tmpdir / "a" / "one.xml", tmpdir / "a" / "two.xml", tmpdir / "b.xml"]
+            self.assertEqual(sources, expected_sources)
+
+    def test_rejectEmptyExpansion(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(ECMDSError) as context:
+                expand_sources([os.path.join(tmpdir, "*.xml")])
+
+            self.assertIn("No documents match", context.exception.msg())
+
+    def test_outputDirsMirrorSourceLayout(self):
+        sources = [Path("/docs/a/index.xml"), Path("/docs/b/index.xml"), Path("/docs/c.xml")]
+
+        output_dirs = output_dirs_for(sources, "/out")
+
+        expected_dirs = [Path("/out/a/index"), Path("/out/b/index"), Path("/out/c")]
+        self.assertEqual(output_dirs, expected_dirs)
+
+    def test_shareCpusBetweenDocuments(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+
+            plugin_dir = tmpdir / "plugins"
+            shutil.copytree(CONFIG_FILE_PATH.parent.parent / "plugins", plugin_dir)
+            (plugin_dir / "data.py").write_text(RECORDING_PLUGIN)
+
+            config_file_path = tmpdir / "ecmds.conf"
+            config = CONFIG_FILE_PATH.read_text().replace("$install_dir/plugins", str(plugin_dir))
+            config_file_path.write_text(config)
+
+            sources = [tmpdir / "one.xml", tmpdir / "two.xml"]
+            for source in sources:
+                source.write_text(DOCUMENT)
+
+            results = render_batch(
+                sources,
+                tmpdir / "out",
+                config_file_path,
+                target_format="xhtml",
+                validation_enabled=False,
+                options={"cache_dir": "", "math_shards": "3"},
+                jobs=2,
+            )
+
+            self.assertEqual([r["status"] for r in results], ["ok", "ok"], results)
+
+            workers = str(max(1, (os.cpu_count() or 1) // 2))
+            expected_settings = {"highlight_workers": workers, "math_shards": "3", "picture_workers": workers}
+
+            for result in results:
+                with open(Path(result["output_dir"]) / "workers.json") as fp:
+                    self.assertEqual(json.load(fp), expected_settings)
+
+    def test_continueAfterFailingDocument(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            (tmpdir / "good.xml").write_text(DOCUMENT)
+            (tmpdir / "bad.xml").write_text(DOCUMENT.replace("</article>", ""))
+
+            results = render_batch(
+                [tmpdir / "bad.xml", tmpdir / "good.xml"],
+                tmpdir / "out",
+                CONFIG_FILE_PATH,
+                target_format="xhtml",
+                validation_enabled=False,
+                options={"cache_dir": ""},
+                jobs=2,
+            )
+
+            self.assertEqual([r["status"] for r in results], ["error", "ok"])
+            self.assertIn("bad.xml", results[0]["message"])
+            self.assertIn("Batch", (tmpdir / "out" / "good" / "index.html").read_text())
+
+            # the command line reports the failure in its exit status
+            env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path), "XDG_CACHE_HOME": str(tmpdir / "cache")}
+
+            for patterns, expected_output in [
+                (["*.xml"], "1 of 2 documents rendered"),
+                (["missing/*.xml"], "No documents match missing/*.xml."),
+            ]:
+                result = subprocess.run(
+                    [
+                        sys.executable,
+                        "-c",
+                        "from ecromedos.ecromedos import main; main()",
+                        "--no-validate",
+                        "-f",
+                        "xhtml",
+                        "-j",
+                        "2",
+                        "-o",
+                        "cli",
+                        *(arg for pattern in patterns for arg in ["--batch", pattern]),
+                    ],
+                    cwd=tmpdir,
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                )
+
+                self.assertNotEqual(result.returncode, 0)
+                self.assertIn(expected_output, result.stdout + result.stderr)
+
+            self.assertTrue((tmpdir / "cli" / "good" / "index.html").is_file())
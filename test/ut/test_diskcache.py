@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+import ecromedos.diskcache as diskcache
+from ecromedos.diskcache import ECMDSDiskCache, parse_size
+from ecromedos.error import ECMDSError
+
+
+class UTTestDiskCache(unittest.TestCase):
+    def test_storeAndRetrieve(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ECMDSDiskCache(tmpdir)
+            cache.put("math", "a", b"1")
+
+            self.assertEqual(cache.get("math", "a"), b"1")
+            self.assertIsNone(cache.get("math", "b"))
+            self.assertIsNone(cache.get("other", "a"))
+
+            # shared between instances
+            self.assertEqual(ECMDSDiskCache(tmpdir).get("math", "a"), b"1")
+
+    def test_storeAndLinkFiles(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "cache"))
+            src = Path(tmpdir) / "image.png"
+            src.write_bytes(b"PNG")
+
+            self.assertIsNone(cache.get_file("picture", "a"))
+            cache.put_file("picture", "a", src)
+
+            entry_path = cache.get_file("picture", "a")
+            self.assertEqual(entry_path.read_bytes(), b"PNG")
+            self.assertEqual(cache.get("picture", "a"), b"PNG")
+
+            # using an entry keeps its modification time
+            os.utime(entry_path, ns=(0, 10**9))
+            cache.get_file("picture", "a")
+            self.assertEqual(entry_path.stat().st_mtime_ns, 10**9)
+            self.assertGreater(entry_path.stat().st_atime_ns, 10**9)
+
+    def test_evictLeastRecentlyUsed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ECMDSDiskCache(tmpdir, max_size=300)
+
+            for index, key in enumerate(["a", "b", "c"]):
+                cache.put("ns", key, b"x" * 100)
+                entry = cache._entry_path("ns", key)
+                os.utime(entry, ns=(index * 10**9, index * 10**9))
+
+            # reading marks as used
+            cache.get("ns", "a")
+            cache.put("ns", "d", b"x" * 100)
+
+            self.assertIsNotNone(cache.get("ns", "a"))
+            self.assertIsNone(cache.get("ns", "b"))
+            self.assertIsNone(cache.get("ns", "c"))
+            self.assertIsNotNone(cache.get("ns", "d"))
+            self.assertLessEqual(sum(p.stat().st_size for p in Path(tmpdir).rglob("*") if p.is_file()), 270)
+
+    def test_readWithoutMarking(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ECMDSDiskCache(tmpdir)
+            cache.put("ns", "a", b"1")
+
+            # as in a cache shared with other users or on a read-only medium
+            def utime(*args, **kwargs):
+                raise PermissionError("Operation not permitted")
+
+            os_utime = diskcache.os.utime
+            diskcache.os.utime = utime
+            try:
+                self.assertEqual(cache.get("ns", "a"), b"1")
+                self.assertEqual(cache.get_file("ns", "a"), cache._entry_path("ns", "a"))
+                self.assertIsNone(cache.get("ns", "b"))
+                self.assertIsNone(cache.get_file("ns", "b"))
+            finally:
+                diskcache.os.utime = os_utime
+
+    def test_parseSize(self):
+        self.assertEqual(parse_size("512"), 512)
+        self.assertEqual(parse_size("4K"), 4096)
+        self.assertEqual(parse_size("64M"), 64 * 1024 * 1024)
+        self.assertEqual(parse_size("1gb"), 1024**3)
+        with self.assertRaises(ECMDSError):
+            parse_size("lots")
@@ -0,0 +1,54 @@
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+ECMDS_TEST_DATA_DIR = os.path.join(ECMDS_INSTALL_DIR, "test", "ut", "data", "plugin_picture")
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.imagesize import image_size
+
+HEADERS = {
+    "gif": b"GIF89a" + struct.pack("<HH", 33, 44) + b"\0" * 8,
+    "bmp": b"BM" + b"\0" * 12 + struct.pack("<Iii", 40, 33, -44) + b"\0" * 16,
+    "bmp-os2": b"BM" + b"\0" * 12 + struct.pack("<IHH", 12, 33, 44) + b"\0" * 4,
+    "jpeg": (
+        b"\xff\xd8"
+        + b"\xff\xe1" + struct.pack(">H", 2 + 1000) + b"\0" * 1000
+        + b"\xff\xc2" + struct.pack(">HBHH", 17, 8, 44, 33) + b"\0" * 12
+    ),
+    "webp-lossy": b"RIFF\0\0\0\0WEBPVP8 " + b"\0" * 10 + struct.pack("<HH", 33, 44),
+    "webp-lossless": b"RIFF\0\0\0\0WEBPVP8L\0\0\0\0\x2f" + struct.pack("<I", 32 | 43 << 14),
+    "webp-extended": b"RIFF\0\0\0\0WEBPVP8X" + b"\0" * 8 + (32).to_bytes(3, "little") + (43).to_bytes(3, "little"),
+    "svg": b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg" width="33px" height="44"/>',
+    "svg-viewbox": b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 33 44"></svg>',
+}
+
+
+class UTTestImageSize(unittest.TestCase):
+    def test_readHeaders(self):
+        self.assertEqual(image_size(os.path.join(ECMDS_TEST_DATA_DIR, "ecromedos.png")), (320, 240))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, data in HEADERS.items():
+                file_path = Path(tmpdir) / name
+                file_path.write_bytes(data)
+                self.assertEqual(image_size(file_path), (33, 44), name)
+
+    def test_unknownFormats(self):
+        self.assertIsNone(image_size(os.path.join(ECMDS_TEST_DATA_DIR, "ecromedos.eps")))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, data in {
+                "empty": b"",
+                "truncated": HEADERS["jpeg"][:20],
+                "svg-units": b'<svg xmlns="http://www.w3.org/2000/svg" width="3cm" height="4cm"/>',
+            }.items():
+                file_path = Path(tmpdir) / name
+                file_path.write_bytes(data)
+                self.assertIsNone(image_size(file_path), name)
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import lxml.etree as etree
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.incremental import ECMDSBuildCache
+
+
+class UTTestIncremental(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = Path(self._tmpdir.name)
+        self.output_dir = self.tmpdir / "out"
+        self.output_dir.mkdir()
+
+        self.chapter = self.tmpdir / "chapter.xml"
+        self.chapter.write_text("<chapter>One</chapter>")
+        self.source = self.tmpdir / "doc.xml"
+        self.source.write_text('<!DOCTYPE book [<!ENTITY chapter SYSTEM "chapter.xml">]><book>&chapter;</book>')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def parse(self):
+        return etree.parse(str(self.source), etree.XMLParser(resolve_entities=True))
+
+    def build(self, cache, files):
+        document = self.parse()
+        if not cache.begin(self.output_dir, document, key="key"):
+            return None
+        for name, content in files.items():
+            (cache.staging_dir / name).write_text(content)
+        return cache.commit()
+
+    def test_publishOnlyChangedFiles(self):
+        cache = ECMDSBuildCache()
+
+        changed = self.build(cache, {"a.html": "a", "b.html": "b", "c.html": "c"})
+        self.assertEqual(changed, ["a.html", "b.html", "c.html"])
+        mtime = (self.output_dir / "a.html").stat().st_mtime_ns
+
+        # nothing changed
+        self.assertIsNone(self.build(cache, {}))
+
+        # an entity file changed
+        self.chapter.write_text("<chapter>Two</chapter>")
+        changed = self.build(cache, {"a.html": "a", "b.html": "B"})
+
+        self.assertEqual(sorted(changed), ["b.html", "c.html"])
+        self.assertEqual((self.output_dir / "a.html").stat().st_mtime_ns, mtime)
+        self.assertEqual((self.output_dir / "b.html").read_text(), "B")
+        self.assertFalse((self.output_dir / "c.html").exists())
+
+    def test_keepOnlyUsedObjects(self):
+        cache = ECMDSBuildCache()
+
+        document = self.parse()
+        cache.begin(self.output_dir, document, key="key")
+        cache.put("math", "x^2", b"one")
+        cache.put("math", "y^2", b"two")
+        cache.commit()
+
+        self.chapter.write_text("<chapter>Two</chapter>")
+        cache.begin(self.output_dir, document, key="key")
+        self.assertEqual(cache.get("math", "x^2"), b"one")
+        cache.commit()
+
+        cache.begin(self.output_dir, document, key="other")
+        self.assertEqual(cache.get("math", "x^2"), b"one")
+        self.assertIsNone(cache.get("math", "y^2"))
+        cache.abort()
@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.latexescape import escape_text, escape_verbatim
+
+
+class UTTestLaTeXEscape(unittest.TestCase):
+    def test_cutLineBreaks(self):
+        self.assertEqual(escape_text("a_b"), ("a\\_{}b", False))
+        self.assertEqual(escape_text("a \n \n\t b\n"), ("a \n\t b\n", True))
+        self.assertEqual(escape_text("a\n  b \t"), ("a\n  b \t", False))
+        self.assertEqual(escape_text(" \n "), (" \n ", True))
+
+    def test_stripAcrossStrings(self):
+        # text and tails are escaped one by one, the state is passed on
+        strings = ["One\n", "\n  \n  ", "", "two\n\n", "\n", " three"]
+        expected_results = ["One\n", "  ", "", "two\n", "", " three"]
+
+        lstrip = False
+        results = []
+        for string in strings:
+            string, lstrip = escape_text(string, lstrip)
+            results.append(string)
+
+        self.assertEqual(results, expected_results)
+        self.assertFalse(lstrip)
+
+    def test_escapeVerbatim(self):
+        self.assertEqual(escape_verbatim("\ta[0] = -1;\n\n", 2), "  a{[}0{]} {}{=}{} {}{-}{}1{}{;}{}\n\n")
+        self.assertEqual(escape_verbatim("\t~", 8), " " * 8 + "\\textasciitilde{}")
@@ -0,0 +1,127 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from importlib.resources import files
+from pathlib import Path
+
+import lxml.etree as etree
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.metrics import ECMDSMetrics, write_metrics
+from ecromedos.pipeline import ECMDSPipeline
+from ecromedos.preprocessor import ECMDSPreprocessor
+
+
+class UTTestMetrics(unittest.TestCase):
+    def test_countNodesInPreprocessor(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (Path(tmpdir) / "keep.py").write_text(
+                "def getInstance(config):\n"
+                "    return Plugin()\n"
+                "class Plugin:\n"
+                "    def process(self, node, format):\n"
+                "        return node\n"
+                "    def flush(self):\n"
+                "        pass\n"
+            )
+            document = etree.ElementTree(etree.fromstring("<article><p>One <b>two</b> three</p><p/></article>"))
+
+            # only elements with plugins are visited
+            preprocessor = ECMDSPreprocessor(configuration={"plugin_dir": tmpdir}, plugins_map={"p": ["keep"]})
+            metrics = ECMDSMetrics()
+            preprocessor.prepareDocument(document, "xhtml", metrics=metrics, verbose=False)
+
+            self.assertEqual(metrics.phases["preprocess"]["elements"], 2)
+            self.assertEqual(metrics.phases["preprocess"]["text_nodes"], 0)
+            self.assertIn("flush", metrics.timings)
+
+            # a text plugin requires looking at every node
+            preprocessor = ECMDSPreprocessor(configuration={"plugin_dir": tmpdir}, plugins_map={"@text": ["keep"]})
+            metrics = ECMDSMetrics()
+            preprocessor.prepareDocument(document, "xhtml", metrics=metrics, verbose=False)
+
+            self.assertEqual(metrics.phases["preprocess"]["elements"], 4)
+            self.assertEqual(metrics.phases["preprocess"]["text_nodes"], 3)
+
+    def test_profilePlugins(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (Path(tmpdir) / "upper.py").write_text(
+                "def getInstance(config):\n"
+                "    return Plugin()\n"
+                "class Plugin:\n"
+                "    def process(self, node, format):\n"
+                "        return node.upper() if isinstance(node, str) else node\n"
+                "    def flush(self):\n"
+                "        pass\n"
+            )
+            preprocessor = ECMDSPreprocessor(
+                configuration={"plugin_dir": tmpdir, "profile_plugins": "2"},
+                plugins_map={"@text": ["upper"], "p": ["upper"]},
+            )
+            document = etree.ElementTree(etree.fromstring("<article>\n<p>One</p>\n<p>Two</p>\n</article>"))
+            metrics = ECMDSMetrics()
+
+            preprocessor.prepareDocument(document, "xhtml", metrics=metrics, verbose=False)
+
+        profile = metrics.as_dict()["plugin_profile"]
+        self.assertEqual(profile["plugins"]["upper"]["process_calls"], 7)
+        self.assertEqual(profile["plugins"]["upper"]["flush_calls"], 1)
+        self.assertEqual(len(profile["slowest_nodes"]), 2)
+        self.assertEqual(document.getroot()[1].text, "TWO")
+
+    def test_collectPluginStatistics(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (Path(tmpdir) / "counter.py").write_text(
+                "def getInstance(config):\n"
+                "    return Plugin()\n"
+                "class Plugin:\n"
+                "    def __init__(self):\n"
+                "        self.count = 0\n"
+                "        self.statistics = {}\n"
+                "    def process(self, node, format):\n"
+                "        self.count += 1\n"
+                "        return node\n"
+                "    def flush(self):\n"
+                "        self.statistics = {'nodes': self.count}\n"
+                "        self.count = 0\n"
+            )
+            document = etree.ElementTree(etree.fromstring("<article><p/><p/></article>"))
+            preprocessor = ECMDSPreprocessor(configuration={"plugin_dir": tmpdir}, plugins_map={"p": ["counter"]})
+            metrics = ECMDSMetrics()
+            preprocessor.prepareDocument(document, "xhtml", metrics=metrics, verbose=False)
+
+            self.assertEqual(metrics.as_dict()["plugin_statistics"], {"counter": {"nodes": 2}})
+
+    def test_countElementsOnRequest(self):
+        config_file_path = Path(str(files("ecromedos"))) / "defaults" / "ecmds.conf"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = Path(tmpdir) / "doc.xml"
+            source_file.write_text("<article><p>One <b>two</b></p><p/></article>")
+
+            # not counted, unless metrics are written
+            for options, expected_elements in [({}, None), ({"count_elements": "yes"}, 4)]:
+                pipeline = ECMDSPipeline(config_file_path, "xhtml", False, tmpdir, {"cache_dir": "", **options})
+                pipeline.load(source_file, verbose=False)
+
+                self.assertEqual(pipeline.metrics.phases["read"].get("elements"), expected_elements)
+
+    def test_writeMetrics(self):
+        metrics = ECMDSMetrics(source_file="doc.xml")
+        with metrics.phase("read") as entry:
+            entry["elements"] = 1
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_metrics(Path(tmpdir) / "metrics.json", [metrics.as_dict()])
+            with open(Path(tmpdir) / "metrics.json", encoding="utf-8") as fp:
+                report = json.load(fp)
+
+        document = report["documents"][0]
+        self.assertEqual(document["source_file"], "doc.xml")
+        self.assertEqual(document["phases"]["read"]["elements"], 1)
+        self.assertGreaterEqual(document["phases"]["read"]["wall_s"], 0.0)
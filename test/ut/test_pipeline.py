@@ -0,0 +1,114 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from importlib.resources import files
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.error import ECMDSError
+from ecromedos.pipeline import render_formats
+
+CONFIG_FILE_PATH = Path(str(files("ecromedos"))) / "defaults" / "ecmds.conf"
+
+DOCUMENT = """\
+<!DOCTYPE article [<!ENTITY section SYSTEM "section.xml">]>
+<article lang="en_US" secsplitdepth="0">
+  <head><title>Test</title><author>Nobody</author></head>
+  &section;
+</article>
+"""
+
+SECTION = "<section><title>One</title><p>%s</p></section>"
+
+# takes the place of the data plugin, which handles the root element
+FAILING_PLUGIN = """\
+from ecromedos.error import ECMDSPluginError
+
+def getInstance(config):
+    return Plugin()
+
+class Plugin:
+    def process(self, node, format):
+        if format == "latex":
+            raise ECMDSPluginError("No LaTeX today.", "data")
+        return node
+
+    def flush(self):
+        pass
+"""
+
+
+class UTTestPipeline(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = Path(self._tmpdir.name)
+        self.source = self.tmpdir / "doc.xml"
+        self.source.write_text(DOCUMENT)
+        self.section = self.tmpdir / "section.xml"
+        self.section.write_text(SECTION % "First version")
+        self.output_dir = self.tmpdir / "out"
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def render(self, target_formats, config_file_path=CONFIG_FILE_PATH, **options):
+        return render_formats(
+            self.source,
+            target_formats,
+            output_dir=self.output_dir,
+            config_file_path=config_file_path,
+            validation_enabled=False,
+            xsl_parameters={},
+            options={"cache_dir": "", **options},
+            verbose=False,
+        )
+
+    def test_rebuildAllFormatsAfterEntityEdit(self):
+        self.render(["xhtml", "latex"], incremental="yes")
+
+        self.section.write_text(SECTION % "Second version")
+        reports = self.render(["xhtml", "latex"], incremental="yes")
+
+        for target_format in ["xhtml", "latex"]:
+            self.assertNotIn("up_to_date", reports[target_format])
+
+        self.assertIn("Second version", (self.output_dir / "xhtml" / "index.html").read_text())
+        self.assertIn("Second version", (self.output_dir / "latex" / "main.tex").read_text())
+
+    def test_renderEachFormatIntoItsDirectory(self):
+        reports = self.render(["xhtml", "latex"])
+
+        self.assertEqual(sorted(p.name for p in self.output_dir.iterdir()), ["latex", "xhtml"])
+        self.assertEqual([p.name for p in (self.output_dir / "latex").iterdir()], ["main.tex"])
+        self.assertTrue((self.output_dir / "xhtml" / "index.html").is_file())
+
+        for target_format in ["xhtml", "latex"]:
+            self.assertEqual(reports[target_format]["target_format"], target_format)
+            self.assertGreater(reports[target_format]["elapsed_s"], 0.0)
+
+    def test_reportFailureByFormat(self):
+        plugin_dir = self.tmpdir / "plugins"
+        shutil.copytree(CONFIG_FILE_PATH.parent.parent / "plugins", plugin_dir)
+        (plugin_dir / "data.py").write_text(FAILING_PLUGIN)
+
+        config_file_path = self.tmpdir / "ecmds.conf"
+        config = CONFIG_FILE_PATH.read_text().replace("$install_dir/plugins", str(plugin_dir))
+        config_file_path.write_text(config)
+
+        # LaTeX is rendered in a worker process first and in this process then
+        for target_formats in [["xhtml", "latex"], ["latex", "xhtml"]]:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+
+            with self.assertRaises(ECMDSError) as context:
+                self.render(target_formats, config_file_path=config_file_path)
+
+            self.assertEqual(context.exception.msg(), "latex: Plugin data caused an exception: No LaTeX today.")
+
+            # the other format is still rendered
+            self.assertTrue((self.output_dir / "xhtml" / "index.html").is_file())
+            self.assertFalse((self.output_dir / "latex" / "main.tex").exists())
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 import unittest
 
 import lxml.etree as etree
@@ -40,3 +41,171 @@ int main(int argc, char *argv[])
         result = etree.tostring(tree, encoding="utf-8", method="xml")
 
         self.assertEqual(result, expected_result)
+
+    def test_formatMarkup(self):
+        from pygments.lexers import get_lexer_by_name
+        from pygments.style import Style
+        from pygments.token import Comment, Keyword
+
+        from ecromedos.highlight.formatter import ECMLPygmentsFormatter
+
+        class TestStyle(Style):
+            background_color = "#FFFFFF"
+            styles = {Keyword: "bold #0000FF", Comment: "italic underline #888"}
+
+        code = "if a < b: # a & b\r\n    pass\n"
+
+        for output_format, line_numbers, expected_result in [
+            (
+                "xhtml",
+                False,
+                b'<code bgcolor="#ffffff"><color rgb="#0000ff"><b>if</b></color> a &lt; b: '
+                b'<color rgb="#888888"><u><i># a &amp; b</i></u></color>\n    '
+                b'<color rgb="#0000ff"><b>pass</b></color>\n</code>',
+            ),
+            (
+                "latex",
+                True,
+                b'<code bgcolor="#ffffff"><b>0005</b> <color rgb="#0000ff"><b>if</b></color> a &lt; b: '
+                b'<color rgb="#888888"><u><i># a &amp; b</i></u></color>\n<b>0007</b>     '
+                b'<color rgb="#0000ff"><b>pass</b></color>\n</code>',
+            ),
+        ]:
+            formatter = ECMLPygmentsFormatter(
+                emit_line_numbers=line_numbers,
+                startline=5,
+                line_step=2,
+                style=TestStyle,
+                output_format=output_format,
+            )
+            markup = formatter.format_markup(get_lexer_by_name("python").get_tokens(code))
+            self.assertEqual(etree.tostring(etree.fromstring(markup)), expected_result)
+
+    def test_reuseLexersAndStyles(self):
+        root = etree.fromstring(
+            '<root><code syntax="python">a = 1</code><code syntax="python">b = 2</code>'
+            '<code syntax="c" colorscheme="emacs">int c;</code></root>'
+        )
+
+        plugin = highlight.getInstance({})
+
+        import ecromedos.highlight.highlighter as highlighter
+
+        looked_up = []
+        get_lexer_by_name = highlighter.get_lexer_by_name
+
+        def lookup(syntax):
+            looked_up.append(syntax)
+            return get_lexer_by_name(syntax)
+
+        highlighter.get_lexer_by_name = lookup
+        try:
+            for node in root.findall("./code"):
+                plugin.process(node, "xhtml")
+        finally:
+            highlighter.get_lexer_by_name = get_lexer_by_name
+
+        self.assertEqual(looked_up, ["python", "c"])
+        self.assertEqual(len(plugin._Plugin__highlighter._ECMDSHighlighter__styles), 2)
+
+        with self.assertRaises(ECMDSPluginError):
+            plugin.process(etree.SubElement(root, "code", syntax="no-such-language"), "xhtml")
+
+    def test_restoreListingFromCache(self):
+        code = '<root><code syntax="python" bgcolor="#123456">a = 1</code></root>'
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = {"cache_dir": tmpdir, "highlight_cache": "yes"}
+
+            root = etree.fromstring(code)
+            highlight.getInstance(config).process(root.find("./code"), "xhtml")
+            expected_result = etree.tostring(root)
+
+            for version, expected_lexed in [(None, []), (["0.0", None], ["python"])]:
+                plugin = highlight.getInstance(config)
+                lexed = []
+                get_lexer = plugin._Plugin__highlighter.get_lexer
+
+                def lookup(syntax):
+                    lexed.append(syntax)
+                    return get_lexer(syntax)
+
+                plugin._Plugin__highlighter.get_lexer = lookup
+                if version is not None:
+                    # as after an update of Pygments
+                    plugin._Plugin__version = version
+
+                root = etree.fromstring(code)
+                plugin.process(root.find("./code"), "xhtml")
+
+                self.assertEqual(etree.tostring(root), expected_result)
+                self.assertEqual(lexed, expected_lexed)
+
+    def test_highlightInParallel(self):
+        listings = "".join(
+            f'<code syntax="{"c" if i % 2 else "python"}" startline="{i}">x = {i}</code>'
+            for i in range(highlight.MIN_PARALLEL_LISTINGS)
+        )
+        code = f'<root>{listings}\n<code syntax="nosuchsyntax">x</code></root>'
+
+        serial = etree.fromstring(code)
+        plugin = highlight.getInstance({"highlight_workers": "1"})
+        for node in serial.findall("./code")[:-1]:
+            plugin.process(node, "latex")
+
+        root = etree.fromstring(code)
+        plugin = highlight.getInstance({"highlight_workers": "2"})
+        plugin.prepare(root, "latex")
+
+        self.assertEqual(len(plugin._Plugin__prepared), highlight.MIN_PARALLEL_LISTINGS + 1)
+
+        # process() must not highlight again
+        plugin._Plugin__highlighter.highlight = None
+
+        nodes = root.findall("./code")
+        for node in nodes[:-1]:
+            plugin.process(node, "latex")
+
+        self.assertEqual(
+            [etree.tostring(node) for node in root.findall("./code")[:-1]],
+            [etree.tostring(node) for node in serial.findall("./code")[:-1]],
+        )
+
+        with self.assertRaises(ECMDSPluginError) as context:
+            plugin.process(nodes[-1], "latex")
+        self.assertIn("in 'code' tag on line 2", context.exception.msg())
+
+    def test_readCachedListingsOnce(self):
+        listings = "".join(
+            f'<code syntax="python" startline="{i}">x = {i}</code>' for i in range(highlight.MIN_PARALLEL_LISTINGS)
+        )
+        code = f"<root>{listings}</root>"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = {"cache_dir": tmpdir, "highlight_cache": "yes", "highlight_workers": "2"}
+
+            root = etree.fromstring(code)
+            plugin = highlight.getInstance(config)
+            for node in root.findall("./code"):
+                plugin.process(node, "xhtml")
+            expected_result = etree.tostring(root)
+
+            plugin = highlight.getInstance(config)
+            cache = plugin._Plugin__caches[0]
+            reads = []
+            get = cache.get
+
+            def read(namespace, key):
+                reads.append(key)
+                return get(namespace, key)
+
+            cache.get = read
+
+            root = etree.fromstring(code)
+            plugin.prepare(root, "xhtml")
+            for node in root.findall("./code"):
+                plugin.process(node, "xhtml")
+
+            self.assertEqual(etree.tostring(root), expected_result)
+            self.assertEqual(len(reads), highlight.MIN_PARALLEL_LISTINGS)
+            self.assertEqual(len(set(reads)), len(reads))
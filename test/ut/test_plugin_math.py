@@ -1,7 +1,10 @@
+import contextlib
 import os
+import shutil
 import sys
 import tempfile
 import unittest
+from pathlib import Path
 
 import lxml.etree as etree
 
@@ -10,6 +13,7 @@ ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpa
 sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
 
 import ecromedos.plugins.math as math
+from ecromedos.diskcache import ECMDSDiskCache
 from ecromedos.error import ECMDSPluginError
 
 
@@ -43,3 +47,214 @@ class UTTestPluginMath(unittest.TestCase):
         expected_result = b'<root><copy><img src="m000001.gif" alt="formula" class="math" style="vertical-align: -1px;"/></copy></root>'
         self.assertEqual(result, expected_result)
         os.unlink("m000001.gif")
+
+    def test_restoreFormulaFromCache(self):
+        root = etree.fromstring("<root><m>a^2</m></root>")
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            config = {"tmp_dir": tmpdir, "cache_dir": tmpdir, "math_cache": "yes", "dvipng_dpi": "100"}
+            plugin = math.getInstance(config)
+
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "math"))
+            cache.put("math", plugin._formula_key("a^2"), b"3px\nGIF89a")
+
+            # no LaTeX run needed
+            plugin.process(root.find("./m"), "xhtml")
+            plugin.flush()
+
+            with open("m000001.gif", "rb") as f:
+                self.assertEqual(f.read(), b"GIF89a")
+
+        result = etree.tostring(root, encoding="utf-8", method="xml")
+        expected_result = (
+            b'<root><copy><img src="m000001.gif" alt="formula" class="math" '
+            b'style="vertical-align: -3px;"/></copy></root>'
+        )
+        self.assertEqual(result, expected_result)
+
+    def test_shareImageOfIdenticalFormulae(self):
+        root = etree.fromstring("<root><m>x</m><m>y</m><m>x</m></root>")
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            config = {"tmp_dir": tmpdir, "cache_dir": tmpdir, "math_cache": "yes"}
+            plugin = math.getInstance(config)
+
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "math"))
+            cache.put("math", plugin._formula_key("x"), b"1px\nX")
+            cache.put("math", plugin._formula_key("y"), b"2px\nY")
+
+            for node in root.findall("./m"):
+                plugin.process(node, "xhtml")
+            plugin.flush()
+
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["m000001.gif", "m000002.gif", "math"])
+
+        images = [(img.get("src"), img.get("style")) for img in root.iter("img")]
+        self.assertEqual(
+            images,
+            [
+                ("m000001.gif", "vertical-align: -1px;"),
+                ("m000002.gif", "vertical-align: -2px;"),
+                ("m000001.gif", "vertical-align: -1px;"),
+            ],
+        )
+        self.assertEqual(plugin.statistics, {"formulae": 3, "distinct": 2, "rendered": 0, "dedup_ratio": 1.5})
+
+    def test_mergeShardsInDocumentOrder(self):
+        root = etree.fromstring("<root>%s</root>" % "".join(f"<m>{i}</m>" for i in range(120)))
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            plugin = math.getInstance({"tmp_dir": tmpdir, "math_shards": "4"})
+
+            shard_sizes = []
+
+            def render_shard(nodes):
+                shard_sizes.append(len(nodes))
+                return [(f"{formula}px", formula.encode("ascii")) for _, formula in nodes]
+
+            plugin._render_shard = render_shard
+
+            for node in root.findall("./m"):
+                plugin.process(node, "xhtml")
+            plugin.flush()
+
+            # no shard smaller than the minimum
+            self.assertEqual(sorted(shard_sizes), [40, 40, 40])
+            self.assertEqual(plugin.statistics["shards"], 3)
+
+            for i, img in enumerate(root.iter("img")):
+                self.assertEqual(img.get("style"), f"vertical-align: -{i}px;")
+                with open(img.get("src"), "rb") as f:
+                    self.assertEqual(f.read(), str(i).encode("ascii"))
+
+    def test_detectRerun(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tex_file_path = Path(tmpdir) / "formulae.tex"
+            tex_file_path.with_suffix(".log").write_text("Output written on formulae.dvi (3 pages).\n")
+            tex_file_path.with_suffix(".aux").write_text("\\relax \n\\gdef \\@abspage@last{3}\n")
+
+            self.assertFalse(math.Plugin._needs_rerun(tex_file_path))
+
+            # data for the next pass
+            tex_file_path.with_suffix(".aux").write_text("\\relax \n\\newlabel{eq}{{1}{1}}\n")
+            self.assertTrue(math.Plugin._needs_rerun(tex_file_path))
+
+            # LaTeX asks for it
+            tex_file_path.with_suffix(".aux").write_text("\\relax \n")
+            tex_file_path.with_suffix(".log").write_text(
+                "LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\n"
+            )
+            self.assertTrue(math.Plugin._needs_rerun(tex_file_path))
+
+    def test_inlineSmallSVGs(self):
+        root = etree.fromstring("<root><p><m>x</m> and <m>x</m></p></root>")
+        svg = (
+            b'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+            b'<defs><path id="g0-1" d="M0 0"/></defs><use xlink:href="#g0-1"/></svg>'
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            config = {"tmp_dir": tmpdir, "cache_dir": tmpdir, "math_cache": "yes"}
+            config.update(math_output="svg", math_inline_size="1K")
+            plugin = math.getInstance(config)
+
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "math"))
+            cache.put("math", plugin._formula_key("x"), b"1.5pt\n" + svg)
+
+            for node in root.findall(".//m"):
+                plugin.process(node, "xhtml")
+            plugin.flush()
+
+            # nothing written
+            self.assertEqual(os.listdir(tmpdir), ["math"])
+
+        svg_nodes = root.findall(".//{http://www.w3.org/2000/svg}svg")
+        self.assertEqual(len(svg_nodes), 2)
+        self.assertEqual(root.find("./p/copy").tail, " and ")
+
+        ids = []
+        for svg_node in svg_nodes:
+            self.assertEqual(svg_node.get("style"), "vertical-align: -1.5pt;")
+            path = svg_node.find(".//{http://www.w3.org/2000/svg}path")
+            use = svg_node.find(".//{http://www.w3.org/2000/svg}use")
+            self.assertEqual(use.get("{http://www.w3.org/1999/xlink}href"), "#" + path.get("id"))
+            ids.append(path.get("id"))
+        self.assertEqual(len(set(ids)), 2)
+
+    def fake_latex(self, plugin, formats_built):
+        """Let @plugin run a LaTeX, which only pretends to build formats and
+        documents, and record the directories formats are built in."""
+
+        def run_latex(*args, cwd=None):
+            if "-version" in args:
+                return "pdfTeX 3.141592653\n"
+            if "-ini" in args:
+                formats_built.append(cwd)
+                (cwd / "preamble.fmt").write_bytes(b"format")
+            elif "-fmt=preamble" in args:
+                self.assertEqual((cwd / "preamble.fmt").read_bytes(), b"format")
+
+        plugin._run_latex = run_latex
+        plugin._dvi_to_gif = lambda dvi_file_path: [("0px", b"GIF")] * math.MIN_SHARD_SIZE
+
+    def render_formulae(self, plugin, num_formulae):
+        root = etree.fromstring("<root>%s</root>" % "".join(f"<m>{i}</m>" for i in range(num_formulae)))
+        for node in root.findall("./m"):
+            plugin.process(node, "xhtml")
+        plugin.flush()
+
+    def test_rebuildFormatAfterCleanup(self):
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            tmp_dir = Path(tmpdir) / "tmp"
+            tmp_dir.mkdir()
+
+            config = {"tmp_dir": tmp_dir, "math_preload_format": "yes", "math_shards": "2"}
+            plugin = math.getInstance(config)
+            formats_built = []
+            self.fake_latex(plugin, formats_built)
+
+            # two documents rendered by one pipeline, which cleans up in between
+            for _ in range(2):
+                self.render_formulae(plugin, 2 * math.MIN_SHARD_SIZE)
+
+                self.assertEqual(plugin.statistics["shards"], 2)
+                self.assertGreater(plugin.statistics["format_s"], 0.0)
+                for entry in tmp_dir.iterdir():
+                    shutil.rmtree(entry)
+
+            self.assertEqual(len(formats_built), 2)
+
+    def test_skipFormatForSingleShard(self):
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            plugin = math.getInstance({"tmp_dir": tmpdir, "math_preload_format": "yes", "math_shards": "2"})
+            formats_built = []
+            self.fake_latex(plugin, formats_built)
+
+            self.render_formulae(plugin, math.MIN_SHARD_SIZE)
+
+            self.assertEqual(plugin.statistics["shards"], 1)
+            self.assertEqual(plugin.statistics["format_s"], 0.0)
+            self.assertEqual(formats_built, [])
+
+    def test_keepFormatInCache(self):
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            tmp_dir = Path(tmpdir) / "tmp"
+            tmp_dir.mkdir()
+
+            config = {"tmp_dir": tmp_dir, "cache_dir": tmpdir, "math_cache": "yes"}
+            config.update(math_preload_format="yes", math_shards="2")
+            formats_built = []
+
+            # documents of two pipelines, the formulae aren't cached
+            for _ in range(2):
+                plugin = math.getInstance(config)
+                self.fake_latex(plugin, formats_built)
+                plugin._store_formula = lambda formula, depth, image: None
+
+                self.render_formulae(plugin, 2 * math.MIN_SHARD_SIZE)
+
+                for entry in tmp_dir.iterdir():
+                    shutil.rmtree(entry)
+
+            self.assertEqual(len(formats_built), 1)
+            self.assertEqual(plugin.statistics["format_s"], 0.0)
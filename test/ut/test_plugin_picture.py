@@ -1,7 +1,9 @@
+import contextlib
 import os
 import sys
 import tempfile
 import unittest
+from pathlib import Path
 
 import lxml.etree as etree
 
@@ -11,7 +13,9 @@ ECMDS_TEST_DATA_DIR = os.path.join(ECMDS_INSTALL_DIR, "test", "ut", "data", "plu
 
 sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
 
+import ecromedos.imageconvert as imageconvert
 import ecromedos.plugins.picture as picture
+from ecromedos.diskcache import ECMDSDiskCache
 from ecromedos.error import ECMDSPluginError
 
 
@@ -130,3 +134,181 @@ class UTTestPluginPicture(unittest.TestCase):
             plugin.flush()
 
         os.unlink("img000001.jpg")
+
+    def test_restoreImageFromCache(self):
+        tree = etree.parse(ECMDS_TEST_DATA_DIR + os.sep + "ecromedos_png.xml")
+        root = tree.getroot()
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            config = {
+                "convert_bin": "/nonexistent/convert",
+                "identify_bin": "/nonexistent/identify",
+                "tmp_dir": tmpdir,
+                "cache_dir": tmpdir,
+                "picture_cache": "yes",
+            }
+
+            plugin = picture.getInstance(config)
+            src = plugin._get_image_source_path(root.find("./img"))
+
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "picture"))
+            cache.put("picture", plugin._image_key(plugin._convert_image, src, "img000001.eps"), b"%!PS")
+
+            # no conversion needed
+            plugin.process(root.find("./img"), "latex")
+            plugin.flush()
+
+            self.assertEqual(root.find("./img").get("src"), "img000001.eps")
+            with open("img000001.eps", "rb") as f:
+                self.assertEqual(f.read(), b"%!PS")
+
+    def test_reportFileErrorsWithLine(self):
+        tree = etree.parse(ECMDS_TEST_DATA_DIR + os.sep + "ecromedos_png.xml")
+        node = tree.getroot().find("./img")
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            config = {"tmp_dir": tmpdir, "cache_dir": tmpdir, "picture_cache": "yes"}
+
+            plugin = picture.getInstance(config)
+            src = plugin._get_image_source_path(node)
+
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "picture"))
+            cache.put("picture", plugin._image_key(plugin._convert_image, src, "img000001.eps"), b"%!PS")
+
+            # in the way of the restored file
+            os.mkdir("img000001.eps")
+
+            plugin.process(node, "latex")
+            with self.assertRaises(ECMDSPluginError) as context:
+                plugin.flush()
+
+            self.assertTrue(context.exception.msg().startswith("Could not write image file:"))
+            self.assertTrue(context.exception.msg().endswith(f"in 'img' tag on line {node.sourceline}."))
+
+    def test_convertOnFlush(self):
+        root = etree.fromstring('<root><img src="a.png"/>\n<img src="b.png"/>\n<img src="a.png"/></root>')
+        converted = []
+
+        def _convert_image(src, dst, width=None):
+            converted.append((src.name, dst))
+            if src.name == "b.png":
+                raise ECMDSPluginError(f"Could not convert graphics file {src}.", "picture")
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            for name in ["a.png", "b.png"]:
+                with open(name, "wb") as f:
+                    f.write(b"PNG")
+            root.getroottree().docinfo.URL = os.path.join(tmpdir, "doc.xml")
+
+            plugin = picture.getInstance({"tmp_dir": tmpdir, "cache_dir": "", "picture_workers": "2"})
+            plugin._convert_image = _convert_image
+
+            for node in root.findall("./img"):
+                plugin.process(node, "latex")
+
+            # only names assigned so far
+            self.assertEqual(converted, [])
+            self.assertEqual([node.get("src") for node in root], ["img000001.eps", "img000002.eps", "img000001.eps"])
+
+            with self.assertRaises(ECMDSPluginError) as context:
+                plugin.flush()
+
+        self.assertIn(("a.png", "img000001.eps"), converted)
+        self.assertTrue(context.exception.msg().endswith("as specified in 'img' tag on line 2."))
+
+    def test_readWidthFromHeader(self):
+        src = os.path.join(ECMDS_TEST_DATA_DIR, "ecromedos.png")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            plugin = picture.getInstance({"tmp_dir": tmpdir, "cache_dir": ""})
+
+            def _identify_width(src):
+                raise AssertionError("identify was run")
+
+            plugin._identify_width = _identify_width
+            self.assertEqual(plugin._image_width(Path(src)), "320")
+
+    def test_selectBackend(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            plugin = picture.getInstance({"tmp_dir": tmpdir, "picture_backend": "auto"})
+            self.assertEqual(plugin._pillow is not None, imageconvert.pillow_available())
+
+            with self.assertRaises(ECMDSPluginError):
+                picture.getInstance({"tmp_dir": tmpdir, "picture_backend": "gimp"})
+
+            if not imageconvert.pillow_available():
+                with self.assertRaises(ECMDSPluginError) as context:
+                    picture.getInstance({"tmp_dir": tmpdir, "picture_backend": "pillow"})
+                self.assertIn("ecromedos[pillow]", context.exception.msg())
+
+    @unittest.skipUnless(imageconvert.pillow_available(), "requires Pillow")
+    def test_convertWithPillow(self):
+        from PIL import Image
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, "in.png")
+            Image.new("RGBA", (100, 50), (255, 0, 0, 0)).save(src)
+
+            plugin = picture.getInstance({"tmp_dir": tmpdir, "picture_backend": "pillow"})
+            plugin._run_convert = None
+
+            dst = os.path.join(tmpdir, "out.jpg")
+            plugin._convert_image(src, dst, "40")
+
+            with Image.open(dst) as image:
+                self.assertEqual((image.format, image.size), ("JPEG", (40, 20)))
+                # transparency becomes white
+                self.assertGreater(min(image.getpixel((20, 10))), 250)
+
+    def test_scaleVariantsFromOneDecode(self):
+        src = os.path.join(ECMDS_TEST_DATA_DIR, "ecromedos.png")
+        root = etree.fromstring(
+            f'<root><img src="{src}" screen-width="100px"/><img src="{src}" screen-width="200px"/>'
+            f'<img src="{src}"/></root>'
+        )
+        calls = []
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            plugin = picture.getInstance({"tmp_dir": tmpdir, "cache_dir": "", "picture_srcset": "2x"})
+            plugin._convert_variants = lambda src, variants: calls.append((src.name, variants))
+
+            for node in root.findall("./img"):
+                plugin.process(node, "xhtml")
+            plugin.flush()
+
+        self.assertEqual(
+            calls,
+            [("ecromedos.png", [("img000001.jpg", "100"), ("img000001-2x.jpg", "200"), ("img000003.jpg", "320")])],
+        )
+
+        # the 2x variant of the first image doubles as the second, the third
+        # is not upscaled
+        self.assertEqual(
+            [(node.get("src"), node.get("srcset")) for node in root],
+            [
+                ("img000001.jpg", "img000001.jpg 1x, img000001-2x.jpg 2x"),
+                ("img000001-2x.jpg", None),
+                ("img000003.jpg", None),
+            ],
+        )
+
+    def test_convertMissingVariantsOnly(self):
+        src = os.path.join(ECMDS_TEST_DATA_DIR, "ecromedos.png")
+        root = etree.fromstring(f'<root><img src="{src}" screen-width="100px"/></root>')
+        calls = []
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+            config = {"tmp_dir": tmpdir, "cache_dir": tmpdir, "picture_cache": "yes", "picture_srcset": "2x"}
+            plugin = picture.getInstance(config)
+            plugin._convert_variants = lambda src, variants: calls.append(variants)
+
+            cache = ECMDSDiskCache(os.path.join(tmpdir, "picture"))
+            cache.put("picture", plugin._image_key(plugin._convert_image, Path(src), "img000001.jpg", "100"), b"JPEG")
+
+            plugin.process(root.find("./img"), "xhtml")
+            plugin.flush()
+
+            with open("img000001.jpg", "rb") as f:
+                self.assertEqual(f.read(), b"JPEG")
+
+        self.assertEqual(calls, [[("img000001-2x.jpg", "200")]])
@@ -0,0 +1,120 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import lxml.etree as etree
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.preprocessor import ECMDSPreprocessor
+
+RECORDING_PLUGIN = """\
+import lxml.etree as etree
+
+visited = []
+
+def getInstance(config):
+    return Plugin()
+
+class Plugin:
+    def process(self, node, format):
+        visited.append(node if isinstance(node, str) else node.get("id"))
+        if node.get("mark") == "final":
+            node.attrib["final"] = "yes"
+        elif node.get("mark") == "copy":
+            node.tag = "copy"
+        elif node.get("mark") == "grow":
+            etree.SubElement(node, "q", id="q1")
+        return node
+
+    def flush(self):
+        pass
+"""
+
+TEXT_PLUGIN = """\
+import sys
+
+def getInstance(config):
+    return Plugin()
+
+class Plugin:
+    def accepts(self, format):
+        return format == "latex"
+
+    def process(self, string, format):
+        sys.modules["recorder"].visited.append(string)
+        return string
+
+    def flush(self):
+        pass
+"""
+
+PREPARING_PLUGIN = """\
+import sys
+
+def getInstance(config):
+    return Plugin()
+
+class Plugin:
+    def prepare(self, root, format):
+        sys.modules["recorder"].visited.append("prepare " + root.get("id"))
+
+    def process(self, node, format):
+        return node
+
+    def flush(self):
+        pass
+"""
+
+DOCUMENT = """\
+<book id="book">
+  <chapter id="c1">
+    <p id="p1">One <b id="b1">two</b></p>
+    <x><p id="p2" mark="final"><p id="p3"/></p></x>
+    <p id="p4" mark="copy"><p id="p5"/></p>
+  </chapter>
+  <chapter id="c2" mark="grow"><x><x><p id="p6"/></x></x><p id="p7"/></chapter>
+</book>
+"""
+
+
+class UTTestPreprocessor(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        (Path(self._tmpdir.name) / "recorder.py").write_text(RECORDING_PLUGIN)
+        (Path(self._tmpdir.name) / "texter.py").write_text(TEXT_PLUGIN)
+        (Path(self._tmpdir.name) / "preparer.py").write_text(PREPARING_PLUGIN)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def visit(self, plugins_map, format):
+        preprocessor = ECMDSPreprocessor(configuration={"plugin_dir": self._tmpdir.name}, plugins_map=plugins_map)
+        document = etree.ElementTree(etree.fromstring(DOCUMENT))
+        preprocessor.prepareDocument(document, format, verbose=False)
+        return [v for v in sys.modules["recorder"].visited if v and v.strip()]
+
+    def test_visitTaggedElementsInOrder(self):
+        plugins_map = {"book": ["recorder"], "chapter": ["recorder"], "p": ["recorder"], "q": ["recorder"]}
+
+        # q elements are added by the plugin
+        visited = self.visit(plugins_map, "latex")
+        self.assertEqual(visited, ["book", "c1", "p1", "p2", "p4", "c2", "p6", "p7", "q1"])
+
+    def test_sameOrderWithTextPlugin(self):
+        plugins_map = {"@text": ["texter"], "p": ["recorder"], "b": ["recorder"]}
+
+        # the text plugin applies to latex only
+        self.assertEqual(self.visit(plugins_map, "xhtml"), ["p1", "b1", "p2", "p4", "p6", "p7"])
+        self.assertEqual(self.visit(plugins_map, "latex"), ["p1", "One ", "b1", "two", "p2", "p4", "p6", "p7"])
+
+    def test_prepareBeforeWalk(self):
+        # registered for two tags, prepared once
+        plugins_map = {"chapter": ["preparer", "recorder"], "p": ["recorder", "preparer"]}
+
+        visited = self.visit(plugins_map, "latex")
+        self.assertEqual(visited, ["prepare book", "c1", "p1", "p2", "p4", "c2", "p6", "p7"])
@@ -0,0 +1,155 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from importlib.resources import files
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.error import ECMDSError, ECMDSServerUnavailable
+from ecromedos.server import ECMDSRenderServer, submit_job
+
+CONFIG_FILE_PATH = Path(str(files("ecromedos"))) / "defaults" / "ecmds.conf"
+
+DOCUMENT = """\
+<article lang="en_US" secsplitdepth="0">
+  <head><title>Test</title><author>Nobody</author></head>
+  <section><title>One</title><p>Served</p></section>
+</article>
+"""
+
+
+class UTTestServer(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = Path(self._tmpdir.name)
+        self.source = self.tmpdir / "doc.xml"
+        self.source.write_text(DOCUMENT)
+        self.socket_path = self.tmpdir / "ecmds.sock"
+
+        # the server reports every job
+        self._stdout = contextlib.redirect_stdout(io.StringIO())
+        self._stdout.__enter__()
+
+        self.server = ECMDSRenderServer(
+            self.socket_path, CONFIG_FILE_PATH, validation_enabled=False, options={"cache_dir": ""}
+        )
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self._thread.join()
+        self.server.server_close()
+        self._stdout.__exit__(None, None, None)
+        self._tmpdir.cleanup()
+
+    def exchange(self, *lines):
+        """Send @lines over one connection, return the decoded responses."""
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self.socket_path))
+            with sock.makefile("rwb") as stream:
+                stream.write(b"".join(line + b"\n" for line in lines))
+                stream.flush()
+                sock.shutdown(socket.SHUT_WR)
+                return [json.loads(line) for line in stream]
+
+    def test_answerEachRequestLine(self):
+        (self.tmpdir / "out").mkdir()
+        job = {"source_file": str(self.source), "output_dir": str(self.tmpdir / "out"), "format": "xhtml"}
+
+        responses = self.exchange(
+            json.dumps(job).encode("utf-8"),
+            b"",
+            b"{not json",
+            json.dumps({"format": "xhtml"}).encode("utf-8"),
+            json.dumps({**job, "format": "troff"}).encode("utf-8"),
+        )
+
+        # blank lines are skipped
+        self.assertEqual([r["status"] for r in responses], ["ok", "error", "error", "error"])
+        self.assertEqual(responses[0]["metrics"]["target_format"], "xhtml")
+        self.assertTrue(responses[1]["message"].startswith("Malformed request:"))
+        self.assertEqual(responses[2]["message"], "Missing 'source_file' in request.")
+        self.assertEqual(responses[3]["message"], "Unknown output format 'troff'.")
+        self.assertIn("Served", (self.tmpdir / "out" / "index.html").read_text())
+
+    def test_reportErrors(self):
+        with self.assertRaises(ECMDSError) as context:
+            submit_job(self.socket_path, self.tmpdir / "missing.xml", output_dir=self.tmpdir, target_format="xhtml")
+
+        self.assertNotIsInstance(context.exception, ECMDSServerUnavailable)
+        self.assertIn("missing.xml", context.exception.msg())
+
+    def test_reuseWarmPipeline(self):
+        pipelines = []
+
+        for name in ["one", "two"]:
+            (self.tmpdir / name).mkdir()
+            result = submit_job(self.socket_path, self.source, output_dir=self.tmpdir / name, target_format="latex")
+            self.assertEqual(result["status"], "ok")
+            self.assertTrue((self.tmpdir / name / "main.tex").is_file())
+            pipelines.append(self.server.get_pipeline("latex"))
+
+        self.assertIs(pipelines[0], pipelines[1])
+        self.assertEqual(list(self.server._pipelines), ["latex"])
+
+    def test_renderWithoutServer(self):
+        socket_path = self.tmpdir / "nobody.sock"
+
+        with self.assertRaises(ECMDSServerUnavailable):
+            submit_job(socket_path, self.source)
+
+        # the command line client renders the document itself
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from ecromedos.ecromedos import main; main()",
+                "--server",
+                str(socket_path),
+                "--no-validate",
+                "-f",
+                "xhtml",
+                str(self.source),
+            ],
+            cwd=self.tmpdir,
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path), "XDG_CACHE_HOME": str(self.tmpdir / "cache")},
+            capture_output=True,
+            text=True,
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("No render server is listening", result.stderr)
+        self.assertIn("Served", (self.tmpdir / "index.html").read_text())
+
+    def test_refuseSecondServer(self):
+        with self.assertRaises(ECMDSError) as context:
+            ECMDSRenderServer(self.socket_path, CONFIG_FILE_PATH)
+
+        self.assertIn("already listening", context.exception.msg())
+
+        # the first server is still reachable
+        self.assertEqual([r["status"] for r in self.exchange(b"{}")], ["error"])
+
+    def test_replaceStaleSocket(self):
+        socket_path = self.tmpdir / "stale.sock"
+
+        # left behind by a server that died
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(str(socket_path))
+        self.assertTrue(socket_path.is_socket())
+
+        server = ECMDSRenderServer(socket_path, CONFIG_FILE_PATH)
+        server.server_close()
+        self.assertFalse(socket_path.exists())
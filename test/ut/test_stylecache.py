@@ -0,0 +1,41 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.argumentparser import ECMDS_INSTALL_DIR as ECMDS_PACKAGE_DIR
+from ecromedos.stylecache import ECMDSStylesheetCache
+
+
+class UTTestStylesheetCache(unittest.TestCase):
+    def test_reuseCompiledStylesheet(self):
+        cache = ECMDSStylesheetCache()
+        style_dir = ECMDS_PACKAGE_DIR / "xslt"
+
+        first = cache.load(style_dir, "xelatex")
+        second = cache.load(style_dir, "xelatex")
+
+        self.assertIs(first, second)
+
+    def test_recompileWhenIncludedFileChanges(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            style_dir = Path(tmpdir) / "xslt"
+            shutil.copytree(ECMDS_PACKAGE_DIR / "xslt", style_dir)
+
+            cache = ECMDSStylesheetCache()
+            first = cache.load(style_dir, "xelatex")
+
+            # touch a file only reachable through xsl:import and xsl:include
+            included = style_dir / "latex" / "section.xsl"
+            st = included.stat()
+            os.utime(included, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+            second = cache.load(style_dir, "xelatex")
+
+        self.assertIsNot(first, second)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import lxml.etree as etree
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.argumentparser import ECMDS_INSTALL_DIR as ECMDS_PACKAGE_DIR
+from ecromedos.validation import ECMDSValidationCache, load_dtd
+
+STYLE_DIR = ECMDS_PACKAGE_DIR / "xslt"
+
+
+class UTTestValidation(unittest.TestCase):
+    def test_reuseLoadedDTD(self):
+        self.assertIs(load_dtd(STYLE_DIR), load_dtd(STYLE_DIR))
+
+    def test_rememberValidatedDocuments(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            source_file = tmpdir / "doc.xml"
+            source_file.write_text("<article><p>Hello</p></article>")
+
+            dtd = load_dtd(STYLE_DIR)
+            digest = ECMDSValidationCache(tmpdir / "cache").digest(etree.parse(str(source_file)), dtd)
+            ECMDSValidationCache(tmpdir / "cache").add(digest)
+
+            self.assertIn(digest, ECMDSValidationCache(tmpdir / "cache"))
+
+            source_file.write_text("<article><p>Bye</p></article>")
+            new_digest = ECMDSValidationCache(tmpdir / "cache").digest(etree.parse(str(source_file)), dtd)
+            self.assertNotIn(new_digest, ECMDSValidationCache(tmpdir / "cache"))
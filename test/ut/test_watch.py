@@ -0,0 +1,201 @@
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from importlib.resources import files
+from pathlib import Path
+
+ECMDS_INSTALL_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", ".."))
+
+ECMDS_TEST_DATA_DIR = os.path.join(ECMDS_INSTALL_DIR, "test", "ut", "data", "plugin_picture")
+
+sys.path.insert(1, ECMDS_INSTALL_DIR + os.sep + "lib")
+
+from ecromedos.pipeline import ECMDSPipeline
+from ecromedos.watch import ECMDSWatcher
+
+CONFIG_FILE_PATH = Path(str(files("ecromedos"))) / "defaults" / "ecmds.conf"
+
+DOCUMENT = """\
+<!DOCTYPE article [<!ENTITY section SYSTEM "section.xml">]>
+<article lang="en_US" secsplitdepth="0">
+  <head><title>Test</title><author>Nobody</author></head>
+  &section;
+</article>
+"""
+
+SECTION = '<section><title>One</title><figure><img src="ecromedos.png"/></figure></section>'
+
+
+class _Stop(Exception):
+    pass
+
+
+class UTTestWatch(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = Path(self._tmpdir.name)
+        self.source = self.tmpdir / "doc.xml"
+        self.source.write_text(DOCUMENT)
+        self.section = self.tmpdir / "section.xml"
+        self.section.write_text(SECTION)
+        self.image = self.tmpdir / "ecromedos.png"
+        shutil.copyfile(os.path.join(ECMDS_TEST_DATA_DIR, "ecromedos.png"), self.image)
+        self.output_dir = self.tmpdir / "out"
+        self.output_dir.mkdir()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def watcher(self):
+        return ECMDSWatcher(
+            self.source,
+            config_file_path=CONFIG_FILE_PATH,
+            target_format="xhtml",
+            validation_enabled=False,
+            output_dir=self.output_dir,
+            options={"cache_dir": ""},
+        )
+
+    def touch(self, file_path, mtime_s):
+        os.utime(file_path, ns=(mtime_s * 10**9, mtime_s * 10**9))
+
+    def test_watchDocumentSources(self):
+        pipeline = ECMDSPipeline(CONFIG_FILE_PATH, "xhtml", False, self.output_dir, options={"cache_dir": ""})
+        document = pipeline.load(self.source, verbose=False)
+
+        dependencies = self.watcher()._find_dependencies(document)
+        self.assertEqual(dependencies, [self.source, self.section, self.image])
+
+    def test_debounceBurstOfChanges(self):
+        watcher = self.watcher()
+        watcher._dependencies = [self.source, self.section, self.image]
+
+        for file_path in watcher._dependencies:
+            self.touch(file_path, 1000)
+        snapshot = watcher.snapshot()
+
+        # a save after two polls, two more while waiting for things to settle
+        edits = {2: self.source, 3: self.section, 4: self.source}
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if file_path := edits.get(len(sleeps)):
+                self.touch(file_path, 1000 + len(sleeps))
+
+        watcher._sleep = sleep
+        changed = watcher.wait_for_change(snapshot)
+
+        self.assertEqual(sorted(changed), ["doc.xml", "section.xml"])
+        self.assertEqual(sleeps, [0.25, 0.25, 0.2, 0.2, 0.2])
+
+    def test_rebuildOnChange(self):
+        watcher = self.watcher()
+        watcher._dependencies = [self.source]
+        self.touch(self.source, 1000)
+
+        builds = []
+
+        def build(tmp_dir):
+            builds.append(tmp_dir)
+            if len(builds) == 2:
+                raise _Stop()
+            return True
+
+        def sleep(seconds):
+            self.touch(self.source, 2000)
+
+        watcher.build = build
+        watcher._sleep = sleep
+
+        with contextlib.redirect_stdout(io.StringIO()) as output, self.assertRaises(_Stop):
+            watcher.run()
+
+        self.assertEqual(len(builds), 2)
+        self.assertIn(" * Changed: doc.xml", output.getvalue())
+
+    def test_pollStylesheetClosure(self):
+        style_dir = self.tmpdir / "xslt"
+        shutil.copytree(CONFIG_FILE_PATH.parent.parent / "xslt", style_dir)
+
+        config_file_path = self.tmpdir / "ecmds.conf"
+        config = CONFIG_FILE_PATH.read_text().replace("$base_dir/xslt", str(style_dir))
+        config_file_path.write_text(config)
+
+        def make_pipeline():
+            return ECMDSPipeline(config_file_path, "xhtml", False, self.output_dir, options={"cache_dir": ""})
+
+        pipeline = make_pipeline()
+
+        # not used for XHTML
+        self.touch(style_dir / "latex" / "ecmds.xsl", 1000)
+        self.assertFalse(pipeline.is_stale())
+
+        # included by the XHTML stylesheet and read by it
+        for file_path in [style_dir / "xhtml" / "table.xsl", style_dir / "i18n" / "german.xml"]:
+            pipeline = make_pipeline()
+            self.touch(file_path, 1000)
+            self.assertTrue(pipeline.is_stale())
+
+    def test_rebuildAfterConfigFix(self):
+        config_file_path = self.tmpdir / "ecmds.conf"
+        config_file_path.write_text("this is not a setting\n")
+        self.touch(config_file_path, 1000)
+
+        watcher = self.watcher()
+        watcher._config_file_path = config_file_path
+        watcher._dependencies = [self.source]
+
+        with contextlib.redirect_stderr(io.StringIO()) as output:
+            self.assertFalse(watcher.build(self.tmpdir / "tmp"))
+        self.assertIn("configuration file", output.getvalue())
+
+        snapshot = watcher.snapshot()
+
+        def sleep(seconds):
+            config_file_path.write_text(CONFIG_FILE_PATH.read_text())
+            self.touch(config_file_path, 2000)
+
+        watcher._sleep = sleep
+        self.assertEqual(watcher.wait_for_change(snapshot), ["ecmds.conf"])
+
+    def test_writeIntoOutputDir(self):
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path), "XDG_CACHE_HOME": str(self.tmpdir / "cache")}
+        index_file = self.tmpdir / "html" / "index.html"
+
+        # needs no image converter
+        self.section.write_text("<section><title>One</title><p>Watched</p></section>")
+
+        with subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from ecromedos.ecromedos import main; main()",
+                "--watch",
+                "--no-validate",
+                "-f",
+                "xhtml",
+                "-o",
+                "html",
+                str(self.source),
+            ],
+            cwd=self.tmpdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ) as proc:
+            try:
+                deadline = time.monotonic() + 60
+                while not index_file.is_file() and proc.poll() is None and time.monotonic() < deadline:
+                    time.sleep(0.1)
+            finally:
+                proc.kill()
+
+        self.assertIn("Watched", index_file.read_text())
+        self.assertFalse((self.tmpdir / "index.html").exists())